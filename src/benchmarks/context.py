@@ -0,0 +1,17 @@
+import glfw
+
+
+def create_context(width: int = 64, height: int = 64):
+    # hidden window, benchmarks only need a current GL 4.4 core context
+    if not glfw.init():
+        raise Exception("Failed to initialize GLFW")
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 4)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 4)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    window = glfw.create_window(width, height, "benchmark", None, None)
+    if not window:
+        glfw.terminate()
+        raise Exception("Failed to create GLFW window")
+    glfw.make_context_current(window)
+    return window
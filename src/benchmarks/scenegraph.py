@@ -0,0 +1,89 @@
+# World transform propagation through a 100k node tree where 1% of the nodes
+# move every frame: the dirty subtree update of TransformStore against
+# recomputing every node, and against walking the tree with glm per node.
+# Needs no GL context.
+#
+#   cd src && python -m benchmarks.scenegraph
+import time
+import glm
+import numpy as np
+
+from modules.transforms import TransformStore, Transform
+
+
+def build_tree(store: TransformStore, nodes: int, branching: int) -> list[Transform]:
+    rng = np.random.default_rng(0)
+    tree = []
+    for i in range(nodes):
+        node = Transform(store)
+        if i > 0:
+            node.parent = tree[(i - 1) // branching]
+        node.position = glm.vec3(*rng.uniform(-1, 1, 3))
+        node.scale = glm.vec3(0.9)
+        tree.append(node)
+    store.update()
+    return tree
+
+
+def move(store: TransformStore, rows: np.ndarray, frame: int):
+    # what an animation system writes: new local components, rows marked dirty
+    store.position[rows, 1] = np.sin(frame * 0.1 + rows)
+    store.dirty[rows] = True
+    store.pending = True
+
+
+def glm_walk(tree: list[Transform], store: TransformStore, children: list[list[int]]):
+    # per node recursion the flat object list would need done by hand
+    stack = [(0, glm.mat4(1))]
+    while stack:
+        index, parent_matrix = stack.pop()
+        row = tree[index].row
+        local = glm.translate(glm.mat4(1), glm.vec3(*store.position[row])) * glm.scale(glm.mat4(1), glm.vec3(*store.scale[row]))
+        world = parent_matrix * local
+        stack.extend((child, world) for child in children[index])
+
+
+def measure(function, frames: int) -> float:
+    start = time.perf_counter()
+    for frame in range(frames):
+        function(frame)
+    return (time.perf_counter() - start) / frames
+
+
+def run(nodes: int = 100_000, branching: int = 8, moving: float = 0.01, frames: int = 20):
+    store = TransformStore(nodes)
+    tree = build_tree(store, nodes, branching)
+    rng = np.random.default_rng(1)
+    rows = np.array([node.row for node in tree])
+
+    def dirty_update(frame):
+        move(store, rng.choice(rows, int(nodes * moving), replace=False), frame)
+        store.update()
+
+    def full_update(frame):
+        move(store, rows, frame)
+        store.update()
+
+    updated = []
+    def counted_update(frame):
+        move(store, rng.choice(rows, int(nodes * moving), replace=False), frame)
+        updated.append(store.update())
+
+    dirty = measure(dirty_update, frames)
+    full = measure(full_update, frames)
+    measure(counted_update, frames)
+
+    children = [[] for _ in range(nodes)]
+    for i in range(1, nodes):
+        children[(i - 1) // branching].append(i)
+    walk = measure(lambda frame: glm_walk(tree, store, children), 1)
+
+    print(f"{nodes} nodes, depth {len(store.levels)}, {moving:.0%} moving per frame")
+    print(f"dirty subtrees:    {dirty * 1e3:8.2f} ms ({np.mean(updated):.0f} world matrices per frame)")
+    print(f"every node:        {full * 1e3:8.2f} ms")
+    print(f"glm tree walk:     {walk * 1e3:8.2f} ms")
+    return dirty, full, walk
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,116 @@
+# Per-draw CPU cost of setting the uniforms of one lit object: the old
+# per-frame glGetUniformLocation lookups, cached locations, and what is left
+# per draw once camera and lights live in the FrameData block and light buffers.
+#
+#   cd src && python -m benchmarks.uniforms
+import time
+import glm
+from OpenGL.GL import *
+
+from modules.figures import Cube
+from modules.model import Model
+from modules.structures import DirLight, PointLight, SpotLight
+from modules.buffers import FrameUniforms
+
+from benchmarks.context import create_context
+
+
+def lookup_uniforms(model, projection, view, view_pos, dir_lights, point_lights, spot_lights):
+    # what Model.render and set_uniforms did before the uniform cache
+    program = model.shaderProgram
+    glUniform2fv(glGetUniformLocation(program, "resolution"), 1, (1080, 720))
+    glUniform1f(glGetUniformLocation(program, "time"), 0.0)
+    glUniform3fv(glGetUniformLocation(program, "viewPos"), 1, glm.value_ptr(view_pos))
+    for i, light in enumerate(dir_lights):
+        for field in DirLight.uniform_fields:
+            glUniform3fv(glGetUniformLocation(program, f"dirlights[{i}].{field}"), 1, glm.value_ptr(getattr(light, field)))
+    for i, light in enumerate(point_lights):
+        for field in PointLight.uniform_fields[:4]:
+            glUniform3fv(glGetUniformLocation(program, f"pointlights[{i}].{field}"), 1, glm.value_ptr(getattr(light, field)))
+        for field in PointLight.uniform_fields[4:]:
+            glUniform1f(glGetUniformLocation(program, f"pointlights[{i}].{field}"), getattr(light, field))
+    for i, light in enumerate(spot_lights):
+        for field in SpotLight.uniform_fields[:5]:
+            glUniform3fv(glGetUniformLocation(program, f"spotlights[{i}].{field}"), 1, glm.value_ptr(getattr(light, field)))
+        for field in SpotLight.uniform_fields[5:]:
+            glUniform1f(glGetUniformLocation(program, f"spotlights[{i}].{field}"), getattr(light, field))
+    glUniformMatrix4fv(glGetUniformLocation(program, "projection"), 1, GL_FALSE, glm.value_ptr(projection))
+    glUniformMatrix4fv(glGetUniformLocation(program, "view"), 1, GL_FALSE, glm.value_ptr(view))
+    glUniformMatrix4fv(glGetUniformLocation(program, "model"), 1, GL_FALSE, glm.value_ptr(model.model_matrix))
+    material = model.material
+    for field in material.uniform_fields[:3]:
+        glUniform3fv(glGetUniformLocation(program, f"material.{field}"), 1, glm.value_ptr(getattr(material, field)))
+    for field in material.uniform_fields[3:]:
+        glUniform1f(glGetUniformLocation(program, f"material.{field}"), getattr(material, field))
+
+
+def cached_uniforms(model, projection, view, view_pos, dir_lights, point_lights, spot_lights):
+    from modules.shaders import get_uniforms
+    program = model.shaderProgram
+    uniforms = get_uniforms(program)
+    glUniform2fv(uniforms["resolution"], 1, (1080, 720))
+    glUniform1f(uniforms["time"], 0.0)
+    glUniform3fv(uniforms["viewPos"], 1, glm.value_ptr(view_pos))
+    for i, light in enumerate(dir_lights):
+        light.set_uniforms(program, i)
+    for i, light in enumerate(point_lights):
+        light.set_uniforms(program, i)
+    for i, light in enumerate(spot_lights):
+        light.set_uniforms(program, i)
+    glUniformMatrix4fv(uniforms["projection"], 1, GL_FALSE, glm.value_ptr(projection))
+    glUniformMatrix4fv(uniforms["view"], 1, GL_FALSE, glm.value_ptr(view))
+    glUniformMatrix4fv(uniforms["model"], 1, GL_FALSE, glm.value_ptr(model.model_matrix))
+    model.material.set_uniforms(program)
+
+
+def block_uniforms(model, *args):
+    from modules.shaders import get_uniforms
+    glUniformMatrix4fv(get_uniforms(model.shaderProgram)["model"], 1, GL_FALSE, glm.value_ptr(model.model_matrix))
+    model.material.set_uniforms(model.shaderProgram)
+
+
+def measure(function, args, draws: int) -> float:
+    function(*args)
+    start = time.perf_counter()
+    for _ in range(draws):
+        function(*args)
+    return (time.perf_counter() - start) / draws
+
+
+def run(draws: int = 2000):
+    model = Model.from_figure(Cube, material="gold")
+    args = (
+        model,
+        glm.perspective(glm.radians(90.0), 1.5, 0.01, 100.0),
+        glm.lookAt(glm.vec3(0, 0, 3), glm.vec3(0), glm.vec3(0, 1, 0)),
+        glm.vec3(0, 0, 3),
+        [DirLight(direction=glm.vec3(1, -1, 0.5))],
+        [PointLight(position=glm.vec3(0, 0, 1.7))],
+        [SpotLight(position=glm.vec3(-3, -1, 2), direction=glm.vec3(0, 0, -1)),
+         SpotLight(position=glm.vec3(3, -1, 2), direction=glm.vec3(0, 0, -1))],
+    )
+
+    frame_uniforms = FrameUniforms()
+    frame_args = (args[1], args[2], args[3], 0.0, (1080, 720), *args[4:])
+
+    glUseProgram(model.shaderProgram)
+    before = measure(lookup_uniforms, args, draws)
+    after = measure(cached_uniforms, args, draws)
+    block = measure(block_uniforms, args, draws)
+    frame = measure(frame_uniforms.update, frame_args, draws)
+    glUseProgram(0)
+    frame_uniforms.delete()
+    model.release()
+
+    print(f"glGetUniformLocation per draw: {before * 1e6:8.1f} us")
+    print(f"cached locations per draw:     {after * 1e6:8.1f} us ({before / after:.2f}x)")
+    print(f"uniform blocks per draw:       {block * 1e6:8.1f} us ({before / block:.2f}x)")
+    print(f"  + block upload per frame:    {frame * 1e6:8.1f} us")
+    return before, after, block
+
+
+if __name__ == "__main__":
+    import glfw
+    create_context()
+    run()
+    glfw.terminate()
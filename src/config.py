@@ -5,4 +5,37 @@ load_dotenv()
 
 SHADERS_DIR = os.environ.get("SHADERS_DIR")
 MODELS_DIR = os.environ.get("MODELS_DIR")
-SOURCES_DIR = os.environ.get("SOURCES_DIR")
\ No newline at end of file
+SOURCES_DIR = os.environ.get("SOURCES_DIR")
+
+# set MESH_CACHE=0 to always re-parse OBJ files instead of using the binary
+# *.obj.mesh cache written next to them
+MESH_CACHE = os.environ.get("MESH_CACHE", "1") != "0"
+
+# meshes get their triangles reordered for the vertex cache and overdraw and
+# their vertices for fetch locality when loaded (and cached that way); set
+# MESH_OPTIMIZE=0 to keep them in file order
+MESH_OPTIMIZE = os.environ.get("MESH_OPTIMIZE", "1") != "0"
+
+# program binaries and other generated data; set SHADER_CACHE=0 to always
+# compile shaders from source
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pyopengl-3d-scene"))
+SHADER_CACHE = os.environ.get("SHADER_CACHE", "1") != "0"
+
+# megabytes of texture layers kept resident, unreferenced ones are evicted
+# least recently used first once the total goes over it
+TEXTURE_BUDGET = int(os.environ.get("TEXTURE_BUDGET", "256")) * (1 << 20)
+
+# megabytes of texture data streamed to the GPU per frame
+TEXTURE_UPLOAD_BUDGET = int(float(os.environ.get("TEXTURE_UPLOAD_BUDGET", "4")) * (1 << 20))
+
+# textures are block compressed (S3TC, RGTC) where the driver supports it;
+# TEXTURE_COMPRESSION=0 keeps them uncompressed, in the fewest channels that
+# hold them
+TEXTURE_COMPRESSION = os.environ.get("TEXTURE_COMPRESSION", "1") != "0"
+
+# color maps in sRGB formats, for use with gamma correction in the shaders
+TEXTURE_SRGB = os.environ.get("TEXTURE_SRGB", "0") != "0"
+
+# set TEXTURE_CACHE=0 to always decode textures and build their mip levels
+# instead of reading the encoded levels cached under CACHE_DIR
+TEXTURE_CACHE = os.environ.get("TEXTURE_CACHE", "1") != "0"
@@ -0,0 +1,226 @@
+# Cooks models and textures ahead of time into the binary caches the engine
+# reads at startup: *.obj.mesh next to every OBJ, and the encoded mip chains
+# of images and cubemaps under CACHE_DIR/textures. Assets cook in a process
+# pool. A manifest under CACHE_DIR records the hashes of every input and
+# output, so a run only cooks what changed since the last one.
+#
+#   cd src && python cook.py [paths ...] [--workers N] [--force]
+#
+# Without paths MODELS_DIR and SOURCES_DIR are cooked.
+import os, sys, json, time, hashlib, argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules.formats import choose_format
+from modules.funcs import CUBEMAP_FACES
+from modules.images import image_mode, image_size, merge_modes
+from modules.mesh import MESH_CACHE_VERSION, load_obj, mesh_cache_header, mesh_cache_path, optimize_mesh, write_mesh_cache
+from modules.mipcache import MIP_CACHE_VERSION, cook_image, mip_cache_header, mip_cache_path
+from config import CACHE_DIR, MODELS_DIR, SOURCES_DIR, MESH_OPTIMIZE, TEXTURE_COMPRESSION, TEXTURE_SRGB
+
+COOK_VERSION = 1
+MANIFEST_PATH = os.path.join(CACHE_DIR, "cook_manifest.json")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tga")
+
+
+class Asset:
+    # one unit of work: an OBJ, an image, or the six faces of a cubemap,
+    # which share a format. outputs pairs every cache file with its source
+    def __init__(self, kind: str, name: str, inputs: list[str]):
+        self.kind = kind
+        self.name = name
+        self.inputs = inputs
+        self.options = {
+            "version": [COOK_VERSION, MESH_CACHE_VERSION, MIP_CACHE_VERSION],
+            "compression": TEXTURE_COMPRESSION if kind != "mesh" else None,
+            "srgb": TEXTURE_SRGB if kind == "texture" else None,
+            "optimize": MESH_OPTIMIZE if kind == "mesh" else None,
+        }
+
+    @property
+    def srgb_variants(self) -> tuple[bool, ...]:
+        # an image may be a color map, loaded as sRGB, and a data map
+        return (False, True) if TEXTURE_SRGB else (False,)
+
+    @property
+    def outputs(self) -> list[tuple[str, str]]:
+        if self.kind == "mesh":
+            return [(mesh_cache_path(self.inputs[0]), self.inputs[0])]
+        if self.kind == "cubemap":
+            return [(mip_cache_path(path, False, False, False), path) for path in self.inputs]
+        return [(mip_cache_path(self.inputs[0], srgb, True, True), self.inputs[0]) for srgb in self.srgb_variants]
+
+    def __repr__(self):
+        return f"Asset(kind={self.kind}, name={self.name}, inputs={len(self.inputs)})"
+
+
+def find_assets(roots: list[str]) -> list[Asset]:
+    assets = []
+    for root in roots:
+        for directory, _, files in os.walk(os.path.realpath(root)):
+            files = set(files)
+            faces = set(CUBEMAP_FACES) <= files
+            if faces:
+                assets.append(Asset("cubemap", directory, [os.path.join(directory, face) for face in CUBEMAP_FACES]))
+            for file in sorted(files):
+                path = os.path.join(directory, file)
+                extension = os.path.splitext(file)[1].lower()
+                if extension == ".obj":
+                    assets.append(Asset("mesh", path, [path]))
+                elif extension in IMAGE_EXTENSIONS and not (faces and file in CUBEMAP_FACES):
+                    assets.append(Asset("texture", path, [path]))
+    return assets
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_record(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_record(path: str) -> dict:
+    return {**stat_record(path), "sha256": file_hash(path)}
+
+
+def unchanged(path: str, record: dict) -> bool:
+    # by size and modification time, nothing is read
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == record["size"] and stat.st_mtime_ns == record["mtime_ns"]
+
+
+def cook(asset: Asset) -> dict:
+    # runs in a worker process, with the options the engine loads the asset
+    # with (see load_mesh, TextureArrays.load and load_cubemap); returns the
+    # asset's manifest entry
+    start = time.perf_counter()
+    if asset.kind == "mesh":
+        path = asset.inputs[0]
+        mesh = load_obj(path)
+        if MESH_OPTIMIZE:
+            mesh = optimize_mesh(mesh)
+        if not write_mesh_cache(path, mesh):
+            raise RuntimeError(f"could not write {mesh_cache_path(path)}")
+    elif asset.kind == "cubemap":
+        fmt = choose_format(merge_modes(image_mode(path) for path in asset.inputs), check=False)
+        for path in asset.inputs:
+            cook_image(path, fmt, False, 1, mip_cache_path(path, False, False, False))
+    else:
+        path = asset.inputs[0]
+        mode = image_mode(path)
+        levels = max(image_size(path)).bit_length()
+        for srgb in asset.srgb_variants:
+            cook_image(path, choose_format(mode, srgb, check=False), True, levels, mip_cache_path(path, srgb, True, True))
+    return {
+        "kind": asset.kind,
+        "options": asset.options,
+        "inputs": {path: file_record(path) for path in asset.inputs},
+        "outputs": {cache_path: file_record(cache_path) for cache_path, _ in asset.outputs},
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def restamp(cache_path: str, source_path: str):
+    # a source that was touched but not changed: the cache header takes the
+    # new size and modification time so the engine accepts it again
+    header_dtype = mesh_cache_header if cache_path.endswith(".mesh") else mip_cache_header
+    buffer = np.memmap(cache_path, dtype="uint8", mode="r+")
+    header = buffer[:header_dtype.itemsize].view(header_dtype)
+    stat = os.stat(source_path)
+    header["source_size"] = stat.st_size
+    header["source_mtime_ns"] = stat.st_mtime_ns
+    buffer.flush()
+    del header, buffer
+
+
+def up_to_date(asset: Asset, entry: dict) -> bool:
+    # by size and modification time first; contents are only hashed for
+    # inputs whose stat changed. Outputs the engine rewrote count as stale
+    if entry is None or entry["options"] != asset.options:
+        return False
+    if set(entry["inputs"]) != set(asset.inputs) or set(entry["outputs"]) != {path for path, _ in asset.outputs}:
+        return False
+    if not all(unchanged(path, record) for path, record in entry["outputs"].items()):
+        return False
+    touched = []
+    for path, record in entry["inputs"].items():
+        if unchanged(path, record):
+            continue
+        if file_hash(path) != record["sha256"]:
+            return False
+        touched.append(path)
+    for path in touched:
+        for cache_path, source_path in asset.outputs:
+            if source_path == path:
+                restamp(cache_path, path)
+                entry["outputs"][cache_path].update(stat_record(cache_path))
+        entry["inputs"][path].update(stat_record(path))
+    return True
+
+
+def read_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest: dict):
+    temp_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, MANIFEST_PATH)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cook models and textures into the engine's binary caches.")
+    parser.add_argument("paths", nargs="*", help="asset directories, MODELS_DIR and SOURCES_DIR by default")
+    parser.add_argument("--workers", type=int, default=None, help="cooking processes, one per CPU by default")
+    parser.add_argument("--force", action="store_true", help="cook everything, even what is up to date")
+    args = parser.parse_args(argv)
+
+    roots = args.paths or [path for path in (MODELS_DIR, SOURCES_DIR) if path]
+    if not roots:
+        parser.error("no paths given and neither MODELS_DIR nor SOURCES_DIR is set")
+
+    start = time.perf_counter()
+    manifest = read_manifest()
+    assets = find_assets(roots)
+    stale = [asset for asset in assets if args.force or not up_to_date(asset, manifest.get(asset.name))]
+    print(f"{len(assets)} assets, {len(assets) - len(stale)} up to date, {len(stale)} to cook")
+
+    failed = 0
+    if stale:
+        with ProcessPoolExecutor(args.workers) as pool:
+            jobs = {pool.submit(cook, asset): asset for asset in stale}
+            for done, job in enumerate(as_completed(jobs), 1):
+                asset = jobs[job]
+                try:
+                    manifest[asset.name] = entry = job.result()
+                    print(f"[{done}/{len(stale)}] {asset.kind} {asset.name} {entry['seconds'] * 1000:.0f} ms")
+                except Exception as e:
+                    failed += 1
+                    manifest.pop(asset.name, None)
+                    print(f"[{done}/{len(stale)}] {asset.kind} {asset.name} failed: {e}")
+
+    # assets whose sources are gone
+    for name in [name for name, entry in manifest.items() if not all(map(os.path.exists, entry["inputs"]))]:
+        del manifest[name]
+    write_manifest(manifest)
+    print(f"cooked {len(stale) - failed}, failed {failed} in {time.perf_counter() - start:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -51,16 +51,13 @@ def main() -> None:
         spotlight2,
     ])
 
-    # IMPORTANT: scene.update_shader_lights_count() 
-    # is required if you change the number of lights
-    scene.update_shader_lights_count()
-
     # Background
     skybox = Skybox()
     floor = Model.from_figure(
         Cube, 
         mode="m", 
         material="black_plastic",
+        static=True,
         # geometryShader="gs_custom.glsl"
     )
     floor.translate(glm.vec3(0, -1.15, 0)).scale((1.3, 0.15, 1.3))
@@ -90,13 +87,13 @@ def main() -> None:
     capybara1.translate(glm.vec3(-0.045, -1, 1.015)).scale(glm.vec3(0.1)).rotate(
         glm.vec3(-90, 0, 90)
     ).scale(glm.vec3(0.1))
-    capybara1_matrix = capybara1.model_matrix
+    capybara1_transform = capybara1.transform.snapshot()
 
     capybara2 = Model.from_model("capybara.obj", material=capybara2_material)
     capybara2.translate(glm.vec3(0.045, -1, 1.0)).scale(glm.vec3(0.1)).rotate(
         glm.vec3(90, 180, 90)
     ).scale(glm.vec3(0.1))
-    capybara2_matrix = capybara2.model_matrix
+    capybara2_transform = capybara2.transform.snapshot()
 
     eiffel_material = TextureMaterial(
         "eiffel_texture",
@@ -108,26 +105,25 @@ def main() -> None:
         "EiffelTower2.obj",
         mode="t",
         material=eiffel_material,
+        static=True,
     )
     eiffel.translate(glm.vec3(0, -1, 0.0)).scale(glm.vec3(0.045))
 
-    scene.objects.extend([
-        skybox,
-        floor,
-        eiffel, 
-        capybara1, 
-        capybara2
-    ])
+    scene.add(skybox)
+    scene.add(floor)
+    scene.add(eiffel)
+    capybara1_handle = scene.add(capybara1)
+    capybara2_handle = scene.add(capybara2)
 
     # for light in scene.pointLights + scene.spotLights:
     #     lamp = Model.from_figure(
     #         Cube, mode="light"
     #     )
     #     lamp.translate(light.position).scale(glm.vec3(0.01))
-    #     scene.objects.append(lamp)
+    #     scene.add(lamp)
 
-    animate_capybara1 = scene.animate_object(scene.objects.index(capybara1))(animate_capybara)
-    animate_capybara2 = scene.animate_object(scene.objects.index(capybara2))(animate_capybara)
+    animate_capybara1 = scene.animate_object(capybara1_handle)(animate_capybara)
+    animate_capybara2 = scene.animate_object(capybara2_handle)(animate_capybara)
 
     # Window params
     glEnable(GL_DEPTH_TEST)
@@ -163,16 +159,16 @@ def main() -> None:
             skybox=skybox
         )
         if windowContainer.animation_mode:
-            animate_capybara1(initial_matrix=capybara1_matrix)
-            animate_capybara2(initial_matrix=capybara2_matrix)
+            animate_capybara1(initial_transform=capybara1_transform)
+            animate_capybara2(initial_transform=capybara2_transform)
 
         glfw.poll_events()
         glfw.swap_buffers(window)
 
     glfw.terminate()
 
-def animate_capybara(capybara, *, time, delta_time, initial_matrix = glm.mat4(1.0)):
-    capybara.model_matrix = initial_matrix
+def animate_capybara(capybara, *, time, delta_time, initial_transform):
+    capybara.transform.restore(initial_transform)
 
     r = 10
     v = 1.0
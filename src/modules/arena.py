@@ -0,0 +1,248 @@
+import bisect
+import numpy as np
+from OpenGL.GL import *
+
+from modules.mesh import MeshData
+from modules.meshopt import index_dtype
+
+# attribute streams of the arena, one buffer each: (name, location, components)
+STREAMS = (("positions", 0, 3), ("normals", 1, 3), ("texcoords", 2, 2))
+sizeof_float = 4
+# the index allocator counts in 32 bit slots, meshes with 16 bit indices
+# keep two in each
+sizeof_index = 4
+
+
+class Allocation:
+    # a range handed out by RangeAllocator; compaction moves it by updating
+    # offset in place, so holders never have to be told
+    __slots__ = ("offset", "size")
+
+    def __init__(self, offset: int, size: int):
+        self.offset = offset
+        self.size = size
+
+    def __repr__(self):
+        return f"Allocation(offset={self.offset}, size={self.size})"
+
+
+class RangeAllocator:
+    # first fit over a sorted list of free ranges, neighbours merged on free.
+    # Units are whatever the caller counts in (vertices, indices).
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.free_offsets = [0]
+        self.free_sizes = [capacity]
+        self.allocations: set[Allocation] = set()
+
+    def allocate(self, size: int) -> Allocation | None:
+        for i, free_size in enumerate(self.free_sizes):
+            if free_size >= size:
+                allocation = Allocation(self.free_offsets[i], size)
+                if free_size == size:
+                    del self.free_offsets[i], self.free_sizes[i]
+                else:
+                    self.free_offsets[i] += size
+                    self.free_sizes[i] -= size
+                self.allocations.add(allocation)
+                return allocation
+        return None
+
+    def free(self, allocation: Allocation):
+        self.allocations.remove(allocation)
+        self.release_range(allocation.offset, allocation.size)
+
+    def release_range(self, offset: int, size: int):
+        i = bisect.bisect(self.free_offsets, offset)
+        # merge with the following free range, then with the preceding one
+        if i < len(self.free_offsets) and offset + size == self.free_offsets[i]:
+            size += self.free_sizes[i]
+            del self.free_offsets[i], self.free_sizes[i]
+        if i > 0 and self.free_offsets[i - 1] + self.free_sizes[i - 1] == offset:
+            self.free_sizes[i - 1] += size
+        else:
+            self.free_offsets.insert(i, offset)
+            self.free_sizes.insert(i, size)
+
+    def grow(self, capacity: int):
+        self.release_range(self.capacity, capacity - self.capacity)
+        self.capacity = capacity
+
+    def compact(self) -> list[tuple[int, int, int]]:
+        # packs every allocation to the front, returns (old, new, size) moves
+        moves = []
+        offset = 0
+        for allocation in sorted(self.allocations, key=lambda a: a.offset):
+            moves.append((allocation.offset, offset, allocation.size))
+            allocation.offset = offset
+            offset += allocation.size
+        self.free_offsets = [offset] if offset < self.capacity else []
+        self.free_sizes = [self.capacity - offset] if offset < self.capacity else []
+        return moves
+
+    @property
+    def used(self) -> int:
+        return self.capacity - sum(self.free_sizes)
+
+    @property
+    def largest_free(self) -> int:
+        return max(self.free_sizes, default=0)
+
+
+class GeometryArena:
+    # every GpuMesh lives in these buffers: one per attribute stream plus a
+    # shared index buffer, so all static meshes are drawn through the same
+    # vertex array with glDrawElementsBaseVertex or one multi-draw call per
+    # index type. Indices are 16 bit wherever the vertex count allows.
+    # Buffers are created on first use, once a context exists.
+    def __init__(self, vertex_capacity: int = 1 << 16, index_capacity: int = 1 << 18):
+        self.vertices = RangeAllocator(vertex_capacity)
+        self.indices = RangeAllocator(index_capacity)
+        self.buffers: list[int] = None
+        self.ebo = None
+        self.vao = None
+        # every vertex array reading the arena, re-pointed when buffers change
+        self.vertex_arrays: list[int] = []
+        # bumped whenever meshes may have moved
+        self.generation = 0
+
+    def ensure(self):
+        if self.buffers is None:
+            self.create_buffers()
+            self.vao = self.create_vertex_array()
+            glBindVertexArray(0)
+
+    def create_buffers(self):
+        self.buffers = [int(buffer) for buffer in glGenBuffers(len(STREAMS))]
+        self.ebo = int(glGenBuffers(1))
+        for buffer, (_, _, components) in zip(self.buffers, STREAMS):
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.vertices.capacity * components * sizeof_float, None, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.ebo)
+        glBufferData(GL_COPY_WRITE_BUFFER, self.indices.capacity * sizeof_index, None, GL_STATIC_DRAW)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+    def attach(self, vao: int):
+        glBindVertexArray(vao)
+        for buffer, (_, location, components) in zip(self.buffers, STREAMS):
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glVertexAttribPointer(location, components, GL_FLOAT, GL_FALSE, components * sizeof_float, None)
+            glEnableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+
+    def create_vertex_array(self) -> int:
+        # left bound so callers can add attributes of their own (instancing)
+        self.ensure()
+        vao = int(glGenVertexArrays(1))
+        self.attach(vao)
+        self.vertex_arrays.append(vao)
+        return vao
+
+    def delete_vertex_array(self, vao: int):
+        self.vertex_arrays.remove(vao)
+        glDeleteVertexArrays(1, (vao,))
+
+    def add(self, mesh: MeshData, layout: str = "pnt") -> tuple[Allocation, Allocation]:
+        # streams left out of layout are zero filled, what a disabled
+        # attribute would have read
+        self.ensure()
+        vertex_count = len(mesh.positions)
+        index_data = np.ascontiguousarray(mesh.indices, dtype=index_dtype(vertex_count))
+        vertices = self.allocate(self.vertices, vertex_count)
+        indices = self.allocate(self.indices, -(-index_data.nbytes // sizeof_index))
+
+        for buffer, (name, _, components) in zip(self.buffers, STREAMS):
+            data = getattr(mesh, name)
+            if name != "positions" and (name[0] not in layout or data is None):
+                data = np.zeros((vertex_count, components), dtype="float32")
+            # figures may carry more normals or texcoords than positions, only
+            # the first vertex_count were ever read
+            data = np.ascontiguousarray(np.asarray(data, dtype="float32").reshape(-1, components)[:vertex_count])
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, vertices.offset * components * sizeof_float, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.ebo)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, indices.offset * sizeof_index, index_data.nbytes, index_data)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        return vertices, indices
+
+    def read(self, vertices: Allocation, indices: Allocation, index_count: int) -> MeshData:
+        # reads a mesh back, for the rare callers that rebuild geometry
+        # (static batching); stalls until the GPU is done with the buffers.
+        # The indices come back in the type they were stored in
+        streams = []
+        for buffer, (_, _, components) in zip(self.buffers, STREAMS):
+            glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+            data = glGetBufferSubData(GL_COPY_READ_BUFFER, vertices.offset * components * sizeof_float, vertices.size * components * sizeof_float)
+            streams.append(np.frombuffer(data, dtype="float32").reshape(-1, components))
+        glBindBuffer(GL_COPY_READ_BUFFER, self.ebo)
+        data = glGetBufferSubData(GL_COPY_READ_BUFFER, indices.offset * sizeof_index, indices.size * sizeof_index)
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        positions, normals, texcoords = streams
+        return MeshData(positions, np.frombuffer(data, dtype=index_dtype(vertices.size))[:index_count], normals, texcoords)
+
+    def free(self, vertices: Allocation, indices: Allocation):
+        self.vertices.free(vertices)
+        self.indices.free(indices)
+
+    def allocate(self, allocator: RangeAllocator, size: int) -> Allocation:
+        allocation = allocator.allocate(size)
+        if allocation is not None:
+            return allocation
+        if allocator.capacity - allocator.used >= size:
+            # enough room, only in pieces
+            self.compact()
+        else:
+            self.rebuild(
+                max(self.vertices.capacity * 2, self.vertices.capacity + size) if allocator is self.vertices else self.vertices.capacity,
+                max(self.indices.capacity * 2, self.indices.capacity + size) if allocator is self.indices else self.indices.capacity,
+            )
+        return allocator.allocate(size)
+
+    def compact(self):
+        # moves every mesh to the front of new buffers of the same size
+        self.rebuild(self.vertices.capacity, self.indices.capacity, compact=True)
+
+    def rebuild(self, vertex_capacity: int, index_capacity: int, compact: bool = False):
+        old_buffers, old_ebo = self.buffers, self.ebo
+        old_vertex_capacity, old_index_capacity = self.vertices.capacity, self.indices.capacity
+        if compact:
+            vertex_moves = self.vertices.compact()
+            index_moves = self.indices.compact()
+        else:
+            vertex_moves = [(0, 0, old_vertex_capacity)]
+            index_moves = [(0, 0, old_index_capacity)]
+            self.vertices.grow(vertex_capacity)
+            self.indices.grow(index_capacity)
+        self.create_buffers()
+
+        for old, new, (_, _, components) in zip(old_buffers, self.buffers, STREAMS):
+            self.copy(old, new, vertex_moves, components * sizeof_float)
+        self.copy(old_ebo, self.ebo, index_moves, sizeof_index)
+        glDeleteBuffers(len(old_buffers) + 1, (*old_buffers, old_ebo))
+
+        for vao in self.vertex_arrays:
+            self.attach(vao)
+        glBindVertexArray(0)
+        self.generation += 1
+        print(f"Geometry arena {'compacted' if compact else 'grown'}: {self.vertices.used}/{self.vertices.capacity} vertices, {self.indices.used}/{self.indices.capacity} indices")
+
+    @staticmethod
+    def copy(source: int, destination: int, moves: list[tuple[int, int, int]], unit: int):
+        glBindBuffer(GL_COPY_READ_BUFFER, source)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, destination)
+        for old, new, size in moves:
+            if size:
+                glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, old * unit, new * unit, size * unit)
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+    def memory_usage(self) -> int:
+        vertex_size = sum(components for _, _, components in STREAMS) * sizeof_float
+        return self.vertices.capacity * vertex_size + self.indices.capacity * sizeof_index
+
+
+geometry = GeometryArena()
@@ -0,0 +1,119 @@
+import numpy as np
+
+from modules.arena import geometry
+from modules.mesh import MeshData
+from modules.model import Model, InstancedModel, GpuMesh
+from modules.shaders import programs
+from modules.transforms import Node, transforms
+
+
+class StaticBatch(Model):
+    # merged world space geometry of static models sharing a program and a
+    # material, drawn as one model with an identity transform
+    def __init__(self, template: Model, mesh: GpuMesh):
+        mesh.ref_count = 1
+        self.mesh = mesh
+        self.mode = template.mode
+        self.material = template.material
+        self.shaderPaths = template.shaderPaths
+        self.shaderDefines = template.shaderDefines
+        self.shaderProgram = programs.acquire(*self.shaderPaths, self.shaderDefines)
+        self.weightedShaderProgram = None
+        self.static = True
+        Node.__init__(self)
+
+
+class StaticGroup:
+    def __init__(self):
+        # member -> its geometry in world space, None until baked
+        self.members: dict[Model, MeshData] = {}
+        self.batch: StaticBatch = None
+        self.dirty = True
+
+
+def bake_model(model: Model, sources: dict[int, MeshData]) -> MeshData:
+    # the vertex shader's work done once: positions by the world matrix,
+    # normals by the normal matrix (fs normalizes them). sources holds the
+    # meshes already read back during this bake.
+    mesh = model.mesh
+    data = sources.get(id(mesh))
+    if data is None:
+        data = sources[id(mesh)] = geometry.read(mesh.vertices, mesh.indices, mesh.index_count)
+    world = transforms.world[model.transform.row]
+    normal_matrix = transforms.normal[model.transform.row]
+    positions = data.positions @ world[:3, :3].T + world[:3, 3]
+    normals = data.normals @ normal_matrix.T
+    return MeshData(positions.astype("float32"), data.indices, normals.astype("float32"), data.texcoords.copy())
+
+
+def merge(meshes: list[MeshData]) -> MeshData:
+    offsets = np.cumsum([0] + [mesh.vertex_count for mesh in meshes[:-1]])
+    return MeshData(
+        np.concatenate([mesh.positions for mesh in meshes]),
+        np.concatenate([mesh.indices + np.uint32(offset) for mesh, offset in zip(meshes, offsets)]).astype("uint32"),
+        np.concatenate([mesh.normals for mesh in meshes]),
+        np.concatenate([mesh.texcoords for mesh in meshes]),
+    )
+
+
+class StaticBatcher:
+    # bakes static models into one StaticBatch per (program, material). Only
+    # groups whose members changed are rebaked, and a member is transformed
+    # once, when it joins. Moving a static model after it was baked has no
+    # effect on screen; remove it and add it again instead.
+    def __init__(self):
+        self.groups: dict[tuple[int, int], StaticGroup] = {}
+        self.group_of: dict[Model, tuple[int, int]] = {}
+
+    def add(self, model) -> bool:
+        # False for objects that cannot be baked, the scene draws those itself
+        if not isinstance(model, Model) or isinstance(model, (InstancedModel, StaticBatch)):
+            return False
+        key = (model.shaderProgram, id(model.material))
+        group = self.groups.setdefault(key, StaticGroup())
+        group.members[model] = None
+        group.dirty = True
+        self.group_of[model] = key
+        return True
+
+    def remove(self, model) -> bool:
+        key = self.group_of.pop(model, None)
+        if key is None:
+            return False
+        group = self.groups[key]
+        del group.members[model]
+        group.dirty = True
+        return True
+
+    def __contains__(self, model) -> bool:
+        return model in self.group_of
+
+    @property
+    def dirty(self) -> bool:
+        return any(group.dirty for group in self.groups.values())
+
+    def bake(self) -> tuple[list[StaticBatch], list[StaticBatch]]:
+        # returns the batches to drop and the ones to draw in their place;
+        # the world matrices of new members have to be up to date
+        removed, added = [], []
+        sources = {}
+        for key, group in list(self.groups.items()):
+            if not group.dirty:
+                continue
+            group.dirty = False
+            if group.batch is not None:
+                removed.append(group.batch)
+                group.batch = None
+            if not group.members:
+                del self.groups[key]
+                continue
+
+            for model, baked in group.members.items():
+                if baked is None:
+                    group.members[model] = bake_model(model, sources)
+            group.batch = StaticBatch(next(iter(group.members)), GpuMesh(merge(list(group.members.values()))))
+            added.append(group.batch)
+        return removed, added
+
+    def __len__(self) -> int:
+        return len(self.groups)
@@ -0,0 +1,264 @@
+import glm, ctypes
+import numpy as np
+from OpenGL.GL import *
+
+# binding points shared by every program, see the matching layout(binding = N)
+# declarations in the shaders. Uniform blocks and shader storage blocks have
+# separate binding namespaces.
+FRAME_DATA_BINDING = 0
+
+DIR_LIGHTS_BINDING = 0
+POINT_LIGHTS_BINDING = 1
+SPOT_LIGHTS_BINDING = 2
+MATERIALS_BINDING = 3
+TEXTURE_MATERIALS_BINDING = 4
+
+# std140 layout of the FrameData uniform block
+frame_data_dtype = np.dtype({
+    "names": ["projection", "view", "viewPos", "time", "resolution",
+              "numDirLights", "numPointLights", "numSpotLights"],
+    "formats": [("<f4", (4, 4)), ("<f4", (4, 4)), ("<f4", 3), "<f4", ("<f4", 2),
+                "<i4", "<i4", "<i4"],
+    "offsets": [0, 64, 128, 140, 144, 152, 156, 160],
+    "itemsize": 176,
+})
+
+# std430 layouts of the light storage buffers. vec3 members are 16-byte
+# aligned, so the light structs interleave their float members into the
+# padding after each vec3; the GLSL structs declare their members in the
+# same order.
+dirlight_dtype = np.dtype({
+    "names": ["direction", "ambient", "diffuse", "specular"],
+    "formats": [("<f4", 3)] * 4,
+    "offsets": [0, 16, 32, 48],
+    "itemsize": 64,
+})
+
+pointlight_dtype = np.dtype({
+    "names": ["position", "constant", "ambient", "linear", "diffuse", "quadratic", "specular"],
+    "formats": [("<f4", 3), "<f4", ("<f4", 3), "<f4", ("<f4", 3), "<f4", ("<f4", 3)],
+    "offsets": [0, 12, 16, 28, 32, 44, 48],
+    "itemsize": 64,
+})
+
+spotlight_dtype = np.dtype({
+    "names": ["position", "constant", "direction", "linear", "ambient", "quadratic",
+              "diffuse", "cutOff", "specular", "outerCutOff"],
+    "formats": [("<f4", 3), "<f4", ("<f4", 3), "<f4", ("<f4", 3), "<f4",
+                ("<f4", 3), "<f4", ("<f4", 3), "<f4"],
+    "offsets": [0, 12, 16, 28, 32, 44, 48, 60, 64, 76],
+    "itemsize": 80,
+})
+
+# std430 layout of Material, shininess fills the padding after specular
+material_dtype = np.dtype({
+    "names": ["ambient", "diffuse", "specular", "shininess", "transparency", "reflectivity", "refractive_index"],
+    "formats": [("<f4", 3), ("<f4", 3), ("<f4", 3), "<f4", "<f4", "<f4", "<f4"],
+    "offsets": [0, 16, 32, 44, 48, 52, 56],
+    "itemsize": 64,
+})
+
+# std430 layout of TextureMaterial: layers of its diffuse and specular maps
+# in their texture arrays. Scalar only structs are not padded to 16 bytes.
+texture_material_dtype = np.dtype({
+    "names": ["diffuse_layer", "specular_layer", "shininess", "diffuse_lod", "specular_lod"],
+    "formats": ["<i4", "<i4", "<f4", "<f4", "<f4"],
+    "offsets": [0, 4, 8, 12, 16],
+    "itemsize": 20,
+})
+
+# per-instance vertex attributes of InstancedModel, matrices stored column
+# by column the way glVertexAttribPointer reads them
+instance_dtype = np.dtype({
+    "names": ["model", "normal_matrix", "material_index"],
+    "formats": [("<f4", (4, 4)), ("<f4", (3, 3)), "<i4"],
+    "offsets": [0, 64, 100],
+    "itemsize": 104,
+})
+
+
+def set_instance_attributes(buffer):
+    # points locations 3-10 of the bound vertex array at instance_dtype
+    # records in buffer, advancing once per instance
+    glBindBuffer(GL_ARRAY_BUFFER, buffer)
+    stride = instance_dtype.itemsize
+    for column in range(4):
+        location = 3 + column
+        offset = instance_dtype.fields["model"][1] + column * 4 * 4
+        glVertexAttribPointer(location, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+        glEnableVertexAttribArray(location)
+        glVertexAttribDivisor(location, 1)
+    for column in range(3):
+        location = 7 + column
+        offset = instance_dtype.fields["normal_matrix"][1] + column * 3 * 4
+        glVertexAttribPointer(location, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+        glEnableVertexAttribArray(location)
+        glVertexAttribDivisor(location, 1)
+    glVertexAttribIPointer(10, 1, GL_INT, stride, ctypes.c_void_p(instance_dtype.fields["material_index"][1]))
+    glEnableVertexAttribArray(10)
+    glVertexAttribDivisor(10, 1)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+def pack_structs(records: np.ndarray, structs):
+    # copies the fields of lights or materials named by the record dtype
+    for record, struct in zip(records, structs):
+        for field in records.dtype.names:
+            record[field] = getattr(struct, field)
+
+
+class MaterialTable:
+    # every material of one kind in one std430 storage buffer, the shaders
+    # read materials[materialIndex] so switching materials between draws is
+    # one integer. Slots are handed out on construction; an edited material
+    # marks its slot and bind() uploads only the marked ones. The buffer is
+    # created on first bind, once a context exists.
+    def __init__(self, dtype: np.dtype, binding: int, capacity: int = 64):
+        self.dtype = dtype
+        self.binding = binding
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.free_slots: list[int] = []
+        self.count = 0
+        self.dirty: set[int] = set()
+        self.buffer = None
+        self.buffer_capacity = 0
+
+    def register(self, material) -> int:
+        if self.free_slots:
+            index = self.free_slots.pop()
+        else:
+            index = self.count
+            self.count += 1
+            if index >= len(self.records):
+                records = np.zeros(len(self.records) * 2, dtype=self.dtype)
+                records[:len(self.records)] = self.records
+                self.records = records
+        self.write(index, material)
+        return index
+
+    def write(self, index: int, material):
+        pack_structs(self.records[index:index + 1], (material,))
+        self.dirty.add(index)
+
+    def free(self, index: int):
+        self.records[index] = 0
+        self.dirty.discard(index)
+        self.free_slots.append(index)
+
+    def bind(self) -> int:
+        # returns the number of slots uploaded
+        uploaded = 0
+        if self.buffer is None:
+            self.buffer = int(glGenBuffers(1))
+        if self.dirty or self.buffer_capacity < len(self.records):
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.buffer)
+            if self.buffer_capacity < len(self.records):
+                glBufferData(GL_SHADER_STORAGE_BUFFER, self.records.nbytes, self.records, GL_DYNAMIC_DRAW)
+                self.buffer_capacity = len(self.records)
+                uploaded = self.count
+            else:
+                base = self.records.ctypes.data
+                size = self.dtype.itemsize
+                for index in self.dirty:
+                    glBufferSubData(GL_SHADER_STORAGE_BUFFER, index * size, size, ctypes.c_void_p(base + index * size))
+                uploaded = len(self.dirty)
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+            self.dirty.clear()
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.buffer)
+        return uploaded
+
+    def delete(self):
+        if self.buffer is not None:
+            glDeleteBuffers(1, (self.buffer,))
+        self.buffer = None
+        self.buffer_capacity = 0
+        self.dirty = set(range(self.count))
+
+
+def align(size: int, alignment: int) -> int:
+    return (size + alignment - 1) // alignment * alignment
+
+
+class FrameUniforms:
+    def __init__(self):
+        # FrameData and the three light arrays share one buffer. It is bound
+        # as a uniform block range plus three shader storage ranges, so a
+        # frame is uploaded with a single glBufferSubData, and a different
+        # number of lights only means a bigger buffer, never a new program.
+        self.buffer = GLuint(0)
+        glGenBuffers(1, self.buffer)
+        self.offset_alignment = max(
+            int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT)),
+            int(glGetIntegerv(GL_SHADER_STORAGE_BUFFER_OFFSET_ALIGNMENT)),
+        )
+        self.light_counts = None
+        self.data = None
+        self.projection_matrix = None
+        self.view_matrix = None
+
+    def allocate(self, light_counts: tuple[int, int, int]):
+        self.light_counts = light_counts
+
+        ranges = []
+        offset = align(frame_data_dtype.itemsize, self.offset_alignment)
+        for dtype, count in zip((dirlight_dtype, pointlight_dtype, spotlight_dtype), light_counts):
+            # empty ranges cannot be bound, keep room for one light
+            size = dtype.itemsize * max(count, 1)
+            ranges.append((offset, size))
+            offset = align(offset + size, self.offset_alignment)
+
+        self.data = np.zeros(offset, dtype="uint8")
+        self.projection_matrix = self.view_matrix = None
+        self.frame = self.data[:frame_data_dtype.itemsize].view(frame_data_dtype)[0]
+        self.dir_lights, self.point_lights, self.spot_lights = (
+            self.data[start:start + size].view(dtype)
+            for (start, size), dtype in zip(ranges, (dirlight_dtype, pointlight_dtype, spotlight_dtype))
+        )
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferRange(GL_UNIFORM_BUFFER, FRAME_DATA_BINDING, self.buffer, 0, frame_data_dtype.itemsize)
+        for binding, (start, size) in zip((DIR_LIGHTS_BINDING, POINT_LIGHTS_BINDING, SPOT_LIGHTS_BINDING), ranges):
+            glBindBufferRange(GL_SHADER_STORAGE_BUFFER, binding, self.buffer, start, size)
+
+    def update(self,
+               projection_matrix: glm.mat4,
+               view_matrix: glm.mat4,
+               view_position: glm.vec3,
+               time: float,
+               resolution: tuple[int, int],
+               dir_lights,
+               point_lights,
+               spot_lights):
+        light_counts = (len(dir_lights), len(point_lights), len(spot_lights))
+        if light_counts != self.light_counts:
+            self.allocate(light_counts)
+
+        # the scene hands over the same matrix objects until they change.
+        # numpy reads glm matrices as [row][column], GL wants columns first
+        if projection_matrix is not self.projection_matrix:
+            self.frame["projection"] = np.asarray(projection_matrix).T
+            self.projection_matrix = projection_matrix
+        if view_matrix is not self.view_matrix:
+            self.frame["view"] = np.asarray(view_matrix).T
+            self.view_matrix = view_matrix
+        self.frame["viewPos"] = view_position
+        self.frame["time"] = time
+        self.frame["resolution"] = resolution if resolution is not None else (0, 0)
+        self.frame["numDirLights"], self.frame["numPointLights"], self.frame["numSpotLights"] = light_counts
+
+        pack_structs(self.dir_lights, dir_lights)
+        pack_structs(self.point_lights, point_lights)
+        pack_structs(self.spot_lights, spot_lights)
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def delete(self):
+        glDeleteBuffers(1, self.buffer)
+
+
+material_table = MaterialTable(material_dtype, MATERIALS_BINDING)
+texture_material_table = MaterialTable(texture_material_dtype, TEXTURE_MATERIALS_BINDING)
@@ -0,0 +1,78 @@
+import glm
+import numpy as np
+from modules.transforms import transforms
+
+
+def frustum_planes(projection_view_matrix: glm.mat4) -> np.ndarray:
+    # (6, 4) planes as (nx, ny, nz, d) with normals pointing into the frustum,
+    # taken from the rows of the clip matrix (left, right, bottom, top, near, far)
+    m = np.asarray(projection_view_matrix, dtype="float32")
+    planes = np.stack((
+        m[3] + m[0],
+        m[3] - m[0],
+        m[3] + m[1],
+        m[3] - m[1],
+        m[3] + m[2],
+        m[3] - m[2],
+    ))
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def cull(model_matrices: np.ndarray,
+         bounds: np.ndarray,
+         spheres: np.ndarray,
+         planes: np.ndarray) -> np.ndarray:
+    # model_matrices (N, 4, 4), local boxes (N, 2, 3), local spheres (N, 4).
+    # Returns the (N,) mask of objects that may intersect the frustum; both
+    # tests are conservative, so an object failing either one is outside.
+    rotation = model_matrices[:, :3, :3]
+    translation = model_matrices[:, :3, 3]
+    normals, distances = planes[:, :3], planes[:, 3]
+
+    # box: transformed center plus the extents projected onto each plane normal
+    centers = np.einsum("nij,nj->ni", rotation, bounds.mean(axis=1)) + translation
+    extents = np.einsum("nij,nj->ni", np.abs(rotation), (bounds[:, 1] - bounds[:, 0]) * 0.5)
+    box_visible = (centers @ normals.T + distances + extents @ np.abs(normals).T >= 0).all(axis=1)
+
+    # sphere: the radius grows with the largest axis scale of the matrix
+    sphere_centers = np.einsum("nij,nj->ni", rotation, spheres[:, :3]) + translation
+    radii = spheres[:, 3] * np.sqrt((rotation ** 2).sum(axis=1).max(axis=1))
+    sphere_visible = (sphere_centers @ normals.T + distances >= -radii[:, None]).all(axis=1)
+
+    return box_visible & sphere_visible
+
+
+class Culler:
+    def __init__(self):
+        self.objects = []
+        self.generation = -1
+        self.cullable = np.zeros(0, dtype=bool)
+        self.rows = np.zeros(0, dtype=np.intp)
+        self.bounds = np.zeros((0, 2, 3), dtype="float32")
+        self.spheres = np.zeros((0, 4), dtype="float32")
+
+    def gather(self, objects: list):
+        # bounds only change when the object list does; objects that are not
+        # cullable (the skybox, instanced models, custom renderables) are
+        # always drawn
+        self.objects = list(objects)
+        self.cullable = np.array([getattr(obj, "cullable", False) for obj in self.objects], dtype=bool)
+        culled = [obj for obj, cullable in zip(self.objects, self.cullable) if cullable]
+        culled_meshes = [obj.mesh for obj in culled]
+        self.rows = np.array([obj.transform.row for obj in culled], dtype=np.intp)
+        self.bounds = np.array([mesh.bounds for mesh in culled_meshes], dtype="float32").reshape(-1, 2, 3)
+        self.spheres = np.array([mesh.sphere for mesh in culled_meshes], dtype="float32").reshape(-1, 4)
+
+    def visible(self, objects: list, generation: int, projection_view_matrix: glm.mat4) -> np.ndarray:
+        # generation is the scene's, bumped whenever its objects change; the
+        # length catches lists edited behind the scene's back
+        if generation != self.generation or len(objects) != len(self.objects):
+            self.gather(objects)
+            self.generation = generation
+
+        visible = np.ones(len(self.objects), dtype=bool)
+        if self.cullable.any():
+            # the scene updates the transform store before culling
+            model_matrices = transforms.world[self.rows]
+            visible[self.cullable] = cull(model_matrices, self.bounds, self.spheres, frustum_planes(projection_view_matrix))
+        return visible
@@ -0,0 +1,133 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_1_3 import glCompressedTexSubImage2D, glCompressedTexSubImage3D
+from OpenGL.GL.EXT.texture_compression_s3tc import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+from OpenGL.GL.EXT.texture_sRGB import GL_COMPRESSED_SRGB_S3TC_DXT1_EXT, GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT
+
+from modules.compression import encoders
+from config import TEXTURE_COMPRESSION
+
+# one and two channel formats read as gray and gray with alpha
+GRAY_SWIZZLE = (GL_RED, GL_RED, GL_RED, GL_ONE)
+GRAY_ALPHA_SWIZZLE = (GL_RED, GL_RED, GL_RED, GL_GREEN)
+
+
+class TextureFormat:
+    # an internal format and what it takes to fill it: the Pillow mode images
+    # are decoded to, then either the pixel transfer format or the block
+    # encoder. Compressed formats store 4x4 texel blocks of block_size bytes.
+    # Nothing here needs a GL context, so cooking processes use these too.
+    def __init__(self,
+                 internal_format: int,
+                 mode: str,
+                 transfer_format: int = None,
+                 encoder: str = None,
+                 block_size: int = 0,
+                 swizzle: tuple = None):
+        self.internal_format = int(internal_format)
+        self.mode = mode
+        self.transfer_format = transfer_format
+        self.encoder = encoder
+        self.block_size = block_size
+        self.swizzle = swizzle
+
+    @property
+    def compressed(self) -> bool:
+        return self.encoder is not None
+
+    @property
+    def row_height(self) -> int:
+        # texel rows per row of data, a row of blocks covers four
+        return 4 if self.compressed else 1
+
+    def row_bytes(self, width: int) -> int:
+        if self.compressed:
+            return (width + 3) // 4 * self.block_size
+        return width * len(self.mode)
+
+    def level_bytes(self, width: int, height: int) -> int:
+        return self.row_bytes(width) * -(-height // self.row_height)
+
+    def encode(self, data: bytes, size: tuple[int, int]) -> bytes:
+        # decoded pixels of one level in this format's layout
+        if not self.compressed:
+            return data
+        width, height = size
+        pixels = np.frombuffer(data, dtype="uint8").reshape(height, width, len(self.mode))
+        return encoders[self.encoder](pixels)
+
+    def sub_image(self, target: int, level: int, offset: tuple, size: tuple, data):
+        # glTex(Sub)Image for 2D targets or, with three components in offset
+        # and size, array layers. data is pixels in this format's layout or
+        # an offset into the bound pixel unpack buffer
+        if self.compressed:
+            # the raw entry points, the wrappers take the size from data
+            depth = size[2] if len(size) == 3 else 1
+            nbytes = self.level_bytes(size[0], size[1]) * depth
+            if not isinstance(data, ctypes.c_void_p):
+                data = np.frombuffer(data, dtype="uint8")
+                pointer = ctypes.c_void_p(data.ctypes.data)
+            else:
+                pointer = data
+            if len(size) == 3:
+                glCompressedTexSubImage3D(target, level, *offset, *size, self.internal_format, nbytes, pointer)
+            else:
+                glCompressedTexSubImage2D(target, level, *offset, *size, self.internal_format, nbytes, pointer)
+        elif len(size) == 3:
+            glTexSubImage3D(target, level, *offset, *size, self.transfer_format, GL_UNSIGNED_BYTE, data)
+        else:
+            glTexSubImage2D(target, level, *offset, *size, self.transfer_format, GL_UNSIGNED_BYTE, data)
+
+    def apply_swizzle(self, target: int):
+        # on the bound texture
+        if self.swizzle is not None:
+            glTexParameteriv(target, GL_TEXTURE_SWIZZLE_RGBA, self.swizzle)
+
+    def __repr__(self):
+        return f"TextureFormat(internal_format={self.internal_format:#x}, mode={self.mode}, encoder={self.encoder})"
+
+
+# (mode, sRGB) -> uncompressed and compressed format. Gray sRGB images are
+# stored as colors, there are no one or two channel sRGB formats
+uncompressed_formats = {
+    ("L", False): TextureFormat(GL_R8, "L", GL_RED, swizzle=GRAY_SWIZZLE),
+    ("LA", False): TextureFormat(GL_RG8, "LA", GL_RG, swizzle=GRAY_ALPHA_SWIZZLE),
+    ("RGB", False): TextureFormat(GL_RGB8, "RGB", GL_RGB),
+    ("RGBA", False): TextureFormat(GL_RGBA8, "RGBA", GL_RGBA),
+    ("RGB", True): TextureFormat(GL_SRGB8, "RGB", GL_RGB),
+    ("RGBA", True): TextureFormat(GL_SRGB8_ALPHA8, "RGBA", GL_RGBA),
+}
+compressed_formats = {
+    ("L", False): TextureFormat(GL_COMPRESSED_RED_RGTC1, "L", encoder="bc4", block_size=8, swizzle=GRAY_SWIZZLE),
+    ("LA", False): TextureFormat(GL_COMPRESSED_RG_RGTC2, "LA", encoder="bc5", block_size=16, swizzle=GRAY_ALPHA_SWIZZLE),
+    ("RGB", False): TextureFormat(GL_COMPRESSED_RGB_S3TC_DXT1_EXT, "RGB", encoder="bc1", block_size=8),
+    ("RGBA", False): TextureFormat(GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, "RGBA", encoder="bc3", block_size=16),
+    ("RGB", True): TextureFormat(GL_COMPRESSED_SRGB_S3TC_DXT1_EXT, "RGB", encoder="bc1", block_size=8),
+    ("RGBA", True): TextureFormat(GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT, "RGBA", encoder="bc3", block_size=16),
+}
+texture_formats: dict[int, TextureFormat] = {
+    fmt.internal_format: fmt for fmt in (*uncompressed_formats.values(), *compressed_formats.values())
+}
+
+supported_formats: dict[int, bool] = {}
+
+
+def format_supported(fmt: TextureFormat) -> bool:
+    # asked once per format, needs the context
+    if fmt.internal_format not in supported_formats:
+        supported = glGetInternalformativ(GL_TEXTURE_2D_ARRAY, fmt.internal_format, GL_INTERNALFORMAT_SUPPORTED, 1)
+        supported_formats[fmt.internal_format] = int(np.ravel(supported)[0]) == GL_TRUE
+    return supported_formats[fmt.internal_format]
+
+
+def choose_format(mode: str, srgb: bool = False, compress: bool = TEXTURE_COMPRESSION, check: bool = True) -> TextureFormat:
+    # mode is what image_mode() found in the image, srgb is for color maps.
+    # check=False takes the compressed formats to be supported, for cooking
+    # without a context; the engine recooks what its driver cannot sample
+    if srgb and mode in ("L", "LA"):
+        mode = "RGB" if mode == "L" else "RGBA"
+    fmt = compressed_formats[mode, srgb]
+    if compress and (not check or format_supported(fmt)):
+        return fmt
+    return uncompressed_formats[mode, srgb]
@@ -1,77 +1,191 @@
+import os, ctypes, hashlib
 from OpenGL.GL import *
-from PIL import Image
+from OpenGL.error import GLError
+from concurrent.futures import Future, as_completed
+from modules.formats import choose_format, format_supported
+from modules.images import image_loader, image_mode, image_size, merge_modes
+from modules.mipcache import cook_image, mip_cache_path, read_mip_cache
+
+# in the order of GL_TEXTURE_CUBE_MAP_POSITIVE_X and the faces after it
+CUBEMAP_FACES = [
+    "posx.jpg",
+    "negx.jpg",
+    "posy.jpg",
+    "negy.jpg",
+    "posz.jpg",
+    "negz.jpg",
+]
+
+
+def load_images(paths: list[str], srgb: bool = False, flip: bool = False, mipmaps: bool = False):
+    # one format for all the images, their size and a future per image that
+    # yields its levels in that format: straight from the mip cache when
+    # every image is there in the same format, otherwise decoded and encoded
+    # on the image loader's threads, which refreshes the cache
+    cache_paths = [mip_cache_path(path, srgb, flip, mipmaps) for path in paths]
+    cached = [read_mip_cache(cache_path, path) for cache_path, path in zip(cache_paths, paths)]
+    formats = {entry[0] for entry in cached if entry is not None}
+    if None not in cached and len(formats) == 1 and format_supported(*formats):
+        futures = []
+        for _, image in cached:
+            future = Future()
+            future.set_result(image)
+            futures.append(future)
+        return formats.pop(), cached[0][1].size, futures
+
+    fmt = choose_format(merge_modes(image_mode(path) for path in paths), srgb)
+    width, height = size = image_size(paths[0])
+    levels = max(width, height).bit_length() if mipmaps else 1
+    futures = [image_loader.run(cook_image, path, fmt, flip, levels, cache_path) for path, cache_path in zip(paths, cache_paths)]
+    return fmt, size, futures
+
 
 def load_cubemap(cubeMapDir: str = "cubemap"):
-    files = [
-        "posx.jpg",
-        "negx.jpg",
-        "posy.jpg",
-        "negy.jpg",
-        "posz.jpg",
-        "negz.jpg",
-    ]
+    fmt, size, images = load_images([f"{cubeMapDir}/{file}" for file in CUBEMAP_FACES])
     texture = GLuint(0)
     glGenTextures(1, texture)
     glBindTexture(GL_TEXTURE_CUBE_MAP, texture)
-    for i, file in enumerate(files):
-        image = Image.open(f"{cubeMapDir}/{file}")
-        image = image.convert('RGB')
-        image_data = image.tobytes()
-        glTexImage2D(
-            GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 
-            0, 
-            GL_RGB, 
-            image.width, 
-            image.height, 
-            0, 
-            GL_RGB, 
-            GL_UNSIGNED_BYTE, 
-            image_data
-        )
+    glTexStorage2D(GL_TEXTURE_CUBE_MAP, 1, fmt.internal_format, *size)
+    # the six faces are uploaded as each one is ready
+    faces = {future: i for i, future in enumerate(images)}
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    for future in as_completed(faces):
+        fmt.sub_image(GL_TEXTURE_CUBE_MAP_POSITIVE_X + faces[future], 0, (0, 0), size, future.result().levels[0])
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
 
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
+    fmt.apply_swizzle(GL_TEXTURE_CUBE_MAP)
 
     return texture
 
-def load_texture(filePath: str):
+def load_texture(filePath: str, srgb: bool = False):
+    fmt, size, (image,) = load_images([filePath], srgb, flip=True, mipmaps=True)
+    levels = image.result().levels
     texture = GLuint(0)
     glGenTextures(1, texture)
-    image = Image.open(f'{filePath}').transpose(Image.FLIP_TOP_BOTTOM).convert("RGBA")
-    image_data = image.tobytes()
 
     glBindTexture(GL_TEXTURE_2D, texture)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image.width, image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, image_data)
-    glGenerateMipmap(GL_TEXTURE_2D)
+    glTexStorage2D(GL_TEXTURE_2D, len(levels), fmt.internal_format, *size)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    for level, data in enumerate(levels):
+        fmt.sub_image(GL_TEXTURE_2D, level, (0, 0), (max(size[0] >> level, 1), max(size[1] >> level, 1)), data)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
 
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT);
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT);
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR);
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    fmt.apply_swizzle(GL_TEXTURE_2D)
 
     return texture
 
 
+def inject_defines(source: str, defines: dict = None) -> str:
+    # #defines have to follow the #version directive
+    if not defines:
+        return source
+    lines = "".join(f"#define {name} {value}\n" for name, value in defines.items())
+    if source.lstrip().startswith("#version"):
+        version, _, body = source.lstrip().partition("\n")
+        return f"{version}\n{lines}{body}"
+    return lines + source
+
+
+def program_binary_path(cacheDir: str, *sources: str) -> str:
+    # the driver identity is part of the key, binaries are only valid for the
+    # exact vendor/renderer/version that produced them
+    digest = hashlib.sha256()
+    for value in (glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION)):
+        digest.update(value or b"")
+        digest.update(b"\0")
+    for source in sources:
+        digest.update((source or "").encode())
+        digest.update(b"\0")
+    return os.path.join(cacheDir, f"{digest.hexdigest()}.bin")
+
+
+def load_program_binary(path: str):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) <= 4:
+        return None
+
+    binaryFormat = int.from_bytes(data[:4], "little")
+    shaderProgram: int = glCreateProgram()
+    try:
+        glProgramBinary(shaderProgram, binaryFormat, data[4:], len(data) - 4)
+        linked = glGetProgramiv(shaderProgram, GL_LINK_STATUS) == GL_TRUE
+    except GLError:
+        linked = False
+    if not linked:
+        # driver update or a binary from another GPU, rebuild it from source
+        glDeleteProgram(shaderProgram)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return shaderProgram
+
+
+def save_program_binary(path: str, shaderProgram: int):
+    if glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) == 0:
+        return
+    size = glGetProgramiv(shaderProgram, GL_PROGRAM_BINARY_LENGTH)
+    if size <= 0:
+        return
+
+    length = GLsizei(0)
+    binaryFormat = GLenum(0)
+    binary = (ctypes.c_ubyte * size)()
+    glGetProgramBinary(shaderProgram, size, ctypes.byref(length), ctypes.byref(binaryFormat), binary)
+
+    tempPath = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tempPath, 'wb') as f:
+            f.write(binaryFormat.value.to_bytes(4, "little"))
+            f.write(bytes(binary)[:length.value])
+        os.replace(tempPath, path)
+    except OSError as e:
+        print("Could not write program binary: ", e)
+
+
 def load_shaders(
         vertexShaderPath: str, 
         fragmentShaderPath: str,
-        geometryShaderPath: str = None):
-    vertexShaderId: int = glCreateShader(GL_VERTEX_SHADER)
-    fragmentShaderId: int = glCreateShader(GL_FRAGMENT_SHADER)
-    geometryShaderId: int = glCreateShader(GL_GEOMETRY_SHADER) if geometryShaderPath is not None else None
-
+        geometryShaderPath: str = None,
+        defines: dict = None,
+        cacheDir: str = None):
     with open(vertexShaderPath, 'r') as f:
-        vertexShader = f.read()
+        vertexShader = inject_defines(f.read(), defines)
 
     with open(fragmentShaderPath, 'r') as f:
-        fragmentShader = f.read()
+        fragmentShader = inject_defines(f.read(), defines)
 
+    geometryShader = None
     if geometryShaderPath is not None:
         with open(geometryShaderPath, 'r') as f:
-            geometryShader = f.read()
+            geometryShader = inject_defines(f.read(), defines)
+
+    binaryPath = None
+    if cacheDir is not None:
+        binaryPath = program_binary_path(cacheDir, vertexShader, fragmentShader, geometryShader)
+        shaderProgram = load_program_binary(binaryPath)
+        if shaderProgram is not None:
+            print("Loaded program binary: ", vertexShaderPath, fragmentShaderPath)
+            return shaderProgram
+
+    vertexShaderId: int = glCreateShader(GL_VERTEX_SHADER)
+    fragmentShaderId: int = glCreateShader(GL_FRAGMENT_SHADER)
+    geometryShaderId: int = glCreateShader(GL_GEOMETRY_SHADER) if geometryShaderPath is not None else None
 
     try:
         print("Compiling shader: ", vertexShaderPath)
@@ -98,6 +212,8 @@ def load_shaders(
     try:
         print("Linking Program")
         shaderProgram: int = glCreateProgram()
+        if binaryPath is not None:
+            glProgramParameteri(shaderProgram, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
         glAttachShader(shaderProgram, vertexShaderId)
         if geometryShaderPath is not None:
             glAttachShader(shaderProgram, geometryShaderId)
@@ -108,5 +224,10 @@ def load_shaders(
 
     glDeleteShader(vertexShaderId)
     glDeleteShader(fragmentShaderId)
+    if geometryShaderPath is not None:
+        glDeleteShader(geometryShaderId)
+
+    if binaryPath is not None and glGetProgramiv(shaderProgram, GL_LINK_STATUS) == GL_TRUE:
+        save_program_binary(binaryPath, shaderProgram)
 
     return shaderProgram
\ No newline at end of file
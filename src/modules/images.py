@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+
+# largest channel difference a gray image saved as color still shows
+GRAY_TOLERANCE = 3
+
+
+class DecodedImage:
+    # pixels ready for glTex(Sub)Image: one buffer per mip level, largest
+    # first, block encoded when it comes from the mip cache or cook_image()
+    __slots__ = ("path", "size", "mode", "levels")
+
+    def __init__(self, path: str, size: tuple[int, int], mode: str, levels: list[bytes]):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.levels = levels
+
+    @property
+    def data(self) -> bytes:
+        return self.levels[0]
+
+    def __repr__(self):
+        return f"DecodedImage(path={self.path}, size={self.size}, mode={self.mode}, levels={len(self.levels)})"
+
+
+def decode_image(path: str, mode: str = "RGBA", flip: bool = False, levels: int = 1) -> DecodedImage:
+    # runs on a worker thread; Pillow drops the GIL while it decodes and
+    # resamples, so several of these run side by side
+    with Image.open(path) as image:
+        if flip:
+            image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        image = image.convert(mode)
+    width, height = image.size
+    data = [image.tobytes()]
+    for level in range(1, levels):
+        image = image.resize((max(width >> level, 1), max(height >> level, 1)), Image.BOX)
+        data.append(image.tobytes())
+    return DecodedImage(path, (width, height), mode, data)
+
+
+def image_size(path: str) -> tuple[int, int]:
+    # from the header alone, nothing is decoded
+    with Image.open(path) as image:
+        return image.size
+
+
+def image_mode(path: str) -> str:
+    # the fewest channels that hold the image, "L", "LA", "RGB" or "RGBA": a
+    # color image that is gray throughout or an alpha channel that is opaque
+    # everywhere are dropped. Judged on a small copy, which JPEGs decode to
+    # directly
+    with Image.open(path) as image:
+        alpha = "A" in image.getbands() or "transparency" in image.info
+        image.draft(None, (256, 256))
+        image = image.convert("RGBA" if alpha else "RGB")
+    image.thumbnail((256, 256))
+    pixels = np.asarray(image).astype("int16")
+    gray = (np.abs(pixels[..., 0] - pixels[..., 1]).max() <= GRAY_TOLERANCE
+            and np.abs(pixels[..., 1] - pixels[..., 2]).max() <= GRAY_TOLERANCE)
+    alpha = alpha and pixels[..., 3].min() < 255
+    return ("L" if gray else "RGB") + ("A" if alpha else "")
+
+
+def merge_modes(modes) -> str:
+    # a mode that holds images of all the given modes
+    modes = list(modes)
+    gray = all(mode.startswith("L") for mode in modes)
+    alpha = any(mode.endswith("A") for mode in modes)
+    return ("L" if gray else "RGB") + ("A" if alpha else "")
+
+
+class ImageLoader:
+    # decodes images on a thread pool. Nothing here touches GL: callers keep
+    # the futures and upload the results on the context thread as they
+    # complete.
+    def __init__(self, workers: int = None):
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 2)
+        self.pool = None
+
+    def run(self, function, *args) -> Future:
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="image-decode")
+        return self.pool.submit(function, *args)
+
+    def submit(self, path: str, mode: str = "RGBA", flip: bool = False, levels: int = 1) -> Future:
+        return self.run(decode_image, path, mode, flip, levels)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.pool = None
+
+
+image_loader = ImageLoader()
@@ -0,0 +1,182 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+
+from modules.arena import geometry
+from modules.buffers import instance_dtype, set_instance_attributes
+from modules.shaders import programs, get_uniforms
+from modules.renderqueue import GLState, PASS_OPAQUE
+from modules.transforms import transforms
+from modules.model import Model
+from modules.structures import Material, TextureMaterial
+from config import SHADERS_DIR
+
+# DrawElementsIndirectCommand as glMultiDrawElementsIndirect reads it
+command_dtype = np.dtype([
+    ("count", "<u4"),
+    ("instance_count", "<u4"),
+    ("first_index", "<u4"),
+    ("base_vertex", "<i4"),
+    ("base_instance", "<u4"),
+])
+
+
+class IndirectDraws:
+    # every plain material or texture model of the scene in one
+    # glMultiDrawElementsIndirect per group of models sharing a program,
+    # texture arrays and index type. Each visible model is a command into the geometry arena
+    # whose base instance selects its record (model matrix, normal matrix,
+    # material table slot) in a per-draw buffer read through the instanced
+    # attributes of vs.glsl, so a frame costs a few numpy calls however many
+    # models there are. The batch is rebuilt when the object list, a model
+    # material, the pass of a material or the arena layout changes.
+    render_pass = PASS_OPAQUE
+    uses_gl_state = True
+
+    def __init__(self):
+        self.objects = []
+        self.object_generation = -1
+        self.material_changes = -1
+        self.pass_changes = -1
+        self.generation = -1
+        self.batched = np.zeros(0, dtype=bool)
+        self.rows = np.zeros(0, dtype=np.intp)
+        # models are kept sorted by group so every group is one run of commands
+        self.order = np.zeros(0, dtype=np.intp)
+        self.group_ids = np.zeros(0, dtype=np.intp)
+        self.groups: list[tuple[str, tuple, int]] = []
+        self.group_counts = np.zeros(0, dtype=np.intp)
+        self.programs: dict[str, int] = {}
+        self.commands = np.zeros(0, dtype=command_dtype)
+        self.material_indices = np.zeros(0, dtype=np.int32)
+        self.count = 0
+        self.frame_commands = self.commands
+        self.records = np.zeros(0, dtype=instance_dtype)
+        self.shaderProgram = None
+        self.vao = None
+
+    def program(self, fragmentShader: str) -> int:
+        # shares the programs of instanced models
+        program = self.programs.get(fragmentShader)
+        if program is None:
+            program = self.programs[fragmentShader] = programs.acquire(f"{SHADERS_DIR}/vs.glsl", f"{SHADERS_DIR}/{fragmentShader}", None, {"INSTANCED": 1})
+        return program
+
+    def create(self):
+        self.shaderProgram = self.program("fs.glsl")
+        self.record_buffer, self.command_buffer = (int(buffer) for buffer in glGenBuffers(2))
+        self.vao = geometry.create_vertex_array()
+        set_instance_attributes(self.record_buffer)
+        glBindVertexArray(0)
+
+    def gather(self, objects: list, generation: int):
+        self.objects = list(objects)
+        self.object_generation = generation
+        self.material_changes = Model.material_changes
+        self.pass_changes = Material.pass_changes
+        self.generation = geometry.generation
+
+        self.batched = np.array([getattr(obj, "indirect", False) for obj in self.objects], dtype=bool)
+        models = [obj for obj, batched in zip(self.objects, self.batched) if batched]
+        groups = {}
+        group_ids = np.array([groups.setdefault(self.group_of(model), len(groups)) for model in models], dtype=np.intp)
+        self.groups = list(groups)
+        self.order = np.argsort(group_ids, kind="stable")
+        self.group_ids = group_ids[self.order]
+        models = [models[i] for i in self.order]
+        self.rows = np.array([model.transform.row for model in models], dtype=np.intp)
+
+        self.commands = np.zeros(len(models), dtype=command_dtype)
+        self.commands["count"] = [model.mesh.index_count for model in models]
+        self.commands["instance_count"] = 1
+        self.commands["first_index"] = [model.mesh.first_index for model in models]
+        self.commands["base_vertex"] = [model.mesh.base_vertex for model in models]
+
+        self.material_indices = np.array([model.material.index for model in models], dtype=np.int32)
+        self.records = np.zeros(len(models), dtype=instance_dtype)
+
+    @staticmethod
+    def group_of(model: Model) -> tuple[str, tuple, int]:
+        # one multi-draw reads one index type
+        if isinstance(model.material, TextureMaterial):
+            return "fs_textures.glsl", model.material.arrays, model.mesh.index_type
+        return "fs.glsl", (), model.mesh.index_type
+
+    def update(self, objects: list, generation: int, visible: np.ndarray) -> np.ndarray:
+        # picks the visible batched models for this frame, returns the mask
+        # of objects the batch draws so the caller skips them. generation is
+        # the scene's, see Culler.visible
+        if (generation != self.object_generation
+                or len(objects) != len(self.objects)
+                or Model.material_changes != self.material_changes
+                or Material.pass_changes != self.pass_changes
+                or geometry.generation != self.generation):
+            self.gather(objects, generation)
+
+        selected = visible[self.batched][self.order]
+        self.count = int(np.count_nonzero(selected))
+        if self.count:
+            rows = self.rows[selected]
+            records = self.records[:self.count]
+            # the buffer wants columns, the store keeps rows
+            records["model"] = transforms.world[rows].transpose(0, 2, 1)
+            records["normal_matrix"] = transforms.normal[rows].transpose(0, 2, 1)
+            records["material_index"] = self.material_indices[selected]
+            self.frame_commands = self.commands[selected]
+            self.frame_commands["base_instance"] = np.arange(self.count, dtype=np.uint32)
+            self.group_counts = np.bincount(self.group_ids[selected], minlength=len(self.groups))
+        return self.batched
+
+    def upload(self):
+        if self.vao is None:
+            self.create()
+        # whole buffers respecified every frame, the driver orphans the old storage
+        for target, buffer, data in (
+            (GL_ARRAY_BUFFER, self.record_buffer, self.records[:self.count]),
+            (GL_DRAW_INDIRECT_BUFFER, self.command_buffer, self.frame_commands),
+        ):
+            glBindBuffer(target, buffer)
+            glBufferData(target, data.nbytes, data, GL_STREAM_DRAW)
+            glBindBuffer(target, 0)
+
+    def render(self, skybox=None, state: GLState = None, **kwargs: any):
+        if not self.count:
+            return
+        standalone = state is None
+        if standalone:
+            state = GLState()
+        self.upload()
+
+        state.bind_vertex_array(self.vao)
+        if skybox is not None:
+            state.bind_texture(2, GL_TEXTURE_CUBE_MAP, skybox.texture)
+
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        first = 0
+        for (fragmentShader, arrays, index_type), count in zip(self.groups, self.group_counts.tolist()):
+            if not count:
+                continue
+            program = self.program(fragmentShader)
+            if state.use_program(program):
+                glUniform1i(get_uniforms(program)["skybox"], 2)
+            for unit, array in enumerate(arrays):
+                state.bind_texture(unit, GL_TEXTURE_2D_ARRAY, array.texture)
+            offset = ctypes.c_void_p(first * command_dtype.itemsize) if first else None
+            glMultiDrawElementsIndirect(GL_TRIANGLES, index_type, offset, count, 0)
+            state.count("draw calls")
+            first += count
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+        state.count("indirect draws", self.count)
+
+        if standalone:
+            state.unbind()
+
+    def release(self):
+        if self.vao is not None:
+            geometry.delete_vertex_array(self.vao)
+            glDeleteBuffers(2, (self.record_buffer, self.command_buffer))
+            self.vao = None
+        for program in self.programs.values():
+            programs.release(program)
+        self.programs.clear()
+        self.shaderProgram = None
@@ -0,0 +1,303 @@
+import os, time
+import numpy as np
+import tinyobjloader
+
+from modules.meshopt import cache_stats, index_dtype, reorder_triangles, reorder_vertices
+
+MESH_CACHE_MAGIC = b"PYMESH"
+MESH_CACHE_VERSION = 4
+MESH_CACHE_SUFFIX = ".mesh"
+
+HAS_NORMALS = 1
+HAS_TEXCOORDS = 2
+OPTIMIZED = 4
+SHORT_INDICES = 8
+
+mesh_cache_header = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("flags", "<u4"),
+    ("source_size", "<u8"),
+    ("source_mtime_ns", "<u8"),
+    ("vertex_count", "<u8"),
+    ("index_count", "<u8"),
+    ("bounds", "<f4", (2, 3)),
+    ("sphere", "<f4", 4),
+])
+
+
+class MeshData:
+    def __init__(self,
+                 positions: np.ndarray,
+                 indices: np.ndarray,
+                 normals: np.ndarray = None,
+                 texcoords: np.ndarray = None,
+                 bounds: np.ndarray = None,
+                 sphere: np.ndarray = None):
+        self.positions = positions
+        self.indices = indices
+        self.normals = normals
+        self.texcoords = texcoords
+        # axis-aligned box as (min, max) and bounding sphere as (x, y, z, radius)
+        self.bounds = bounds if bounds is not None else compute_bounds(positions)
+        self.sphere = sphere if sphere is not None else compute_sphere(positions, self.bounds)
+        self.timings: dict[str, float] = {}
+        # set by optimize_mesh, with the vertex cache statistics before and after
+        self.optimized = False
+        self.cache_stats: dict[str, tuple[float, float]] = {}
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.positions)
+
+    @property
+    def index_count(self) -> int:
+        return len(self.indices)
+
+    def __repr__(self):
+        return f"MeshData(vertices={self.vertex_count}, indices={self.index_count}, normals={self.normals is not None}, texcoords={self.texcoords is not None})"
+
+
+def compute_bounds(positions: np.ndarray) -> np.ndarray:
+    if len(positions) == 0:
+        return np.zeros((2, 3), dtype="float32")
+    return np.stack((positions.min(axis=0), positions.max(axis=0))).astype("float32")
+
+
+def compute_sphere(positions: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    # centered on the box so culling can share the transformed center
+    center = bounds.mean(axis=0)
+    radius = np.sqrt(((positions - center) ** 2).sum(axis=1).max()) if len(positions) else 0.0
+    return np.append(center, radius).astype("float32")
+
+
+def weld_corners(corners: np.ndarray, normal_count: int, texcoord_count: int):
+    # corners is an (N, 3) array of OBJ (vertex, normal, texcoord) index
+    # triples where -1 marks a missing attribute. Every distinct triple becomes
+    # one output vertex; returns the source triple of each unique vertex and
+    # the unified index buffer.
+    v = corners[:, 0].astype(np.int64)
+    n = corners[:, 1].astype(np.int64) + 1
+    t = corners[:, 2].astype(np.int64) + 1
+
+    n_range = normal_count + 1
+    t_range = texcoord_count + 1
+    if (int(v.max(initial=0)) + 1) * n_range * t_range < 2**63:
+        keys = (v * n_range + n) * t_range + t
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        # packed key would overflow int64, weld on the raw rows instead
+        _, first, inverse = np.unique(corners, axis=0, return_index=True, return_inverse=True)
+
+    return corners[first], inverse.reshape(-1).astype(np.uint32)
+
+
+def load_obj(path: str) -> MeshData:
+    timings = {}
+
+    start = time.perf_counter()
+    reader = tinyobjloader.ObjReader()
+    if not reader.ParseFromFile(path):
+        raise RuntimeError(f"Failed to load {path}\nWarn: {reader.Warning()}\nErr: {reader.Error()}")
+    if reader.Warning():
+        print("Warn:", reader.Warning())
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    attrib = reader.GetAttrib()
+    shapes = reader.GetShapes()
+
+    # the numpy_* accessors of the pinned tinyobjloader return garbage, the
+    # list getters are converted in C++ and are nearly as fast
+    vertices = np.array(attrib.vertices, dtype="float32").reshape(-1, 3)
+    normals = np.array(attrib.normals, dtype="float32").reshape(-1, 3)
+    texcoords = np.array(attrib.texcoords, dtype="float32").reshape(-1, 2)
+
+    # touching mesh.indices would build one Python object per corner, so only
+    # the flat per-attribute index lists are read
+    corners = np.concatenate([
+        np.column_stack((
+            np.array(mesh.vertex_indices(), dtype="int32"),
+            np.array(mesh.normal_indices(), dtype="int32"),
+            np.array(mesh.texcoord_indices(), dtype="int32"),
+        ))
+        for mesh in (shape.mesh for shape in shapes)
+    ] or [np.empty((0, 3), dtype="int32")])
+    timings["extract"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unique, indices = weld_corners(corners, len(normals), len(texcoords))
+
+    positions = vertices[unique[:, 0]]
+
+    unified_normals = None
+    if len(normals) and (unique[:, 1] >= 0).any():
+        unified_normals = np.where(
+            (unique[:, 1] >= 0)[:, None], normals[unique[:, 1]], 0
+        ).astype("float32")
+
+    unified_texcoords = None
+    if len(texcoords) and (unique[:, 2] >= 0).any():
+        unified_texcoords = np.where(
+            (unique[:, 2] >= 0)[:, None], texcoords[unique[:, 2]], 0
+        ).astype("float32")
+    timings["weld"] = time.perf_counter() - start
+
+    mesh = MeshData(
+        np.ascontiguousarray(positions),
+        indices,
+        unified_normals,
+        unified_texcoords,
+    )
+    mesh.timings = timings
+    return mesh
+
+
+def optimize_mesh(mesh: MeshData) -> MeshData:
+    # triangles in vertex cache and overdraw friendly order, vertices in the
+    # order the triangles first use them and indices as narrow as the vertex
+    # count allows. Returns a new mesh, views into a cache file stay untouched
+    if mesh.index_count % 3 or not mesh.index_count:
+        return mesh
+    start = time.perf_counter()
+    vertex_count = mesh.vertex_count
+    before = cache_stats(mesh.indices)
+    triangles = reorder_triangles(np.asarray(mesh.indices).reshape(-1, 3), mesh.positions)
+    order, remap = reorder_vertices(triangles, vertex_count)
+    indices = remap[triangles].reshape(-1).astype(index_dtype(vertex_count))
+    after = cache_stats(indices)
+
+    def reorder(data: np.ndarray | None) -> np.ndarray | None:
+        # figures may carry more normals or texcoords than positions
+        return None if data is None else np.ascontiguousarray(np.asarray(data, dtype="float32")[:vertex_count][order])
+
+    optimized = MeshData(
+        reorder(mesh.positions),
+        indices,
+        reorder(mesh.normals),
+        reorder(mesh.texcoords),
+        bounds=mesh.bounds,
+        sphere=mesh.sphere,
+    )
+    optimized.optimized = True
+    optimized.cache_stats = {"ACMR": (before[0], after[0]), "ATVR": (before[1], after[1])}
+    optimized.timings = {**mesh.timings, "optimize": time.perf_counter() - start}
+    return optimized
+
+
+def format_timings(timings: dict[str, float]) -> str:
+    return ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items())
+
+
+def mesh_cache_path(path: str) -> str:
+    return f"{path}{MESH_CACHE_SUFFIX}"
+
+
+def read_mesh_cache(path: str) -> MeshData | None:
+    # returns views into a read-only memory map of the cache file, or None if
+    # the cache is missing or was built from a different version of the source
+    cache_path = mesh_cache_path(path)
+    try:
+        source = os.stat(path)
+        if os.path.getsize(cache_path) < mesh_cache_header.itemsize:
+            return None
+        buffer = np.memmap(cache_path, dtype="uint8", mode="r")
+    except OSError:
+        return None
+
+    header = buffer[:mesh_cache_header.itemsize].view(mesh_cache_header)[0]
+    if (header["magic"] != MESH_CACHE_MAGIC
+            or header["version"] != MESH_CACHE_VERSION
+            or header["source_size"] != source.st_size
+            or header["source_mtime_ns"] != source.st_mtime_ns):
+        return None
+
+    vertex_count = int(header["vertex_count"])
+    index_count = int(header["index_count"])
+    flags = int(header["flags"])
+
+    offset = mesh_cache_header.itemsize
+    def take(dtype: str, count: int, width: int):
+        nonlocal offset
+        size = count * width * np.dtype(dtype).itemsize
+        array = buffer[offset:offset + size].view(dtype)
+        offset += size
+        return array.reshape(-1, width) if width > 1 else array
+
+    positions = take("<f4", vertex_count, 3)
+    normals = take("<f4", vertex_count, 3) if flags & HAS_NORMALS else None
+    texcoords = take("<f4", vertex_count, 2) if flags & HAS_TEXCOORDS else None
+    indices = take("<u2" if flags & SHORT_INDICES else "<u4", index_count, 1)
+    if offset != len(buffer):
+        return None
+
+    mesh = MeshData(
+        positions,
+        indices,
+        normals,
+        texcoords,
+        bounds=np.array(header["bounds"], dtype="float32"),
+        sphere=np.array(header["sphere"], dtype="float32"),
+    )
+    mesh.optimized = bool(flags & OPTIMIZED)
+    return mesh
+
+
+def write_mesh_cache(path: str, mesh: MeshData) -> bool:
+    source = os.stat(path)
+    header = np.zeros((), dtype=mesh_cache_header)
+    header["magic"] = MESH_CACHE_MAGIC
+    header["version"] = MESH_CACHE_VERSION
+    short = mesh.indices.dtype.itemsize == 2
+    header["flags"] = ((HAS_NORMALS if mesh.normals is not None else 0)
+                       | (HAS_TEXCOORDS if mesh.texcoords is not None else 0)
+                       | (OPTIMIZED if mesh.optimized else 0)
+                       | (SHORT_INDICES if short else 0))
+    header["source_size"] = source.st_size
+    header["source_mtime_ns"] = source.st_mtime_ns
+    header["vertex_count"] = mesh.vertex_count
+    header["index_count"] = mesh.index_count
+    header["bounds"] = mesh.bounds
+    header["sphere"] = mesh.sphere
+
+    cache_path = mesh_cache_path(path)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(header.tobytes())
+            for array, dtype in ((mesh.positions, "<f4"),
+                                 (mesh.normals, "<f4"),
+                                 (mesh.texcoords, "<f4"),
+                                 (mesh.indices, "<u2" if short else "<u4")):
+                if array is not None:
+                    f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write mesh cache {cache_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def load_mesh(path: str, cache: bool = True, optimize: bool = False) -> MeshData:
+    # an unoptimized cache is optimized and written again when optimize is
+    # set, an optimized one serves either way
+    mesh = None
+    if cache:
+        start = time.perf_counter()
+        mesh = read_mesh_cache(path)
+        if mesh is not None:
+            mesh.timings["cache"] = time.perf_counter() - start
+            if mesh.optimized or not optimize:
+                return mesh
+
+    if mesh is None:
+        mesh = load_obj(path)
+    if optimize:
+        mesh = optimize_mesh(mesh)
+    if cache:
+        start = time.perf_counter()
+        write_mesh_cache(path, mesh)
+        mesh.timings["write cache"] = time.perf_counter() - start
+    return mesh
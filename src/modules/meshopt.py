@@ -0,0 +1,247 @@
+import numpy as np
+
+# triangle and vertex reordering of index buffers, after Sander, Nehab and
+# Barczak's Tipsify ("Fast Triangle Reordering for Vertex Locality and
+# Reduced Overdraw"). Tipsify walks the mesh one triangle fan at a time,
+# which is sequential, so the mesh is cut into spatially compact clusters
+# that are walked side by side: every numpy call below advances all the
+# clusters by one fan. The clusters are then ordered for overdraw, outer
+# surfaces facing outwards first.
+
+# entries of the post-transform vertex cache the ordering targets and the
+# statistics simulate, first in first out
+CACHE_SIZE = 16
+# triangles per cluster
+CLUSTER_SIZE = 1024
+# entries of a cluster's dead-end stack, older ones are dropped
+STACK_SIZE = 128
+# vertices a cluster scans per call when its stack runs dry
+SCAN_WINDOW = 64
+# indices per lane of the cache simulation, each lane replays the indices
+# just before its own to warm its cache first
+SIMULATION_CHUNK = 1 << 10
+
+
+def index_dtype(vertex_count: int) -> str:
+    # the narrowest index type that reaches every vertex
+    return "uint16" if vertex_count <= 1 << 16 else "uint32"
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    # 10 bit integers with two zero bits after every bit
+    values = values.astype(np.uint32) & np.uint32(0x3FF)
+    for shift, mask in ((16, 0x030000FF), (8, 0x0300F00F), (4, 0x030C30C3), (2, 0x09249249)):
+        values = (values | (values << np.uint32(shift))) & np.uint32(mask)
+    return values
+
+
+def morton_order(points: np.ndarray) -> np.ndarray:
+    # sorts points along a Z-order curve through their bounding box
+    low = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - low).max()), 1e-12)
+    cells = ((points - low) * (1023 / extent)).astype(np.uint32)
+    codes = spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << np.uint32(1)) | (spread_bits(cells[:, 2]) << np.uint32(2))
+    return np.argsort(codes, kind="stable")
+
+
+def tipsify(triangles: np.ndarray, lanes: np.ndarray, lane_count: int, cache_size: int = CACHE_SIZE) -> np.ndarray:
+    # triangles (T, 3) belong to lanes[t], sorted by lane. Returns the new
+    # triangle order, lane by lane
+    vertex_count = int(triangles.max()) + 1
+    # vertices shared by lanes are split into one copy per lane, so the lanes
+    # keep their own counts and cache times and never see each other
+    keys = lanes[:, None].astype(np.int64) * vertex_count + triangles
+    local_keys, local = np.unique(keys, return_inverse=True)
+    local = local.reshape(-1, 3)
+    local_count = len(local_keys)
+    lane_vertices = np.searchsorted(local_keys // vertex_count, np.arange(lane_count + 1))
+
+    # triangles around every vertex
+    flat = local.ravel()
+    adjacent = np.argsort(flat, kind="stable") // 3
+    degree = np.bincount(flat, minlength=local_count)
+    first = np.concatenate(([0], np.cumsum(degree)[:-1]))
+
+    live = degree.copy()
+    cache_time = np.full(local_count, -2 * cache_size, dtype=np.int64)
+    emitted = np.zeros(len(triangles), dtype=bool)
+    time = np.zeros(lane_count, dtype=np.int64)
+    fan = np.full(lane_count, -1, dtype=np.int64)
+    cursor = lane_vertices[:-1].copy()
+    end = lane_vertices[1:]
+    stack = np.zeros((lane_count, STACK_SIZE), dtype=np.int64)
+    top = np.zeros(lane_count, dtype=np.int64)
+    bottom = np.zeros(lane_count, dtype=np.int64)
+    done = np.zeros(lane_count, dtype=bool)
+    depths = np.arange(STACK_SIZE)
+    window = np.arange(SCAN_WINDOW)
+    order_lanes, order_triangles = [], []
+
+    while True:
+        # lanes without a fan vertex take the newest live one on their stack,
+        # then the next live one in input order
+        rows = np.flatnonzero((fan < 0) & ~done)
+        if rows.size:
+            entries = top[rows, None] - 1 - depths
+            candidates = stack[rows[:, None], entries % STACK_SIZE]
+            found = (entries >= bottom[rows, None]) & (live[candidates] > 0)
+            hit = found.any(axis=1)
+            depth = found.argmax(axis=1)
+            fan[rows[hit]] = candidates[hit, depth[hit]]
+            top[rows] = np.where(hit, top[rows] - 1 - depth, bottom[rows])
+            rows = rows[~hit]
+        while rows.size:
+            positions = cursor[rows, None] + window
+            found = (positions < end[rows, None]) & (live[np.minimum(positions, local_count - 1)] > 0)
+            hit = found.any(axis=1)
+            fan[rows[hit]] = cursor[rows[hit]] = positions[hit, found[hit].argmax(axis=1)]
+            cursor[rows[~hit]] += SCAN_WINDOW
+            exhausted = ~hit & (cursor[rows] >= end[rows])
+            done[rows[exhausted]] = True
+            rows = rows[~hit & ~exhausted]
+
+        rows = np.flatnonzero(fan >= 0)
+        if not rows.size:
+            break
+        vertices = fan[rows]
+
+        # emit the fan: every live triangle around the vertex. A degenerate
+        # triangle has the vertex in two or three corners and so as many
+        # entries, next to each other, of which only the first counts
+        count = degree[vertices]
+        columns = np.arange(count.max())
+        valid = columns < count[:, None]
+        fan_triangles = adjacent[np.where(valid, first[vertices, None] + columns, 0)]
+        valid &= ~emitted[fan_triangles]
+        valid[:, 1:] &= fan_triangles[:, 1:] != fan_triangles[:, :-1]
+        emitted[fan_triangles[valid]] = True
+        order_lanes.append(np.broadcast_to(rows[:, None], valid.shape)[valid])
+        order_triangles.append(fan_triangles[valid])
+
+        corners = np.where(np.repeat(valid, 3, axis=1), local[fan_triangles].reshape(len(rows), -1), -1)
+        used = corners >= 0
+        np.subtract.at(live, corners[used], 1)
+
+        # every corner goes on the stack
+        pushed = used.sum(axis=1)
+        slots = top[rows, None] + np.cumsum(used, axis=1) - 1
+        stack[np.broadcast_to(rows[:, None], used.shape)[used], slots[used] % STACK_SIZE] = corners[used]
+        top[rows] += pushed
+        bottom[rows] = np.maximum(bottom[rows], top[rows] - STACK_SIZE)
+
+        # each distinct vertex of the fan that was not cached is now
+        corners.sort(axis=1)
+        distinct = corners >= 0
+        distinct[:, 1:] &= corners[:, 1:] != corners[:, :-1]
+        corners = np.maximum(corners, 0)
+        age = time[rows, None] - cache_time[corners]
+        missed = distinct & (age > cache_size)
+        ranks = time[rows, None] + np.cumsum(missed, axis=1) - 1
+        cache_time[corners[missed]] = ranks[missed]
+        time[rows] += missed.sum(axis=1)
+
+        # the next fan is the live vertex of this one that leaves the cache
+        # soonest while it still has triangles left, or any live one
+        age = time[rows, None] - cache_time[corners]
+        remaining = live[corners]
+        priority = np.where(age + 2 * remaining <= cache_size, age, 0)
+        priority = np.where(distinct & (remaining > 0), priority, -1)
+        best = priority.argmax(axis=1)
+        pick = np.arange(len(rows))
+        fan[rows] = np.where(priority[pick, best] >= 0, corners[pick, best], -1)
+
+    order_lanes = np.concatenate(order_lanes)
+    order_triangles = np.concatenate(order_triangles)
+    # every triangle exactly once, anything else would leave holes
+    if len(order_triangles) != len(triangles) or not emitted.all():
+        raise RuntimeError(f"triangle reorder emitted {len(order_triangles)} of {len(triangles)} triangles")
+    return order_triangles[np.argsort(order_lanes, kind="stable")]
+
+
+def cluster_order(corners: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    # orders the clusters, runs of the (T, 3, 3) triangle corners beginning
+    # at starts, by how far their surface lies out along its own normal from
+    # the center of the mesh, so outer surfaces are drawn before what they
+    # hide from most directions
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    weighted = corners.mean(axis=1) * areas[:, None]
+    center = weighted.sum(axis=0) / max(float(areas.sum()), 1e-12)
+
+    cluster_normals = np.add.reduceat(normals, starts)
+    cluster_normals /= np.maximum(np.linalg.norm(cluster_normals, axis=1), 1e-12)[:, None]
+    cluster_centers = np.add.reduceat(weighted, starts) / np.maximum(np.add.reduceat(areas, starts), 1e-12)[:, None]
+    return np.argsort(-((cluster_centers - center) * cluster_normals).sum(axis=1), kind="stable")
+
+
+def reorder_triangles(triangles: np.ndarray, positions: np.ndarray, cache_size: int = CACHE_SIZE) -> np.ndarray:
+    # (T, 3) triangles -> the same triangles in vertex cache and overdraw
+    # friendly order, with their winding kept
+    positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+    triangles = triangles.astype(np.int64)
+    corners = positions[triangles]
+    spatial = morton_order(corners.mean(axis=1))
+    triangles, corners = triangles[spatial], corners[spatial]
+    lane_count = -(-len(triangles) // CLUSTER_SIZE)
+    lanes = np.arange(len(triangles)) // CLUSTER_SIZE
+
+    ordered = tipsify(triangles, lanes, lane_count, cache_size)
+    rank = np.empty(lane_count, dtype=np.int64)
+    rank[cluster_order(corners, np.arange(0, len(triangles), CLUSTER_SIZE))] = np.arange(lane_count)
+    # the tipsify order is lane by lane, so the lane of each position is known
+    return triangles[ordered[np.argsort(rank[lanes], kind="stable")]]
+
+
+def reorder_vertices(indices: np.ndarray, vertex_count: int) -> tuple[np.ndarray, np.ndarray]:
+    # vertices in the order the indices first use them, unused ones last.
+    # Returns the new order and the remap from old to new vertex
+    used, first_use = np.unique(indices, return_index=True)
+    first = np.full(vertex_count, len(indices), dtype=np.int64)
+    first[used] = first_use
+    order = np.argsort(first, kind="stable")
+    remap = np.empty(vertex_count, dtype=np.int64)
+    remap[order] = np.arange(vertex_count)
+    return order, remap
+
+
+def cache_misses(indices: np.ndarray, cache_size: int = CACHE_SIZE) -> int:
+    # vertex shader invocations of the indices behind a FIFO cache, replayed
+    # in lanes of SIMULATION_CHUNK indices side by side. A vertex is cached
+    # while fewer than cache_size misses followed its own
+    indices = np.asarray(indices, dtype=np.int64).ravel()
+    if not len(indices):
+        return 0
+    chunk = min(SIMULATION_CHUNK, len(indices))
+    warmup = 4 * cache_size if chunk < len(indices) else 0
+    lane_count = -(-len(indices) // chunk)
+    steps = np.arange(-warmup, chunk) + np.arange(lane_count)[:, None] * chunk
+    valid = (steps >= 0) & (steps < len(indices))
+    # every lane has copies of its vertices, like the clusters of tipsify
+    keys = np.arange(lane_count)[:, None] * (int(indices.max()) + 1) + indices[np.clip(steps, 0, len(indices) - 1)]
+    _, stream = np.unique(keys, return_inverse=True)
+    stream = stream.reshape(steps.shape)
+
+    inserted = np.full(int(stream.max()) + 1, -cache_size - 1, dtype=np.int64)
+    misses = np.zeros(lane_count, dtype=np.int64)
+    for step in range(steps.shape[1]):
+        if step == warmup:
+            warm = misses.copy()
+        vertices = stream[:, step]
+        missed = valid[:, step] & (misses - inserted[vertices] > cache_size)
+        inserted[vertices[missed]] = misses[missed]
+        misses += missed
+    return int((misses - warm).sum())
+
+
+def cache_stats(indices: np.ndarray, cache_size: int = CACHE_SIZE) -> tuple[float, float]:
+    # average cache miss ratio (misses per triangle, 0.5 at best on closed
+    # meshes, 3 at worst) and average transform to vertex ratio (misses per
+    # vertex used, 1 at best)
+    misses = cache_misses(indices, cache_size)
+    triangles = len(indices) // 3
+    vertices = int(np.count_nonzero(np.bincount(np.asarray(indices, dtype=np.int64).ravel()))) if len(indices) else 0
+    return misses / max(triangles, 1), misses / max(vertices, 1)
+
+
+def format_cache_stats(stats: dict[str, tuple[float, float]]) -> str:
+    return ", ".join(f"{name} {before:.3f} -> {after:.3f}" for name, (before, after) in stats.items())
@@ -0,0 +1,108 @@
+import os, hashlib
+import numpy as np
+
+from modules.formats import TextureFormat, texture_formats
+from modules.images import DecodedImage, decode_image
+from config import CACHE_DIR, TEXTURE_CACHE, TEXTURE_COMPRESSION
+
+MIP_CACHE_MAGIC = b"PYMIPS"
+MIP_CACHE_VERSION = 1
+MIP_CACHE_SUFFIX = ".mips"
+MIP_CACHE_DIR = os.path.join(CACHE_DIR, "textures")
+MAX_LEVELS = 16
+
+mip_cache_header = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("internal_format", "<u4"),
+    ("source_size", "<u8"),
+    ("source_mtime_ns", "<u8"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("level_count", "<u4"),
+    ("level_sizes", "<u8", MAX_LEVELS),
+])
+
+
+def mip_cache_path(path: str, srgb: bool, flip: bool, mipmaps: bool) -> str | None:
+    # one file per source and set of options that change what is stored,
+    # None with the cache turned off
+    if not TEXTURE_CACHE:
+        return None
+    key = f"{os.path.realpath(path)}\0{srgb:d}\0{flip:d}\0{mipmaps:d}\0{TEXTURE_COMPRESSION:d}"
+    return os.path.join(MIP_CACHE_DIR, f"{hashlib.sha1(key.encode()).hexdigest()}{MIP_CACHE_SUFFIX}")
+
+
+def read_mip_cache(cache_path: str, path: str) -> tuple[TextureFormat, DecodedImage] | None:
+    # the levels are views into a read-only memory map of the cache file,
+    # ready to upload in the stored format. None if the cache is missing or
+    # was built from a different version of the source
+    if cache_path is None:
+        return None
+    try:
+        source = os.stat(path)
+        if os.path.getsize(cache_path) < mip_cache_header.itemsize:
+            return None
+        buffer = np.memmap(cache_path, dtype="uint8", mode="r")
+    except OSError:
+        return None
+
+    header = buffer[:mip_cache_header.itemsize].view(mip_cache_header)[0]
+    if (header["magic"] != MIP_CACHE_MAGIC
+            or header["version"] != MIP_CACHE_VERSION
+            or header["source_size"] != source.st_size
+            or header["source_mtime_ns"] != source.st_mtime_ns
+            or int(header["internal_format"]) not in texture_formats):
+        return None
+
+    fmt = texture_formats[int(header["internal_format"])]
+    size = (int(header["width"]), int(header["height"]))
+    levels = []
+    offset = mip_cache_header.itemsize
+    for length in header["level_sizes"][:int(header["level_count"])].tolist():
+        levels.append(buffer[offset:offset + length])
+        offset += length
+    if offset != len(buffer):
+        return None
+    return fmt, DecodedImage(path, size, fmt.mode, levels)
+
+
+def write_mip_cache(cache_path: str, path: str, fmt: TextureFormat, image: DecodedImage) -> bool:
+    source = os.stat(path)
+    header = np.zeros((), dtype=mip_cache_header)
+    header["magic"] = MIP_CACHE_MAGIC
+    header["version"] = MIP_CACHE_VERSION
+    header["internal_format"] = fmt.internal_format
+    header["source_size"] = source.st_size
+    header["source_mtime_ns"] = source.st_mtime_ns
+    header["width"], header["height"] = image.size
+    header["level_count"] = len(image.levels)
+    header["level_sizes"][:len(image.levels)] = [len(data) for data in image.levels]
+
+    temp_path = f"{cache_path}.{os.getpid()}.{id(image)}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(header.tobytes())
+            for data in image.levels:
+                f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print("Could not write mip cache: ", e)
+        return False
+    return True
+
+
+def cook_image(path: str, fmt: TextureFormat, flip: bool = False, levels: int = 1, cache_path: str = None) -> DecodedImage:
+    # decodes the image with its mip levels, encodes them in fmt and stores
+    # the result for the next run. Touches no GL, so it runs on the image
+    # loader's threads
+    image = decode_image(path, fmt.mode, flip, levels)
+    width, height = image.size
+    image.levels = [
+        fmt.encode(data, (max(width >> level, 1), max(height >> level, 1)))
+        for level, data in enumerate(image.levels)
+    ]
+    if cache_path is not None:
+        write_mip_cache(cache_path, path, fmt, image)
+    return image
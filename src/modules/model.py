@@ -1,4 +1,4 @@
-import glm, ctypes, tinyobjloader
+import glm, ctypes, time
 import numpy as np
 from OpenGL.GL import *
 from typing import Literal
@@ -6,30 +6,140 @@ from typing import Literal
 from modules.figures import Primitive
 from modules.materials import materials
 from modules.structures import Material, TextureMaterial
-from modules.funcs import load_shaders, load_cubemap
-from config import SHADERS_DIR, MODELS_DIR, SOURCES_DIR
+from modules.funcs import load_cubemap
+from modules.shaders import programs, get_uniforms
+from modules.transforms import Node, transforms
+from modules.renderqueue import GLState, PASS_BACKGROUND, PASS_OPAQUE, PASS_WEIGHTED, PASS_TRANSLUCENT
+from modules.mesh import MeshData, load_mesh, optimize_mesh, format_timings
+from modules.meshopt import format_cache_stats, index_dtype
+from modules.arena import STREAMS, geometry, sizeof_index
+from modules.buffers import instance_dtype, material_table, texture_material_table, set_instance_attributes
+from config import SHADERS_DIR, MODELS_DIR, SOURCES_DIR, MESH_CACHE, MESH_OPTIMIZE
 
 sizeof_float = ctypes.sizeof(ctypes.c_float)
 void_p = ctypes.c_void_p
 
-class Model:
+class GpuMesh:
+    def __init__(self, mesh: MeshData, layout: str = "pnt", key: tuple = None):
+        # layout lists the attribute streams to upload:
+        # p - positions (location 0), n - normals (1), t - texcoords (2).
+        # The data goes into the shared geometry arena, the mesh only keeps
+        # its vertex and index ranges there.
+        self.key = key
+        self.layout = layout
+        self.ref_count = 0
+
+        self.vertex_count = len(mesh.positions)
+        self.index_count = len(mesh.indices)
+        self.bounds = mesh.bounds
+        self.sphere = mesh.sphere
+        # what the arena stores the indices as
+        self.index_dtype = np.dtype(index_dtype(self.vertex_count))
+        self.index_type = GL_UNSIGNED_SHORT if self.index_dtype.itemsize == 2 else GL_UNSIGNED_INT
+
+        self.vertices, self.indices = geometry.add(mesh, layout)
+        self.size = self.vertex_count * sum(components for name, _, components in STREAMS if name[0] in layout or name == "positions") * sizeof_float + self.index_count * self.index_dtype.itemsize
+
+    @property
+    def vao(self) -> int:
+        return geometry.vao
+
+    @property
+    def vbo(self) -> int:
+        return geometry.buffers[0]
+
+    @property
+    def ebo(self) -> int:
+        return geometry.ebo
+
+    @property
+    def base_vertex(self) -> int:
+        return self.vertices.offset
+
+    @property
+    def first_index(self) -> int:
+        # in indices of the mesh's own type, as draw commands count them
+        return self.indices.offset * sizeof_index // self.index_dtype.itemsize
+
+    @property
+    def index_offset(self) -> int:
+        # in bytes, as the element buffer offset of a draw call
+        return self.indices.offset * sizeof_index
+
+    def create_vertex_array(self) -> int:
+        # a vertex array over the arena buffers, left bound so models that add
+        # attributes of their own (instancing) can extend it
+        return geometry.create_vertex_array()
+
+    def delete(self):
+        if self.vertices is not None:
+            geometry.free(self.vertices, self.indices)
+        self.vertices = self.indices = None
+
+    def __repr__(self):
+        return f"GpuMesh(key={self.key}, vertices={self.vertex_count}, indices={self.index_count}, refs={self.ref_count})"
+
+
+class MeshRegistry:
+    def __init__(self):
+        self.meshes: dict[tuple, GpuMesh] = {}
+
+    def acquire(self, source: str, loader, layout: str = "pnt") -> GpuMesh:
+        # loader is only called when (source, layout) has not been uploaded yet
+        key = (source, layout)
+        mesh = self.meshes.get(key)
+        if mesh is None:
+            mesh = GpuMesh(loader(), layout, key)
+            self.meshes[key] = mesh
+        mesh.ref_count += 1
+        return mesh
+
+    def release(self, mesh: GpuMesh):
+        # also accepts the unregistered meshes Model builds from raw arrays
+        mesh.ref_count -= 1
+        if mesh.ref_count <= 0:
+            if self.meshes.get(mesh.key) is mesh:
+                del self.meshes[mesh.key]
+            mesh.delete()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.meshes
+
+    def __len__(self) -> int:
+        return len(self.meshes)
+
+    def memory_usage(self) -> int:
+        return sum(mesh.size for mesh in self.meshes.values())
+
+
+class Model(Node):
+    meshes = MeshRegistry()
+    # whether the scene may skip the model by testing its mesh bounds
+    cullable = True
+    # binds only through the GLState it is given
+    uses_gl_state = True
+    # bumped on every material assignment, batches built from models compare it
+    material_changes = 0
+
     def __init__(self, 
-                 vertices: np.ndarray,
-                 vertex_indices: np.ndarray,
+                 vertices: np.ndarray = None,
+                 vertex_indices: np.ndarray = None,
                  normals: np.ndarray = None,
                  texcoords: np.ndarray = None,
                  mode: str | Literal["light", "l", "materials", "m", "textures", "t", "custom"] = "materials",
                  material: str | Material | TextureMaterial = None,
                  vertexShader: str = None, 
                  fragmentShader: str = None,
-                 geometryShader:str = None):
-        self.vao = GLuint(0)
-        self.vbo = GLuint(0)
-        self.ebo = GLuint(0)
-
-        glGenVertexArrays(1, self.vao)
-        glGenBuffers(1, self.vbo)
-        glGenBuffers(1, self.ebo)
+                 geometryShader:str = None,
+                 mesh: GpuMesh = None,
+                 shaderDefines: dict = None,
+                 static: bool = False):
+        # either a shared mesh from Model.meshes or raw arrays which get an
+        # unregistered mesh of their own
+        if mesh is None:
+            mesh = GpuMesh(MeshData(vertices, vertex_indices, normals, texcoords))
+            mesh.ref_count = 1
+        self.mesh = mesh
 
         self.mode = mode
         self.material = None
@@ -77,45 +187,87 @@ class Model:
         vertexShaderPath = f"{SHADERS_DIR}/{vertexShader}"
         fragmentShaderPath = f"{SHADERS_DIR}/{fragmentShader}"
         geometryShaderPath = f"{SHADERS_DIR}/{geometryShader}" if geometryShader is not None else None
-        self.shaderProgram = load_shaders(
+        self.shaderProgram = programs.acquire(
             vertexShaderPath, 
             fragmentShaderPath,
-            geometryShaderPath
+            geometryShaderPath,
+            shaderDefines
+        )
+        self.shaderPaths = (vertexShaderPath, fragmentShaderPath, geometryShaderPath)
+        self.shaderDefines = shaderDefines
+        self.weightedShaderProgram = None
+        # never moves after being added to a scene, which bakes it into a
+        # StaticBatch with the other static models of its program and material
+        self.static = static
+
+        Node.__init__(self)
+
+    @property
+    def material(self) -> Material | TextureMaterial | None:
+        return self._material
+
+    @material.setter
+    def material(self, material: Material | TextureMaterial | None):
+        self._material = material
+        Model.material_changes += 1
+
+    @property
+    def indirect(self) -> bool:
+        # plain opaque material and texture models are drawn by the scene's
+        # IndirectDraws
+        return (
+            self.mode in ["materials", "m", "textures", "t"]
+            and self.shaderDefines is None
+            and self.shaderPaths[2] is None
+            and self.render_pass == PASS_OPAQUE
         )
 
-        self.vertex_count = len(vertices)
-        self.index_count = len(vertex_indices)
-
-        vertices_size = vertices.nbytes
-        normals_size = normals.nbytes if normals is not None else 0
-        texcoords_size = texcoords.nbytes if texcoords is not None else 0
-
-        glBindVertexArray(self.vao)
-
-        buffer_size = vertices_size + normals_size + texcoords_size
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, buffer_size, None, GL_STATIC_DRAW)
-
-        glBufferSubData(GL_ARRAY_BUFFER, 0, vertices_size, vertices.data)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * sizeof_float, void_p(0))
-        glEnableVertexAttribArray(0)
-
-        if normals is not None:
-            glBufferSubData(GL_ARRAY_BUFFER, vertices_size, normals_size, normals.data)
-            glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 3 * sizeof_float, void_p(vertices_size))
-            glEnableVertexAttribArray(1)
-
-        if texcoords is not None:
-            glBufferSubData(GL_ARRAY_BUFFER, vertices_size + normals_size, texcoords_size, texcoords.data)
-            glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, 2 * sizeof_float, void_p(vertices_size + normals_size))
-            glEnableVertexAttribArray(2)
-
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, vertex_indices.nbytes, vertex_indices.data, GL_STATIC_DRAW)
-
-        glBindVertexArray(0)
-
-        self.model_matrix = glm.mat4(1)
+    @property
+    def render_pass(self) -> int:
+        # materials with transparency are blended over the opaque geometry
+        if isinstance(self.material, Material) and self.material.transparency > 0:
+            return PASS_TRANSLUCENT
+        return PASS_OPAQUE
+
+    @property
+    def weighted_program(self) -> int | None:
+        # the same shaders writing the order independent transparency
+        # targets, only fs.glsl has them
+        if not self.shaderPaths[1].endswith("/fs.glsl"):
+            return None
+        if self.weightedShaderProgram is None:
+            self.weightedShaderProgram = programs.acquire(
+                *self.shaderPaths,
+                {**(self.shaderDefines or {}), "WEIGHTED_OIT": 1}
+            )
+        return self.weightedShaderProgram
+
+    @property
+    def vao(self):
+        return self.mesh.vao
+
+    @property
+    def vbo(self):
+        return self.mesh.vbo
+
+    @property
+    def ebo(self):
+        return self.mesh.ebo
+
+    @property
+    def vertex_count(self) -> int:
+        return self.mesh.vertex_count
+
+    @property
+    def index_count(self) -> int:
+        return self.mesh.index_count
+
+    def release(self):
+        Model.meshes.release(self.mesh)
+        programs.release(self.shaderProgram)
+        if self.weightedShaderProgram is not None:
+            programs.release(self.weightedShaderProgram)
+        self.transform.release()
     
     @classmethod
     def from_figure(cls,
@@ -124,21 +276,30 @@ class Model:
                     material: str | Material | TextureMaterial = None,
                     vertexShader: str = None, 
                     fragmentShader: str = None,
-                    geometryShader: str = None):
-        vertices = figure.vertices
-        indices = figure.indices if figure.indices is not None else np.arange(len(vertices), dtype="uint32")
-        normals = figure.normals if figure.normals is not None else None
-        texcoords = figure.texcoords if figure.texcoords is not None else None
+                    geometryShader: str = None,
+                    layout: str = "pnt",
+                    shaderDefines: dict = None,
+                    optimize: bool = MESH_OPTIMIZE,
+                    **kwargs: any):
+        def load():
+            vertices = figure.vertices
+            indices = figure.indices if figure.indices is not None else np.arange(len(vertices), dtype="uint32")
+            mesh = MeshData(vertices, indices, figure.normals, figure.texcoords)
+            if optimize:
+                mesh = optimize_mesh(mesh)
+            if mesh.cache_stats:
+                print(f"{figure.__qualname__}: {format_cache_stats(mesh.cache_stats)}")
+            return mesh
+
         return cls(
-            vertices,
-            indices,
-            normals,
-            texcoords,
             mode = mode,
             material = material,
             vertexShader = vertexShader, 
             fragmentShader = fragmentShader,
-            geometryShader = geometryShader
+            geometryShader = geometryShader,
+            mesh = Model.meshes.acquire(f"figure:{figure.__module__}.{figure.__qualname__}", load, layout),
+            shaderDefines = shaderDefines,
+            **kwargs
         )
     
     @classmethod
@@ -148,41 +309,41 @@ class Model:
                    material: str | Material | TextureMaterial = None,
                    vertexShader: str = None, 
                    fragmentShader: str = None,
-                   geometryShader: str = None):
-        reader = tinyobjloader.ObjReader()
-
-        print(f"loading {filename}")
-
-        if not reader.ParseFromFile(f"{MODELS_DIR}/{filename}"):
-            print("Failed to load : ", filename)
-            print("Warn:", reader.Warning())
-            print("Err:", reader.Error())
-
-        if reader.Warning():
-            print("Warn:", reader.Warning())
-
-        print(f"{filename} loaded succesfully")
-
-        attrib = reader.GetAttrib()
-        shapes = reader.GetShapes()
-        materials = reader.GetMaterials()
-
-        vertices = np.array(attrib.vertices, dtype = 'float32').reshape(-1, 3)
-        normals = np.array(attrib.normals, dtype = 'float32').reshape(-1, 3)
-        texcoords = np.array(attrib.texcoords, dtype = 'float32').reshape(-1, 2)
-
-        vertex_indices = np.array([index.vertex_index for shape in shapes for index in shape.mesh.indices], dtype = 'uint32')
-        return cls(
-            vertices,
-            vertex_indices,
-            normals,
-            texcoords,
+                   geometryShader: str = None,
+                   cache: bool = MESH_CACHE,
+                   layout: str = "pnt",
+                   shaderDefines: dict = None,
+                   optimize: bool = MESH_OPTIMIZE,
+                   **kwargs: any):
+        timings = {}
+
+        def load():
+            print(f"loading {filename}")
+            mesh = load_mesh(f"{MODELS_DIR}/{filename}", cache=cache, optimize=optimize)
+            print(f"{filename} loaded succesfully")
+            if mesh.cache_stats:
+                print(f"{filename}: {format_cache_stats(mesh.cache_stats)}")
+            timings.update(mesh.timings)
+            return mesh
+
+        start = time.perf_counter()
+        mesh = Model.meshes.acquire(f"{MODELS_DIR}/{filename}", load, layout)
+        timings["upload" if timings else "shared mesh"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model = cls(
             mode = mode,
             material = material,
             vertexShader = vertexShader, 
             fragmentShader = fragmentShader,
-            geometryShader = geometryShader
+            geometryShader = geometryShader,
+            mesh = mesh,
+            shaderDefines = shaderDefines,
+            **kwargs
         )
+        timings["init"] = time.perf_counter() - start
+        print(f"{filename}: {format_timings(timings)}")
+        return model
 
     def render(self, 
                projection_matrix: glm.mat4 = glm.mat4(1),
@@ -194,65 +355,177 @@ class Model:
                point_lights = None,
                spot_lights = None,
                skybox = None,
+               state: GLState = None,
+               render_pass: int = None,
                **kwargs: any):
-        view_pos = view_position
+        # camera, time and resolution come from the FrameData uniform block
+        # and the lights from the storage buffers the scene uploads per frame.
+        # Without a state shadow from the render queue every bind happens and
+        # everything is unbound afterwards.
+        standalone = state is None
+        if standalone:
+            state = GLState()
+            material_table.bind()
+            texture_material_table.bind()
+        program = self.weighted_program if render_pass == PASS_WEIGHTED else self.shaderProgram
+        uniforms = get_uniforms(program)
+
+        if state.use_program(program):
+            # first use of the program this frame
+            if uniforms.loose_frame_uniforms:
+                # custom shaders that still declare them as plain uniforms
+                glUniform2fv(uniforms["resolution"], 1, resolution)
+                glUniform1f(uniforms["time"], time)
+                glUniform3fv(uniforms["viewPos"], 1, glm.value_ptr(view_position))
+                glUniformMatrix4fv(uniforms["projection"], 1, GL_FALSE, glm.value_ptr(projection_matrix))
+                glUniformMatrix4fv(uniforms["view"], 1, GL_FALSE, glm.value_ptr(view_matrix))
+
+            if uniforms.loose_light_uniforms and self.mode not in ["light", "l"]:
+                for lights in (dir_lights, point_lights, spot_lights):
+                    for i, light in enumerate(lights or ()):
+                        light.set_uniforms(program, i)
+
+            if self.mode not in ["light", "l"]:
+                glUniform1i(uniforms["skybox"], 2)
+
+        # straight from the transform store, rows are [row][column]
+        row = self.transform.row
+        transforms.refresh()
+        glUniformMatrix4fv(uniforms["model"], 1, GL_TRUE, transforms.world_pointer(row))
+        glUniformMatrix3fv(uniforms["normalMatrix"], 1, GL_TRUE, transforms.normal_pointer(row))
 
-        glUseProgram(self.shaderProgram)
-
-        glUniform2fv(glGetUniformLocation(self.shaderProgram, "resolution"), 1, resolution)
-        glUniform1f(glGetUniformLocation(self.shaderProgram, "time"), time)
-
-        glUniform3fv(glGetUniformLocation(self.shaderProgram, "viewPos"), 1, glm.value_ptr(view_pos))
+        if self.material is not None:
+            if state.set_material(program, self.material):
+                self.material.set_uniforms(program, state=state)
+            elif isinstance(self.material, TextureMaterial):
+                self.material.bind_textures(state)
 
-        if self.mode not in ["light", "l"]:
-            if dir_lights is not None:
-                for i, light in enumerate(dir_lights):
-                    light.set_uniforms(self.shaderProgram, i)
+        # the element buffer is part of the vertex array state
+        state.bind_vertex_array(self.vao)
+        if self.mode not in ["light", "l"] and skybox is not None:
+            state.bind_texture(2, GL_TEXTURE_CUBE_MAP, skybox.texture)
+        self.draw()
+        state.count("draw calls")
 
-            if point_lights is not None:
-                for i, light in enumerate(point_lights):
-                    light.set_uniforms(self.shaderProgram, i)
+        if standalone:
+            state.unbind()
+        return self
 
-            if spot_lights is not None:
-                for i, light in enumerate(spot_lights):
-                    light.set_uniforms(self.shaderProgram, i)
+    def draw(self):
+        mesh = self.mesh
+        glDrawElementsBaseVertex(GL_TRIANGLES, mesh.index_count, mesh.index_type, void_p(mesh.index_offset), mesh.base_vertex)
 
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderProgram, "projection"), 1, GL_FALSE, glm.value_ptr(projection_matrix))
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderProgram, "view"), 1, GL_FALSE, glm.value_ptr(view_matrix))
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderProgram, "model"), 1, GL_FALSE, glm.value_ptr(self.model_matrix))
 
-        if self.material is not None:
-            self.material.set_uniforms(self.shaderProgram)
+class InstancedModel(Model):
+    # many copies of one mesh drawn with a single glDrawElementsInstanced.
+    # Every instance has its own model matrix, normal matrix and index into
+    # instance_materials, kept in one numpy array and one vertex buffer.
+    cullable = False
+    indirect = False
 
-        glBindVertexArray(self.vao)
-        if self.mode not in ["light", "l"] and skybox is not None:
-            glUniform1i(glGetUniformLocation(self.shaderProgram, "skybox"), 2)
-            glActiveTexture(GL_TEXTURE2)
-            glBindTexture(GL_TEXTURE_CUBE_MAP, skybox.texture)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        glDrawElements(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None)
-
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+    def __init__(self,
+                 count: int = 1,
+                 instance_materials: list[Material] = None,
+                 shaderDefines: dict = None,
+                 **kwargs: any):
+        super().__init__(shaderDefines={"INSTANCED": 1, **(shaderDefines or {})}, **kwargs)
+
+        self.instances = np.zeros(count, dtype=instance_dtype)
+        self.instances["model"] = np.eye(4, dtype="float32")
+        self.instances["normal_matrix"] = np.eye(3, dtype="float32")
+        self.dirty = True
+
+        self.instance_vbo = GLuint(0)
+        glGenBuffers(1, self.instance_vbo)
+        self.instance_capacity = 0
+
+        # own vertex array, the mesh one may be shared with other models
+        self.instance_vao = self.mesh.create_vertex_array()
+        set_instance_attributes(self.instance_vbo)
         glBindVertexArray(0)
-        glUseProgram(0)
-        return self
 
-    def translate(self, pos: glm.vec3):
-        self.model_matrix = glm.translate(self.model_matrix, pos)
-        return self
+        # material_index of an instance points into instance_materials, the
+        # uploaded records point into the material table
+        self.instance_materials = []
+        self.material_slots = np.zeros(1, dtype=np.int32)
+        if isinstance(self.material, (Material, TextureMaterial)):
+            self.set_materials(instance_materials or [self.material])
+
+    @property
+    def vao(self):
+        return self.instance_vao
+
+    @property
+    def render_pass(self) -> int:
+        # instances are not sorted among themselves, weighted blended
+        # transparency keeps their order from mattering
+        if any(isinstance(material, Material) and material.transparency > 0 for material in self.instance_materials):
+            return PASS_TRANSLUCENT
+        return PASS_OPAQUE
+
+    @property
+    def count(self) -> int:
+        return len(self.instances)
+
+    def resize(self, count: int):
+        instances = np.zeros(count, dtype=instance_dtype)
+        instances["model"] = np.eye(4, dtype="float32")
+        instances["normal_matrix"] = np.eye(3, dtype="float32")
+        kept = min(count, self.count)
+        instances[:kept] = self.instances[:kept]
+        self.instances = instances
+        self.dirty = True
+
+    def set_transforms(self, model_matrices: np.ndarray, start: int = 0):
+        # model_matrices is an (N, 4, 4) array laid out like np.asarray(glm.mat4),
+        # i.e. [row][column]; the buffer wants columns, so both are transposed
+        model_matrices = np.asarray(model_matrices, dtype="float32")
+        end = start + len(model_matrices)
+        self.instances["model"][start:end] = model_matrices.transpose(0, 2, 1)
+        # transpose(inverse(m)) stored column by column is inverse(m) row by row
+        self.instances["normal_matrix"][start:end] = np.linalg.inv(model_matrices[:, :3, :3])
+        self.dirty = True
+
+    def set_material_indices(self, indices: np.ndarray, start: int = 0):
+        self.instances["material_index"][start:start + len(indices)] = indices
+        self.dirty = True
+
+    def set_materials(self, instance_materials: list[Material | TextureMaterial]):
+        # texture materials have to share the arrays of self.material, which
+        # are the ones bound for the draw
+        self.instance_materials = list(instance_materials)
+        self.material_slots = np.array([material.index for material in self.instance_materials], dtype=np.int32)
+        self.dirty = True
+
+    def upload(self):
+        # the whole instance array in one call, reallocated only when it grew
+        instances = self.instances.copy()
+        instances["material_index"] = self.material_slots[self.instances["material_index"]]
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        if self.count > self.instance_capacity:
+            glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_DYNAMIC_DRAW)
+            self.instance_capacity = self.count
+        else:
+            glBufferSubData(GL_ARRAY_BUFFER, 0, instances.nbytes, instances)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.dirty = False
+
+    def draw(self):
+        if self.dirty:
+            self.upload()
+        mesh = self.mesh
+        glDrawElementsInstancedBaseVertex(GL_TRIANGLES, mesh.index_count, mesh.index_type, void_p(mesh.index_offset), self.count, mesh.base_vertex)
+
+    def release(self):
+        geometry.delete_vertex_array(self.instance_vao)
+        glDeleteBuffers(1, self.instance_vbo)
+        super().release()
 
-    def scale(self, scalers: glm.vec3):
-        self.model_matrix = glm.scale(self.model_matrix, scalers)
-        return self
-
-    def rotate(self, angles: glm.vec3):
-        angles = glm.radians(angles)
-        self.model_matrix = glm.rotate(self.model_matrix, angles.x, glm.vec3(1, 0, 0))
-        self.model_matrix = glm.rotate(self.model_matrix, angles.y, glm.vec3(0, 1, 0))
-        self.model_matrix = glm.rotate(self.model_matrix, angles.z, glm.vec3(0, 0, 1))
-        return self
 
 class Skybox:
+    render_pass = PASS_BACKGROUND
+    uses_gl_state = True
+
     def __init__(self,
                  directory: str = "skybox",
                  vertexShader: str = "vs_skybox.glsl", 
@@ -263,7 +536,7 @@ class Skybox:
         glGenVertexArrays(1, self.vao)
         glGenBuffers(1, self.vbo)
 
-        self.shaderProgram = load_shaders(f"{SHADERS_DIR}/{vertexShader}", f"{SHADERS_DIR}/{fragmentShader}")
+        self.shaderProgram = programs.acquire(f"{SHADERS_DIR}/{vertexShader}", f"{SHADERS_DIR}/{fragmentShader}")
         self.texture = load_cubemap(f"{SOURCES_DIR}/cubemaps/{directory}")
 
         skyboxVertices = np.array([
@@ -314,26 +587,32 @@ class Skybox:
         glBindVertexArray(self.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, skyboxVertices.nbytes, skyboxVertices.data, GL_STATIC_DRAW)
+        glBufferData(GL_ARRAY_BUFFER, skyboxVertices.nbytes, skyboxVertices, GL_STATIC_DRAW)
         glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * sizeof_float, void_p(0))
         glEnableVertexAttribArray(0)
 
         glBindVertexArray(0)
 
     def render(self,
-               projection_matrix,
-               view_matrix,
+               projection_matrix = None,
+               view_matrix = None,
+               state: GLState = None,
                **kwargs: any):
-        glDepthMask(GL_FALSE)
+        standalone = state is None
+        if standalone:
+            state = GLState()
 
-        glUseProgram(self.shaderProgram)
+        state.depth_mask(False)
 
-        view_matrix = glm.mat4(glm.mat3(view_matrix))
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderProgram, "projection"), 1, GL_FALSE, glm.value_ptr(projection_matrix))
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderProgram, "view"), 1, GL_FALSE, glm.value_ptr(view_matrix))
+        if state.use_program(self.shaderProgram):
+            glUniform1i(get_uniforms(self.shaderProgram)["skybox"], 0)
 
-        glBindVertexArray(self.vao)
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self.texture)
+        state.bind_vertex_array(self.vao)
+        # an explicit unit, the active one is whatever was bound last
+        state.bind_texture(0, GL_TEXTURE_CUBE_MAP, self.texture)
         glDrawArrays(GL_TRIANGLES, 0, 36)
+        state.count("draw calls")
 
-        glDepthMask(GL_TRUE)
\ No newline at end of file
+        state.depth_mask(True)
+        if standalone:
+            state.unbind()
\ No newline at end of file
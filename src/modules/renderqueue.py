@@ -0,0 +1,221 @@
+import numpy as np
+from OpenGL.GL import *
+
+from modules.stats import FrameStats
+from modules.transforms import transforms
+
+PASS_BACKGROUND = 0
+PASS_OPAQUE = 1
+# order independent translucency, see modules/transparency.py
+PASS_WEIGHTED = 2
+# sorted back to front, drawn last with depth writes off
+PASS_TRANSLUCENT = 3
+
+# sort key layout, most significant first: pass, program, material, mesh, depth.
+# Translucent keys hold only the pass and the inverted depth below it.
+PASS_SHIFT, PASS_BITS = 60, 4
+PROGRAM_SHIFT, PROGRAM_BITS = 48, 12
+MATERIAL_SHIFT, MATERIAL_BITS = 32, 16
+MESH_SHIFT, MESH_BITS = 16, 16
+DEPTH_BITS = 16
+DEPTH_MAX = (1 << DEPTH_BITS) - 1
+TRANSLUCENT_DEPTH_SHIFT = PASS_SHIFT - DEPTH_BITS
+
+
+class GLState:
+    # shadow of the GL bindings the render queue touches, so that repeated
+    # binds of the same object are skipped. Anything drawing behind its back
+    # has to call invalidate().
+    def __init__(self, stats: FrameStats = None):
+        self.stats = stats
+        self.invalidate()
+
+    def invalidate(self):
+        self.program = None
+        self.vao = None
+        self.active_unit = None
+        self.textures: dict[int, tuple[int, int]] = {}
+        self.depth_writes = None
+        self.blending = None
+        # per frame: programs whose shared uniforms were set and the material
+        # last uploaded to each program
+        self.prepared_programs: set[int] = set()
+        self.materials: dict[int, object] = {}
+
+    def count(self, name: str, amount: int = 1):
+        if self.stats is not None:
+            self.stats.count(name, amount)
+
+    def use_program(self, program: int) -> bool:
+        # True the first time the program is used since invalidate(), so
+        # callers know to set the uniforms that stay the same all frame
+        if program != self.program:
+            glUseProgram(program)
+            self.program = program
+            self.count("program switches")
+        if program in self.prepared_programs:
+            return False
+        self.prepared_programs.add(program)
+        return True
+
+    def set_material(self, program: int, material) -> bool:
+        # uniforms live in the program, so a material only has to be uploaded
+        # again when the program last saw a different one
+        if self.materials.get(program) is material:
+            return False
+        self.materials[program] = material
+        self.count("material uploads")
+        return True
+
+    def bind_vertex_array(self, vao):
+        if vao != self.vao:
+            glBindVertexArray(vao)
+            self.vao = vao
+            self.count("vao binds")
+
+    def bind_texture(self, unit: int, target: int, texture: int):
+        if self.textures.get(unit) == (target, texture):
+            return
+        if unit != self.active_unit:
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self.active_unit = unit
+        glBindTexture(target, texture)
+        self.textures[unit] = (target, texture)
+        self.count("texture binds")
+
+    def blend(self, enabled: bool):
+        if enabled != self.blending:
+            (glEnable if enabled else glDisable)(GL_BLEND)
+            self.blending = enabled
+
+    def depth_mask(self, enabled: bool):
+        if enabled != self.depth_writes:
+            glDepthMask(GL_TRUE if enabled else GL_FALSE)
+            self.depth_writes = enabled
+
+    def unbind(self):
+        glBindVertexArray(0)
+        glUseProgram(0)
+        self.program = self.vao = None
+
+
+class RenderQueue:
+    # collects the visible objects of a frame, orders them by a packed 64-bit
+    # key and submits them through one GLState, so objects sharing a program,
+    # material or mesh are drawn back to back without rebinding. Translucent
+    # objects are ordered by view depth alone, farthest first.
+    def __init__(self, stats: FrameStats = None):
+        self.state = GLState(stats)
+        self.objects = []
+        self.passes = []
+        self.keys = []
+        self.rows = []
+        self.centers = []
+        # WeightedBlendedOIT for this frame, None sorts every translucent object
+        self.weighted = None
+        # small stable numbers for the programs, materials and meshes seen
+        self.ids: dict[int, dict[int, int]] = {PROGRAM_SHIFT: {}, MATERIAL_SHIFT: {}, MESH_SHIFT: {}}
+
+    def id_of(self, resource, shift: int, bits: int) -> int:
+        if resource is None:
+            return 0
+        ids = self.ids[shift]
+        key = resource if isinstance(resource, int) else id(resource)
+        if key not in ids:
+            ids[key] = len(ids) + 1
+        return (ids[key] & ((1 << bits) - 1)) << shift
+
+    def begin(self, weighted=None):
+        self.objects.clear()
+        self.passes.clear()
+        self.keys.clear()
+        self.rows.clear()
+        self.centers.clear()
+        self.weighted = weighted
+
+    def add(self, obj):
+        render_pass = getattr(obj, "render_pass", PASS_OPAQUE)
+        program = getattr(obj, "shaderProgram", None)
+        if render_pass == PASS_TRANSLUCENT and self.weighted is not None:
+            weighted_program = getattr(obj, "weighted_program", None)
+            if weighted_program is not None:
+                render_pass, program = PASS_WEIGHTED, weighted_program
+
+        mesh = getattr(obj, "mesh", None)
+        key = render_pass << PASS_SHIFT
+        if render_pass != PASS_TRANSLUCENT:
+            key |= (
+                self.id_of(program, PROGRAM_SHIFT, PROGRAM_BITS)
+                | self.id_of(getattr(obj, "material", None), MATERIAL_SHIFT, MATERIAL_BITS)
+                | self.id_of(mesh, MESH_SHIFT, MESH_BITS)
+            )
+        transform = getattr(obj, "transform", None)
+        sphere = getattr(mesh, "sphere", None)
+        self.objects.append(obj)
+        self.passes.append(render_pass)
+        self.keys.append(key)
+        self.rows.append(transform.row if transform is not None else -1)
+        # depth is taken at the center of the bounding sphere
+        self.centers.append(sphere[:3] if sphere is not None else (0, 0, 0))
+
+    def sort(self, view, far: float) -> np.ndarray:
+        keys = np.array(self.keys, dtype=np.uint64)
+        rows = np.array(self.rows, dtype=np.intp)
+
+        placed = rows >= 0
+        if placed.any():
+            world = transforms.world[rows[placed]]
+            centers = np.einsum("nij,nj->ni", world[:, :3, :3], np.array(self.centers, dtype="float32")[placed]) + world[:, :3, 3]
+            # distance along the view direction, quantized over [0, far]
+            v = np.asarray(view, dtype="float32")
+            depth = -(centers @ v[2, :3] + v[2, 3])
+            depth = (np.clip(depth / far, 0, 1) * DEPTH_MAX).astype(np.uint64)
+
+            # front to back in the low bits inside a state bucket, translucent
+            # objects back to front right below the pass
+            translucent = np.array(self.passes)[placed] == PASS_TRANSLUCENT
+            keys[placed] |= np.where(translucent, (np.uint64(DEPTH_MAX) - depth) << np.uint64(TRANSLUCENT_DEPTH_SHIFT), depth)
+        return np.argsort(keys, kind="stable")
+
+    def begin_pass(self, render_pass: int):
+        state = self.state
+        if render_pass == PASS_OPAQUE:
+            state.depth_mask(True)
+        elif render_pass == PASS_WEIGHTED:
+            self.weighted.begin(state)
+        elif render_pass == PASS_TRANSLUCENT:
+            # tested against the opaque depth, but not hiding what is behind
+            state.depth_mask(False)
+            state.blend(True)
+            glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+    def end_pass(self, render_pass: int):
+        if render_pass == PASS_WEIGHTED:
+            self.weighted.composite(self.state)
+
+    def flush(self, view, far: float, **kwargs: any):
+        state = self.state
+        state.invalidate()
+        blending = bool(glIsEnabled(GL_BLEND))
+        current = None
+        for index in self.sort(view, far):
+            obj = self.objects[index]
+            render_pass = self.passes[index]
+            if render_pass != current:
+                self.end_pass(current)
+                self.begin_pass(render_pass)
+                current = render_pass
+            try:
+                obj.render(state=state, render_pass=render_pass, **kwargs)
+            except Exception as e:
+                print(f"{obj} is not rendered")
+                print(f"Detail: {e}")
+                state.invalidate()
+                continue
+            if not getattr(obj, "uses_gl_state", False):
+                # it may have bound anything, forget what the shadow knows
+                state.invalidate()
+        self.end_pass(current)
+        state.depth_mask(True)
+        state.blend(blending)
+        state.unbind()
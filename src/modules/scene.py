@@ -1,14 +1,74 @@
-import re, glob
 import glm
+import numpy as np
 from modules.structures import DirLight, PointLight, SpotLight
-from config import SHADERS_DIR
+from modules.buffers import FrameUniforms, material_table, texture_material_table
+from modules.stats import FrameStats
+from modules.culling import Culler
+from modules.renderqueue import RenderQueue
+from modules.transparency import WeightedBlendedOIT
+from modules.indirect import IndirectDraws
+from modules.batching import StaticBatcher
+from modules.transforms import transforms
+from modules.textures import texture_arrays
 from typing import Iterable
 from functools import wraps
 
 
+def invalidating(name: str, flag: str, convert=None):
+    # attribute that marks a cached matrix as stale whenever it is assigned.
+    # glm vectors are mutable, so assign a new value (or use +=) instead of
+    # changing components in place.
+    private = f"_{name}"
+
+    def getter(self):
+        return getattr(self, private)
+
+    def setter(self, value):
+        setattr(self, private, convert(value) if convert else value)
+        setattr(self, flag, True)
+
+    return property(getter, setter)
+
+
+class RenderContext:
+    # everything a frame shares between objects, filled once per frame
+    def __init__(self):
+        self.projection_matrix = glm.mat4(1)
+        self.view_matrix = glm.mat4(1)
+        self.projection_view_matrix = glm.mat4(1)
+        self.view_position = glm.vec3(0)
+        self.time = 0.0
+        self.delta_time = 0.0
+        self.resolution = None
+
+
 class Scene:
+    fov = invalidating("fov", "projection_dirty")
+    aspect = invalidating("aspect", "projection_dirty")
+    near = invalidating("near", "projection_dirty")
+    far = invalidating("far", "projection_dirty")
+
+    @property
+    def objects(self) -> list:
+        return self._objects
+
+    @objects.setter
+    def objects(self, value: list):
+        # a new list is a change of its own
+        self._objects = value
+        self.generation += 1
+
     def __init__(self, aspect):
+        # objects is what gets drawn, nodes maps handles to everything added
+        # with Scene.add, drawable or not. generation is bumped by every
+        # change to either, the culler and the indirect draws compare it
+        # instead of the whole list
+        self.generation = 0
         self.objects = []
+        self.nodes: dict[int, object] = {}
+        self.parents: dict[int, int] = {}
+        self.children: dict[int, set[int]] = {}
+        self.next_handle = 0
         self.dirLights: Iterable[DirLight] = []
         self.pointLights: Iterable[PointLight] = []
         self.spotLights: Iterable[SpotLight] = []
@@ -25,71 +85,202 @@ class Scene:
         self.aspect = aspect
         self.near = 0.01
         self.far = 100.0
+        self.projection_matrix = glm.mat4(1)
 
-    def update_shader_lights_count(self):
-        shader_file_pattern = "fs*.glsl"
-        shader_files = glob.glob(f'{SHADERS_DIR}/{shader_file_pattern}')
+        self.context = RenderContext()
+        self.stats = FrameStats()
+        self.frustum_culling = True
+        self.culler = Culler()
+        self.queue = RenderQueue(self.stats)
+        # static models merged per program and material
+        self.static_batches = StaticBatcher()
+        # plain material models in one glMultiDrawElementsIndirect
+        self.multi_draw_indirect = True
+        self.indirect = IndirectDraws()
+        # translucent objects through WeightedBlendedOIT instead of sorting
+        self.weighted_transparency = False
+        self.transparency = None
+        self.frame_uniforms = FrameUniforms()
 
-        patterns = (
-            r'#define NUM_DIRLIGHTS \d+',
-            r'#define NUM_POINTLIGHTS \d+',
-            r'#define NUM_SPOTLIGHTS \d+'
-        )
-        repls = (
-            f'#define NUM_DIRLIGHTS {len(self.dirLights)}',
-            f'#define NUM_POINTLIGHTS {len(self.pointLights)}',
-            f'#define NUM_SPOTLIGHTS {len(self.spotLights)}'
-        )
+    def get_projection_matrix(self):
+        if self.projection_dirty:
+            self.projection_matrix = glm.perspective(
+                glm.radians(self.fov), self.aspect, self.near, self.far
+            )
+            self.projection_dirty = False
+        return self.projection_matrix
 
-        for file in shader_files:
-            with open(file, 'r') as f:
-                shader = f.read()
+    def update_context(self, time: float, resolution: tuple[int, int]) -> RenderContext:
+        context = self.context
+        context.time = time
+        context.delta_time = self.delta_time
+        context.resolution = resolution
 
-            for pattern, repl in zip(patterns, repls):
-                shader = re.sub(pattern, repl, shader)
+        # the camera and the projection only rebuild their matrices after one
+        # of their parameters was assigned, otherwise the cached objects come
+        # back and nothing here has to be recomputed either
+        projection_matrix = self.get_projection_matrix()
+        view_matrix = self.camera.get_view_matrix()
+        projection_changed = projection_matrix is not context.projection_matrix
+        view_changed = view_matrix is not context.view_matrix
+        if projection_changed:
+            context.projection_matrix = projection_matrix
+        if view_changed:
+            context.view_matrix = view_matrix
+            context.view_position = glm.vec3(self.camera.position)
+        if projection_changed or view_changed:
+            context.projection_view_matrix = projection_matrix * view_matrix
 
-            with open(file, 'w') as f:
-                f.write(shader)
+        rebuilt = projection_changed + view_changed + (projection_changed or view_changed)
+        self.stats.count("matrix rebuilds", rebuilt)
+        self.stats.count("matrix skips", 3 - rebuilt)
+        return context
 
-    def render(self, time: float = 0, **kwargs: any):
+    def render(self, time: float = 0, resolution: tuple[int, int] = None, **kwargs: any):
         self.delta_time = time - self.last_frame_time
         self.last_frame_time = time
-        for model in self.objects:
-            try:
-                model.render(
-                    projection_matrix=glm.perspective(
-                        glm.radians(self.fov), self.aspect, self.near, self.far
-                    ),
-                    view_matrix=self.camera.get_view_matrix(),
-                    view_position=self.camera.position,
-                    time=time,
-                    dir_lights=self.dirLights,
-                    point_lights=self.pointLights,
-                    spot_lights=self.spotLights,
-                    **kwargs,
-                )
-            except Exception as e:
-                print(f"{model} is not rendered")
-                print(f"Detail: {e}")
 
-    def animate_object(self, index):
+        self.stats.begin_frame()
+        context = self.update_context(time, resolution)
+
+        # one upload of camera and light data, shared by every program
+        self.frame_uniforms.update(
+            context.projection_matrix,
+            context.view_matrix,
+            context.view_position,
+            time,
+            resolution,
+            self.dirLights,
+            self.pointLights,
+            self.spotLights,
+        )
+        # material edits since the last frame, one slot each
+        self.stats.count("material slots uploaded", material_table.bind() + texture_material_table.bind())
+
+        # mip levels of decoded textures, within the upload budget
+        self.stats.count("texture bytes uploaded", texture_arrays.update())
+        self.stats.count("texture queue depth", texture_arrays.queue_depth)
+
+        # world and normal matrices of everything that moved, in one pass
+        self.stats.count("transforms updated", transforms.update())
+
+        if self.static_batches.dirty:
+            removed, added = self.static_batches.bake()
+            for batch in removed:
+                self.objects.remove(batch)
+                batch.release()
+            self.objects.extend(added)
+            self.generation += 1
+            self.stats.count("static batches baked", len(added))
+
+        if self.frustum_culling:
+            visible = self.culler.visible(self.objects, self.generation, context.projection_view_matrix)
+        else:
+            visible = np.ones(len(self.objects), dtype=bool)
+        visible_count = int(np.count_nonzero(visible))
+        self.stats.count("visible", visible_count)
+        self.stats.count("culled", len(self.objects) - visible_count)
+
+        weighted = None
+        if self.weighted_transparency:
+            if self.transparency is None:
+                self.transparency = WeightedBlendedOIT()
+            if self.transparency.prepare():
+                weighted = self.transparency
+
+        if self.multi_draw_indirect:
+            batched = self.indirect.update(self.objects, self.generation, visible)
+        else:
+            batched = np.zeros(len(self.objects), dtype=bool)
+
+        self.queue.begin(weighted)
+        for index in np.flatnonzero(visible & ~batched):
+            self.queue.add(self.objects[index])
+        if self.multi_draw_indirect and self.indirect.count:
+            self.queue.add(self.indirect)
+        self.queue.flush(
+            context.view_matrix,
+            self.far,
+            projection_matrix=context.projection_matrix,
+            view_matrix=context.view_matrix,
+            view_position=context.view_position,
+            time=time,
+            resolution=resolution,
+            dir_lights=self.dirLights,
+            point_lights=self.pointLights,
+            spot_lights=self.spotLights,
+            **kwargs,
+        )
+
+    def add(self, obj, parent: int = None) -> int:
+        # returns a handle for O(1) lookups; parent is the handle of a node
+        # added earlier whose transform the new one follows
+        handle = self.next_handle
+        self.next_handle += 1
+        self.nodes[handle] = obj
+        self.generation += 1
+        # static models are drawn through their StaticBatch
+        static = getattr(obj, "static", False) and self.static_batches.add(obj)
+        if not static and hasattr(obj, "render"):
+            self.objects.append(obj)
+        if parent is not None:
+            self.set_parent(handle, parent)
+        return handle
+
+    def get(self, handle: int):
+        return self.nodes[handle]
+
+    def set_parent(self, handle: int, parent: int | None):
+        self.nodes[handle].transform.parent = self.nodes[parent].transform if parent is not None else None
+        self.generation += 1
+        previous = self.parents.pop(handle, None)
+        if previous is not None:
+            self.children[previous].discard(handle)
+        if parent is not None:
+            self.parents[handle] = parent
+            self.children.setdefault(parent, set()).add(handle)
+
+    def remove(self, handle: int):
+        # removes the node and everything attached below it
+        for child in list(self.children.get(handle, ())):
+            self.remove(child)
+        self.children.pop(handle, None)
+        parent = self.parents.pop(handle, None)
+        if parent is not None:
+            self.children[parent].discard(handle)
+        obj = self.nodes.pop(handle)
+        if not self.static_batches.remove(obj) and obj in self.objects:
+            self.objects.remove(obj)
+        self.generation += 1
+        return obj
+
+    def animate_object(self, handle: int):
         def outer_wrapper(animation):
             @wraps(animation)
             def inner_wrapper(*args, **kwargs):
                 self.animation_time += self.delta_time
-                self.objects[index] = animation(
-                    self.objects[index], 
+                obj = self.nodes[handle]
+                result = animation(
+                    obj, 
                     time = self.animation_time,
                     delta_time = self.delta_time, 
                     *args, 
                     **kwargs
                 )
-                return self.objects[index]
+                if result is not obj:
+                    self.nodes[handle] = result
+                    self.objects[self.objects.index(obj)] = result
+                    self.generation += 1
+                return result
             return inner_wrapper
         return outer_wrapper
 
 
 class Camera:
+    position = invalidating("position", "view_dirty", glm.vec3)
+    target = invalidating("target", "view_dirty", glm.vec3)
+    up = invalidating("up", "view_dirty", glm.vec3)
+
     def __init__(
         self,
         position=glm.vec3(0, 0, 3),
@@ -99,6 +290,7 @@ class Camera:
         self.position = position
         self.target = target
         self.up = up
+        self.view_matrix = glm.mat4(1)
 
         self.yaw = -90.0
         self.pitch = 0.0
@@ -106,4 +298,7 @@ class Camera:
         self.speed = 1
 
     def get_view_matrix(self):
-        return glm.lookAt(self.position, self.position + self.target, self.up)
+        if self.view_dirty:
+            self.view_matrix = glm.lookAt(self.position, self.position + self.target, self.up)
+            self.view_dirty = False
+        return self.view_matrix
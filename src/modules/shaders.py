@@ -0,0 +1,122 @@
+import os, hashlib
+from OpenGL.GL import *
+from modules.funcs import load_shaders
+from config import CACHE_DIR, SHADER_CACHE
+
+
+class ProgramCache:
+    def __init__(self, binaryCacheDir: str = None):
+        # linked programs are also kept on disk as driver binaries when
+        # binaryCacheDir is set
+        self.binaryCacheDir = binaryCacheDir
+        self.programs: dict[tuple, int] = {}
+        self.keys: dict[int, tuple] = {}
+        self.ref_counts: dict[int, int] = {}
+
+    @staticmethod
+    def make_key(vertexShaderPath: str,
+                 fragmentShaderPath: str,
+                 geometryShaderPath: str = None,
+                 defines: dict = None) -> tuple:
+        # stage paths plus a hash of what is on disk right now, so an edited
+        # shader file never hands back a program built from the old source
+        stages = []
+        for path in (vertexShaderPath, fragmentShaderPath, geometryShaderPath):
+            if path is None:
+                stages.append(None)
+                continue
+            with open(path, 'rb') as f:
+                stages.append((path, hashlib.sha1(f.read()).hexdigest()))
+        return (*stages, tuple(sorted((defines or {}).items())))
+
+    def acquire(self,
+                vertexShaderPath: str,
+                fragmentShaderPath: str,
+                geometryShaderPath: str = None,
+                defines: dict = None) -> int:
+        key = self.make_key(vertexShaderPath, fragmentShaderPath, geometryShaderPath, defines)
+        program = self.programs.get(key)
+        if program is None:
+            program = load_shaders(vertexShaderPath, fragmentShaderPath, geometryShaderPath, defines, self.binaryCacheDir)
+            self.programs[key] = program
+            self.keys[program] = key
+            self.ref_counts[program] = 0
+        self.ref_counts[program] += 1
+        return program
+
+    def release(self, program: int):
+        if program not in self.ref_counts:
+            return
+        self.ref_counts[program] -= 1
+        if self.ref_counts[program] <= 0:
+            del self.programs[self.keys.pop(program)]
+            del self.ref_counts[program]
+            forget_uniforms(program)
+            glDeleteProgram(program)
+
+    def __len__(self) -> int:
+        return len(self.programs)
+
+
+class ProgramUniforms:
+    def __init__(self, program: int):
+        # active uniforms are enumerated once; names the linker optimised
+        # away are simply absent and resolve to -1
+        self.program = program
+        self.locations: dict[str, int] = {}
+        self.structs: dict[tuple, tuple[int, ...]] = {}
+
+        for index in range(glGetProgramiv(program, GL_ACTIVE_UNIFORMS)):
+            name, size, _ = glGetActiveUniform(program, index)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = glGetUniformLocation(program, name)
+            if location < 0:
+                # uniform block members have no location
+                continue
+            self.locations[name] = location
+            if name.endswith("[0]"):
+                base = name[:-3]
+                self.locations[base] = location
+                for element in range(1, int(size)):
+                    self.locations[f"{base}[{element}]"] = glGetUniformLocation(program, f"{base}[{element}]")
+
+        self.loose_frame_uniforms = "view" in self.locations or "projection" in self.locations
+        self.loose_light_uniforms = any(
+            name.startswith(("dirlights[", "pointlights[", "spotlights[")) for name in self.locations
+        )
+        self.loose_material_uniforms = "material.ambient" in self.locations
+
+    def __getitem__(self, name: str) -> int:
+        return self.locations.get(name, -1)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.locations
+
+    def resolve(self, *names: str) -> tuple[int, ...]:
+        return tuple(self.locations.get(name, -1) for name in names)
+
+    def struct(self, name: str, fields: tuple[str, ...], index: int = None) -> tuple[int, ...]:
+        # locations of name[index].field for every field, resolved on first use
+        key = (name, index, fields)
+        handles = self.structs.get(key)
+        if handles is None:
+            prefix = name if index is None else f"{name}[{index}]"
+            handles = self.structs[key] = self.resolve(*(f"{prefix}.{field}" for field in fields))
+        return handles
+
+
+_uniforms: dict[int, ProgramUniforms] = {}
+
+
+def get_uniforms(program: int) -> ProgramUniforms:
+    uniforms = _uniforms.get(program)
+    if uniforms is None:
+        uniforms = _uniforms[program] = ProgramUniforms(program)
+    return uniforms
+
+
+def forget_uniforms(program: int):
+    _uniforms.pop(program, None)
+
+
+programs = ProgramCache(os.path.join(CACHE_DIR, "programs") if SHADER_CACHE else None)
@@ -0,0 +1,23 @@
+class FrameStats:
+    def __init__(self):
+        self.frames = 0
+        self.counters: dict[str, int] = {}
+        self.totals: dict[str, int] = {}
+
+    def begin_frame(self):
+        self.frames += 1
+        self.counters = {}
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        self.totals[name] = self.totals.get(name, 0) + amount
+
+    def __getitem__(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def report(self, totals: bool = False) -> str:
+        counters = self.totals if totals else self.counters
+        return ", ".join(f"{name} {value}" for name, value in counters.items())
+
+    def __repr__(self):
+        return f"FrameStats(frame {self.frames}: {self.report()})"
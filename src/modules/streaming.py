@@ -0,0 +1,150 @@
+import ctypes
+import numpy as np
+from collections import deque
+from OpenGL.GL import *
+
+from modules.images import DecodedImage
+
+# mip levels up to this size are uploaded as soon as an image arrives, so
+# something is on screen before the budgeted levels follow
+IMMEDIATE_SIZE = 64
+
+
+class UploadJob:
+    # one image on its way into a layer, coarsest level first; large levels
+    # go up in bands of rows, or of block rows for compressed formats
+    def __init__(self, texture, image: DecodedImage):
+        self.texture = texture
+        self.image = image
+        self.levels = [np.frombuffer(data, dtype=np.uint8) for data in image.levels]
+        self.level = len(self.levels) - 1
+        self.row = 0
+
+    @property
+    def done(self) -> bool:
+        return self.level < 0
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        return self.texture.array.level_size(level)
+
+    def upload(self, address: int, offset: int, room: int) -> int:
+        # copies as many rows of the current level as fit in room bytes to
+        # address, the mapped memory at offset in the bound unpack buffer, and
+        # points the layer at them; returns the bytes used
+        array = self.texture.array
+        width, height = self.level_size(self.level)
+        pitch = array.format.row_bytes(width)
+        step = array.format.row_height
+        rows = min(height - self.row, room // pitch * step)
+        if rows <= 0:
+            return 0
+        data = self.levels[self.level]
+        start = self.row // step * pitch
+        size = -(-rows // step) * pitch
+        ctypes.memmove(address, data.ctypes.data + start, size)
+        array.upload_level(self.texture.layer, self.level, ctypes.c_void_p(offset), self.row, rows)
+        self.row += rows
+        if self.row == height:
+            self.texture.set_resident(self.level)
+            self.level -= 1
+            self.row = 0
+        return size
+
+
+class TextureStreamer:
+    # feeds decoded images into their layers through one persistently mapped
+    # pixel unpack buffer, at most budget bytes a frame. The buffer holds a
+    # region per frame in flight; a fence marks when the GPU is done reading
+    # a region, and a frame whose region is still busy uploads nothing rather
+    # than wait.
+    def __init__(self, budget: int, frames: int = 3):
+        self.budget = budget
+        self.frames = frames
+        self.jobs: deque[UploadJob] = deque()
+        self.buffer = None
+        self.address = None
+        self.fences = [None] * frames
+        self.frame = 0
+
+    def create(self):
+        # a region has to hold the widest row of any level, or the job
+        # waiting on it would never move: four bytes a texel for RGBA8, the
+        # same for a block row of the 16 byte block formats
+        self.budget = max(self.budget, int(glGetIntegerv(GL_MAX_TEXTURE_SIZE)) * 4)
+        size = self.budget * self.frames
+        flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+        self.buffer = int(glGenBuffers(1))
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+        glBufferStorage(GL_PIXEL_UNPACK_BUFFER, size, None, flags)
+        self.address = ctypes.cast(glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, size, flags), ctypes.c_void_p).value
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def add(self, texture, image: DecodedImage):
+        job = UploadJob(texture, image)
+        # the small levels right away, straight from client memory
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        while not job.done and max(job.level_size(job.level)) <= IMMEDIATE_SIZE:
+            texture.array.upload_level(texture.layer, job.level, job.levels[job.level])
+            job.level -= 1
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        texture.set_resident(job.level + 1)
+        if not job.done:
+            self.jobs.append(job)
+
+    def cancel(self, texture) -> DecodedImage | None:
+        # drops the texture's job, returns its image if there was one
+        for job in self.jobs:
+            if job.texture is texture:
+                self.jobs.remove(job)
+                return job.image
+        return None
+
+    def update(self) -> int:
+        if not self.jobs:
+            return 0
+        if self.buffer is None:
+            self.create()
+        region = self.frame % self.frames
+        fence = self.fences[region]
+        if fence is not None:
+            if glClientWaitSync(fence, 0, 0) == GL_TIMEOUT_EXPIRED:
+                return 0
+            glDeleteSync(fence)
+            self.fences[region] = None
+
+        offset = region * self.budget
+        used = 0
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        while self.jobs and used < self.budget:
+            job = self.jobs[0]
+            size = job.upload(self.address + offset + used, offset + used, self.budget - used)
+            if not size:
+                break
+            used += size
+            if job.done:
+                self.jobs.popleft()
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+
+        self.fences[region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.frame += 1
+        return used
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def release(self):
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * self.frames
+        if self.buffer is not None:
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+            glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+            glDeleteBuffers(1, (self.buffer,))
+        self.buffer = self.address = None
+        self.jobs.clear()
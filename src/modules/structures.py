@@ -1,10 +1,14 @@
-import glm
+import glm, weakref
 from OpenGL.GL import *
-from config import SOURCES_DIR
-from modules.funcs import load_texture
+from config import SOURCES_DIR, TEXTURE_SRGB
+from modules.shaders import get_uniforms
+from modules.buffers import material_table, texture_material_table
+from modules.textures import texture_arrays, texture_cache
 
 
 class DirLight:
+    uniform_fields = ("direction", "ambient", "diffuse", "specular")
+
     def __init__(
         self,
         direction: glm.vec3,
@@ -18,29 +22,18 @@ class DirLight:
         self.specular = specular
 
     def set_uniforms(self, program, index: int, *ars: any, **kwargs: any):
-        glUniform3fv(
-            glGetUniformLocation(program, f"dirlights[{index}].direction"),
-            1,
-            glm.value_ptr(self.direction),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"dirlights[{index}].ambient"),
-            1,
-            glm.value_ptr(self.ambient),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"dirlights[{index}].diffuse"),
-            1,
-            glm.value_ptr(self.diffuse),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"dirlights[{index}].specular"),
-            1,
-            glm.value_ptr(self.specular),
+        direction, ambient, diffuse, specular = get_uniforms(program).struct(
+            "dirlights", self.uniform_fields, index
         )
+        glUniform3fv(direction, 1, glm.value_ptr(self.direction))
+        glUniform3fv(ambient, 1, glm.value_ptr(self.ambient))
+        glUniform3fv(diffuse, 1, glm.value_ptr(self.diffuse))
+        glUniform3fv(specular, 1, glm.value_ptr(self.specular))
 
 
 class PointLight:
+    uniform_fields = ("position", "ambient", "diffuse", "specular", "constant", "linear", "quadratic")
+
     def __init__(
         self,
         position: glm.vec3,
@@ -60,40 +53,24 @@ class PointLight:
         self.quadratic = quadratic
 
     def set_uniforms(self, program, index: int, *args: any, **kwargs: any):
-        glUniform3fv(
-            glGetUniformLocation(program, f"pointlights[{index}].position"),
-            1,
-            glm.value_ptr(self.position),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"pointlights[{index}].ambient"),
-            1,
-            glm.value_ptr(self.ambient),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"pointlights[{index}].diffuse"),
-            1,
-            glm.value_ptr(self.diffuse),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"pointlights[{index}].specular"),
-            1,
-            glm.value_ptr(self.specular),
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"pointlights[{index}].constant"),
-            self.constant,
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"pointlights[{index}].linear"), self.linear
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"pointlights[{index}].quadratic"),
-            self.quadratic,
+        position, ambient, diffuse, specular, constant, linear, quadratic = get_uniforms(program).struct(
+            "pointlights", self.uniform_fields, index
         )
+        glUniform3fv(position, 1, glm.value_ptr(self.position))
+        glUniform3fv(ambient, 1, glm.value_ptr(self.ambient))
+        glUniform3fv(diffuse, 1, glm.value_ptr(self.diffuse))
+        glUniform3fv(specular, 1, glm.value_ptr(self.specular))
+        glUniform1f(constant, self.constant)
+        glUniform1f(linear, self.linear)
+        glUniform1f(quadratic, self.quadratic)
 
 
 class SpotLight:
+    uniform_fields = (
+        "position", "direction", "ambient", "diffuse", "specular",
+        "constant", "linear", "quadratic", "cutOff", "outerCutOff",
+    )
+
     def __init__(
         self,
         position: glm.vec3,
@@ -119,52 +96,28 @@ class SpotLight:
         self.outerCutOff = glm.cos(glm.radians(outerCutOff))
 
     def set_uniforms(self, program, index: int, *args: any, **kwargs: any):
-        glUniform3fv(
-            glGetUniformLocation(program, f"spotlights[{index}].position"),
-            1,
-            glm.value_ptr(self.position),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"spotlights[{index}].direction"),
-            1,
-            glm.value_ptr(self.direction),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"spotlights[{index}].ambient"),
-            1,
-            glm.value_ptr(self.ambient),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"spotlights[{index}].diffuse"),
-            1,
-            glm.value_ptr(self.diffuse),
-        )
-        glUniform3fv(
-            glGetUniformLocation(program, f"spotlights[{index}].specular"),
-            1,
-            glm.value_ptr(self.specular),
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"spotlights[{index}].constant"),
-            self.constant,
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"spotlights[{index}].linear"), self.linear
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"spotlights[{index}].quadratic"),
-            self.quadratic,
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"spotlights[{index}].cutOff"), self.cutOff
-        )
-        glUniform1f(
-            glGetUniformLocation(program, f"spotlights[{index}].outerCutOff"),
-            self.outerCutOff,
-        )
+        (position, direction, ambient, diffuse, specular,
+         constant, linear, quadratic, cutOff, outerCutOff) = get_uniforms(program).struct(
+            "spotlights", self.uniform_fields, index
+        )
+        glUniform3fv(position, 1, glm.value_ptr(self.position))
+        glUniform3fv(direction, 1, glm.value_ptr(self.direction))
+        glUniform3fv(ambient, 1, glm.value_ptr(self.ambient))
+        glUniform3fv(diffuse, 1, glm.value_ptr(self.diffuse))
+        glUniform3fv(specular, 1, glm.value_ptr(self.specular))
+        glUniform1f(constant, self.constant)
+        glUniform1f(linear, self.linear)
+        glUniform1f(quadratic, self.quadratic)
+        glUniform1f(cutOff, self.cutOff)
+        glUniform1f(outerCutOff, self.outerCutOff)
 
 
 class Material:
+    uniform_fields = ("ambient", "diffuse", "specular", "shininess", "transparency", "reflectivity", "refractive_index")
+    # bumped whenever a material moves between the opaque and translucent
+    # passes, batches that sorted models by pass compare it
+    pass_changes = 0
+
     def __init__(
         self,
         name: str,
@@ -184,41 +137,110 @@ class Material:
         self.transparency = transparency
         self.reflectivity = reflectivity
         self.refractive_index = refractive_index
+        # slot in the material table, freed with the material
+        self.index = material_table.register(self)
+        weakref.finalize(self, material_table.free, self.index)
+
+    def __setattr__(self, name: str, value: any):
+        crosses = name == "transparency" and (self.__dict__.get("transparency", 0) > 0) != (value > 0)
+        super().__setattr__(name, value)
+        if name in self.uniform_fields and "index" in self.__dict__:
+            material_table.write(self.index, self)
+            if crosses:
+                Material.pass_changes += 1
 
     def set_uniforms(self, shaderProgram: int, *args: any, **kwargs: any):
-        glUniform3fv(glGetUniformLocation(shaderProgram, "material.ambient"), 1, glm.value_ptr(self.ambient))
-        glUniform3fv(glGetUniformLocation(shaderProgram, "material.diffuse"), 1, glm.value_ptr(self.diffuse))
-        glUniform3fv(glGetUniformLocation(shaderProgram, "material.specular"), 1, glm.value_ptr(self.specular))
-        glUniform1f(glGetUniformLocation(shaderProgram, "material.shininess"), self.shininess)
-        glUniform1f(glGetUniformLocation(shaderProgram, "material.transparency"), self.transparency)
-        glUniform1f(glGetUniformLocation(shaderProgram, "material.reflectivity"), self.reflectivity)
-        glUniform1f(glGetUniformLocation(shaderProgram, "material.refractive_index"), self.refractive_index)
+        uniforms = get_uniforms(shaderProgram)
+        if not uniforms.loose_material_uniforms:
+            glUniform1i(uniforms["materialIndex"], self.index)
+            return
+        # custom shaders that still declare a uniform Material
+        ambient, diffuse, specular, shininess, transparency, reflectivity, refractive_index = uniforms.struct(
+            "material", self.uniform_fields
+        )
+        glUniform3fv(ambient, 1, glm.value_ptr(self.ambient))
+        glUniform3fv(diffuse, 1, glm.value_ptr(self.diffuse))
+        glUniform3fv(specular, 1, glm.value_ptr(self.specular))
+        glUniform1f(shininess, self.shininess)
+        glUniform1f(transparency, self.transparency)
+        glUniform1f(reflectivity, self.reflectivity)
+        glUniform1f(refractive_index, self.refractive_index)
 
     def __repr__(self):
         return f"Material(name={self.name}, ambient={self.ambient}, diffuse={self.diffuse}, specular={self.specular}, shininess={self.shininess}, transparency={self.transparency}, reflectivity={self.reflectivity}, refractive_index={self.refractive_index})"
 
 
 class TextureMaterial:
+    uniform_fields = ("diffuse_layer", "specular_layer", "shininess", "diffuse_lod", "specular_lod")
+
     def __init__(
             self, 
             name: str, 
             diffuse_texture: str, 
             specular_texture: str,
-            shininess: float
+            shininess: float,
+            wait: bool = True,
     ):
         self.name = name
-        self.diffuse_texture = load_texture(f"{SOURCES_DIR}/textures/{diffuse_texture}")
-        self.specular_texture = load_texture(f"{SOURCES_DIR}/textures/{specular_texture}")
+        # shared layers in the texture arrays, see modules/textures.py. Both
+        # maps decode at the same time; with wait=False they appear once the
+        # scene has uploaded them
+        self.diffuse_texture = texture_cache.acquire(f"{SOURCES_DIR}/textures/{diffuse_texture}", TEXTURE_SRGB, wait=False)
+        self.specular_texture = texture_cache.acquire(f"{SOURCES_DIR}/textures/{specular_texture}", wait=False)
+        if wait:
+            texture_arrays.finish(self.diffuse_texture, self.specular_texture)
         self.shininess = shininess * 128
+        self.index = texture_material_table.register(self)
+        # streamed mip levels update the slot as they arrive
+        self.diffuse_texture.owners.add(self)
+        self.specular_texture.owners.add(self)
+        weakref.finalize(self, texture_material_table.free, self.index)
+        weakref.finalize(self, texture_cache.release, self.diffuse_texture)
+        weakref.finalize(self, texture_cache.release, self.specular_texture)
+
+    def __setattr__(self, name: str, value: any):
+        super().__setattr__(name, value)
+        if name == "shininess" and "index" in self.__dict__:
+            texture_material_table.write(self.index, self)
+
+    @property
+    def diffuse_layer(self) -> int:
+        return self.diffuse_texture.layer
+
+    @property
+    def specular_layer(self) -> int:
+        return self.specular_texture.layer
+
+    @property
+    def diffuse_lod(self) -> float:
+        return float(self.diffuse_texture.resident_level)
+
+    @property
+    def specular_lod(self) -> float:
+        return float(self.specular_texture.resident_level)
+
+    def texture_changed(self, texture):
+        texture_material_table.write(self.index, self)
+
+    @property
+    def arrays(self) -> tuple:
+        # materials with the same arrays can be drawn together
+        return self.diffuse_texture.array, self.specular_texture.array
 
     def set_uniforms(self, shaderProgram: int, *args: any, **kwargs: any):
-        glUniform1i(glGetUniformLocation(shaderProgram, "material.diffuse"), 0)
-        glUniform1i(glGetUniformLocation(shaderProgram, "material.specular"), 1)
-        glUniform1f(glGetUniformLocation(shaderProgram, "material.shininess"), self.shininess)
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.diffuse_texture)
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.specular_texture)
+        glUniform1i(get_uniforms(shaderProgram)["materialIndex"], self.index)
+        self.bind_textures(kwargs.get("state"))
+
+    def bind_textures(self, state=None):
+        diffuse, specular = self.arrays
+        if state is None:
+            glActiveTexture(GL_TEXTURE0)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, diffuse.texture)
+            glActiveTexture(GL_TEXTURE1)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, specular.texture)
+        else:
+            state.bind_texture(0, GL_TEXTURE_2D_ARRAY, diffuse.texture)
+            state.bind_texture(1, GL_TEXTURE_2D_ARRAY, specular.texture)
 
     def __repr__(self):
         return f"TextureMaterial(name={self.name}, diffuse_texture={self.diffuse_texture}, specular_texture={self.specular_texture}, shininess={self.shininess}"
\ No newline at end of file
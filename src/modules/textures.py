@@ -0,0 +1,351 @@
+import os, weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from OpenGL.GL import *
+from modules.formats import choose_format, format_supported, texture_formats
+from modules.images import DecodedImage, image_loader, image_mode, image_size
+from modules.mipcache import cook_image, mip_cache_path, read_mip_cache
+from modules.streaming import TextureStreamer
+from config import TEXTURE_BUDGET, TEXTURE_UPLOAD_BUDGET
+
+
+class TextureLayer:
+    # a layer handed out by a TextureArray. Growing the array moves it to a
+    # new texture object but keeps the layer index, so holders keep theirs.
+    # resident_level is the finest mip level uploaded so far (levels while
+    # nothing is), owners are told when it changes.
+    __slots__ = ("array", "layer", "resident_level", "owners")
+
+    def __init__(self, array, layer: int):
+        self.array = array
+        self.layer = layer
+        self.resident_level = array.levels
+        self.owners = weakref.WeakSet()
+
+    def set_resident(self, level: int):
+        self.resident_level = level
+        for owner in list(self.owners):
+            owner.texture_changed(self)
+
+    def __repr__(self):
+        return f"TextureLayer(size={self.array.size}, layer={self.layer})"
+
+
+class TextureArray:
+    # one GL_TEXTURE_2D_ARRAY for images of a single size, format and
+    # sampling, layers handed out from a free list. Full arrays are grown into
+    # a texture with twice the layers, up to max_layers, copied over on the GPU.
+    def __init__(self,
+                 size: tuple[int, int],
+                 internal_format: int = GL_RGBA8,
+                 mipmaps: bool = True,
+                 wrap: int = GL_REPEAT,
+                 capacity: int = 4,
+                 max_layers: int = None):
+        self.size = size
+        self.max_layers = max_layers
+        self.internal_format = internal_format
+        self.format = texture_formats[int(internal_format)]
+        self.wrap = wrap
+        width, height = size
+        self.levels = max(width, height).bit_length() if mipmaps else 1
+        self.capacity = 0
+        self.texture = None
+        self.free_layers: list[int] = []
+        self.count = 0
+        self.resize(min(capacity, max_layers) if max_layers else capacity)
+
+    def create_texture(self, capacity: int) -> int:
+        width, height = self.size
+        texture = int(glGenTextures(1))
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+        glTexStorage3D(GL_TEXTURE_2D_ARRAY, self.levels, self.internal_format, width, height, capacity)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, self.wrap)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, self.wrap)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR if self.levels > 1 else GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        self.format.apply_swizzle(GL_TEXTURE_2D_ARRAY)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        return texture
+
+    def resize(self, capacity: int):
+        texture = self.create_texture(capacity)
+        if self.texture is not None:
+            width, height = self.size
+            for level in range(self.levels):
+                glCopyImageSubData(
+                    self.texture, GL_TEXTURE_2D_ARRAY, level, 0, 0, 0,
+                    texture, GL_TEXTURE_2D_ARRAY, level, 0, 0, 0,
+                    max(width >> level, 1), max(height >> level, 1), self.count,
+                )
+            glDeleteTextures(1, (self.texture,))
+        self.texture = texture
+        self.capacity = capacity
+
+    @property
+    def full(self) -> bool:
+        return not self.free_layers and self.count == self.capacity
+
+    @property
+    def growable(self) -> bool:
+        return self.max_layers is None or self.capacity < self.max_layers
+
+    @property
+    def used(self) -> int:
+        return self.count - len(self.free_layers)
+
+    def allocate(self) -> int:
+        if self.free_layers:
+            return self.free_layers.pop()
+        if self.count == self.capacity:
+            capacity = self.capacity * 2
+            self.resize(min(capacity, self.max_layers) if self.max_layers else capacity)
+        self.count += 1
+        return self.count - 1
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        width, height = self.size
+        return max(width >> level, 1), max(height >> level, 1)
+
+    def upload_level(self, layer: int, level: int, data, row: int = 0, rows: int = None):
+        # rows of one level, data in the array's format or an offset into the
+        # bound pixel unpack buffer; expects an unpack alignment of 1
+        width, height = self.level_size(level)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        self.format.sub_image(GL_TEXTURE_2D_ARRAY, level, (0, row, layer), (width, height - row if rows is None else rows, 1), data)
+
+    def upload(self, layer: int, image: DecodedImage):
+        # every mip level of the image, the other layers are left alone
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, data in enumerate(image.levels):
+            self.upload_level(layer, level, data)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+
+    def clear(self, layer: int):
+        # black until its image arrives, instead of whatever the layer held.
+        # Materials sample no finer than the resident level, which starts past
+        # the last one, so only the smallest level is ever seen
+        level = self.levels - 1
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        self.upload_level(layer, level, bytes(self.format.level_bytes(*self.level_size(level))))
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+
+    def free(self, layer: int):
+        self.free_layers.append(layer)
+
+    @property
+    def layer_size(self) -> int:
+        # bytes of one layer with its mip chain
+        return sum(self.format.level_bytes(*self.level_size(level)) for level in range(self.levels))
+
+    def memory_usage(self) -> int:
+        return self.layer_size * self.capacity
+
+    def release(self):
+        if self.texture is not None:
+            glDeleteTextures(1, (self.texture,))
+        self.texture = None
+
+
+class TextureArrays:
+    # every 2D texture of TextureMaterials, packed into one TextureArray per
+    # (width, height, format, sampling). Textured models whose materials share
+    # arrays only differ by layer indices, so they batch like plain material
+    # models. The format follows the image's content, see modules/formats.py.
+    # Images decode on the image loader's threads, or come memory mapped from
+    # the mip cache with their levels encoded; the layer is handed out at once
+    # and filled by finish(), or streamed in over the frames after update()
+    # finds it ready.
+    def __init__(self):
+        self.arrays: dict[tuple, list[TextureArray]] = {}
+        self.max_layers = None
+        self.pending: dict[TextureLayer, Future] = {}
+        self.streamer = TextureStreamer(TEXTURE_UPLOAD_BUDGET)
+
+    def array_for(self, size: tuple[int, int], internal_format: int, mipmaps: bool, wrap: int) -> TextureArray:
+        if self.max_layers is None:
+            self.max_layers = int(glGetIntegerv(GL_MAX_ARRAY_TEXTURE_LAYERS))
+        arrays = self.arrays.setdefault((size, internal_format, mipmaps, wrap), [])
+        for array in arrays:
+            if not array.full or array.growable:
+                return array
+        # only once an array holds max_layers is a second one started
+        array = TextureArray(size, internal_format, mipmaps, wrap, max_layers=self.max_layers)
+        arrays.append(array)
+        return array
+
+    def load(self,
+             filePath: str,
+             srgb: bool = False,
+             mipmaps: bool = True,
+             wrap: int = GL_REPEAT,
+             wait: bool = True) -> TextureLayer:
+        cache_path = mip_cache_path(filePath, srgb, True, mipmaps)
+        cached = read_mip_cache(cache_path, filePath)
+        if cached is not None and format_supported(cached[0]):
+            fmt, image = cached
+            array = self.array_for(image.size, fmt.internal_format, mipmaps, wrap)
+            future = Future()
+            future.set_result(image)
+        else:
+            # a small copy picks the format and the header gives the size,
+            # which together pick the array, before decoding
+            fmt = choose_format(image_mode(filePath), srgb)
+            array = self.array_for(image_size(filePath), fmt.internal_format, mipmaps, wrap)
+            future = image_loader.run(cook_image, filePath, fmt, True, array.levels, cache_path)
+        texture = TextureLayer(array, array.allocate())
+        self.pending[texture] = future
+        if wait:
+            self.finish(texture)
+        else:
+            array.clear(texture.layer)
+        return texture
+
+    def complete(self, texture: TextureLayer):
+        # the whole image now, skipping the streamer
+        future = self.pending.pop(texture, None)
+        image = future.result() if future is not None else self.streamer.cancel(texture)
+        if image is not None:
+            texture.array.upload(texture.layer, image)
+            texture.set_resident(0)
+
+    def finish(self, *textures: TextureLayer):
+        # blocks until the given textures, or all pending ones, are uploaded
+        for texture in textures or list(self.pending):
+            self.complete(texture)
+
+    def update(self) -> int:
+        # hands whatever finished decoding to the streamer, then streams
+        # this frame's share; returns the bytes uploaded
+        done = [texture for texture, future in self.pending.items() if future.done()]
+        for texture in done:
+            self.streamer.add(texture, self.pending.pop(texture).result())
+        return self.streamer.update()
+
+    @property
+    def queue_depth(self) -> int:
+        # textures still decoding or streaming
+        return len(self.pending) + len(self.streamer)
+
+    def ready(self, texture: TextureLayer) -> bool:
+        return texture.resident_level == 0
+
+    def free(self, texture: TextureLayer):
+        future = self.pending.pop(texture, None)
+        if future is not None:
+            future.cancel()
+        self.streamer.cancel(texture)
+        array = texture.array
+        array.free(texture.layer)
+        if not array.used:
+            # an empty array gives its memory back
+            array.release()
+            for key, arrays in self.arrays.items():
+                if array in arrays:
+                    arrays.remove(array)
+                    if not arrays:
+                        del self.arrays[key]
+                    break
+
+    def __len__(self) -> int:
+        return sum(len(arrays) for arrays in self.arrays.values())
+
+    def memory_usage(self) -> int:
+        return sum(array.memory_usage() for arrays in self.arrays.values() for array in arrays)
+
+    def release(self):
+        for arrays in self.arrays.values():
+            for array in arrays:
+                array.release()
+        self.arrays.clear()
+        self.streamer.release()
+
+
+class TextureCache:
+    # shares one layer between every material loading the same file with the
+    # same options. The key holds the resolved path and modification time, so
+    # an edited file is loaded again. Textures nobody references stay
+    # resident in least recently used order until they would push the cache
+    # past budget bytes.
+    def __init__(self, arrays: TextureArrays, budget: int):
+        self.arrays = arrays
+        self.budget = budget
+        self.textures: dict[tuple, TextureLayer] = {}
+        self.keys: dict[TextureLayer, tuple] = {}
+        self.ref_counts: dict[TextureLayer, int] = {}
+        self.unused: OrderedDict[TextureLayer, None] = OrderedDict()
+
+    @staticmethod
+    def make_key(filePath: str, srgb: bool, mipmaps: bool, wrap: int) -> tuple:
+        path = os.path.realpath(filePath)
+        return path, os.stat(path).st_mtime_ns, srgb, mipmaps, int(wrap)
+
+    def acquire(self,
+                filePath: str,
+                srgb: bool = False,
+                mipmaps: bool = True,
+                wrap: int = GL_REPEAT,
+                wait: bool = True) -> TextureLayer:
+        # wait=False returns before the image is decoded, the layer is filled
+        # by a later TextureArrays.update()
+        key = self.make_key(filePath, srgb, mipmaps, wrap)
+        texture = self.textures.get(key)
+        if texture is None:
+            texture = self.arrays.load(filePath, srgb, mipmaps, wrap, wait)
+            self.textures[key] = texture
+            self.keys[texture] = key
+            self.ref_counts[texture] = 0
+        elif wait:
+            self.arrays.finish(texture)
+        self.unused.pop(texture, None)
+        self.ref_counts[texture] += 1
+        self.trim()
+        return texture
+
+    def release(self, texture: TextureLayer):
+        if texture not in self.ref_counts:
+            return
+        self.ref_counts[texture] -= 1
+        if self.ref_counts[texture] <= 0:
+            self.unused[texture] = None
+            self.trim()
+
+    def trim(self):
+        # referenced textures are never evicted, even over budget
+        while self.unused and self.resident() > self.budget:
+            texture, _ = self.unused.popitem(last=False)
+            self.evict(texture)
+
+    def evict(self, texture: TextureLayer):
+        del self.textures[self.keys.pop(texture)]
+        del self.ref_counts[texture]
+        self.arrays.free(texture)
+
+    def clear(self):
+        # drops every unreferenced texture
+        while self.unused:
+            texture, _ = self.unused.popitem(last=False)
+            self.evict(texture)
+
+    def resident(self) -> int:
+        return sum(texture.array.layer_size for texture in self.textures.values())
+
+    def report(self) -> str:
+        mib = 1 << 20
+        return (
+            f"{len(self.textures)} textures ({len(self.unused)} unreferenced), "
+            f"{self.resident() / mib:.1f} of {self.budget / mib:.1f} MiB resident, "
+            f"{self.arrays.memory_usage() / mib:.1f} MiB allocated in {len(self.arrays)} arrays"
+        )
+
+    def __len__(self) -> int:
+        return len(self.textures)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.textures
+
+
+texture_arrays = TextureArrays()
+texture_cache = TextureCache(texture_arrays, TEXTURE_BUDGET)
@@ -0,0 +1,400 @@
+import glm, ctypes
+import numpy as np
+
+
+def quat_to_mat3(rotations: np.ndarray) -> np.ndarray:
+    # (N, 4) quaternions stored (w, x, y, z) like glm.quat to (N, 3, 3)
+    # rotation matrices indexed [row][column]
+    w, x, y, z = rotations.T
+    matrices = np.empty((len(rotations), 3, 3), dtype="float32")
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - w * z)
+    matrices[:, 0, 2] = 2 * (x * z + w * y)
+    matrices[:, 1, 0] = 2 * (x * y + w * z)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - w * x)
+    matrices[:, 2, 0] = 2 * (x * z - w * y)
+    matrices[:, 2, 1] = 2 * (y * z + w * x)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+
+def decompose(matrix: np.ndarray):
+    # splits a [row][column] matrix into position, rotation and scale, or
+    # returns None when it shears or projects and has no such form
+    if not np.allclose(matrix[3], (0, 0, 0, 1), atol=1e-6):
+        return None
+    basis = matrix[:3, :3]
+    scale = np.linalg.norm(basis, axis=0)
+    if (scale < 1e-12).any():
+        return None
+    if np.linalg.det(basis) < 0:
+        scale[0] = -scale[0]
+    rotation = basis / scale
+    if not np.allclose(rotation.T @ rotation, np.eye(3), atol=1e-4):
+        return None
+    quat = glm.quat_cast(glm.mat3(*rotation.T.ravel()))
+    return matrix[:3, 3].copy(), np.array((quat.w, quat.x, quat.y, quat.z), dtype="float32"), scale
+
+
+class TransformStore:
+    # position, rotation and scale of every node in contiguous arrays, plus
+    # the parent of each row. Rows edited since the last update get their
+    # local matrices composed in one vectorized pass, then world matrices are
+    # propagated level by level, touching only the subtrees below them.
+    # Matrices are indexed [row][column] like np.asarray(glm.mat4).
+    def __init__(self, capacity: int = 256):
+        self.count = 0
+        self.free_rows: list[int] = []
+        self.capacity = 0
+        # set whenever a row is dirtied, so clean frames return immediately
+        self.pending = False
+        # rows grouped by depth, rebuilt after the hierarchy changes
+        self.levels: list[np.ndarray] | None = None
+        self.depth = np.zeros(0, dtype="int32")
+        self.resize(capacity)
+
+    def resize(self, capacity: int):
+        def grow(array, fill):
+            grown = np.empty((capacity, *fill.shape), dtype=fill.dtype)
+            grown[:] = fill
+            if array is not None:
+                grown[:self.count] = array[:self.count]
+            return grown
+
+        current = self.capacity > 0
+        self.position = grow(self.position if current else None, np.zeros(3, dtype="float32"))
+        self.rotation = grow(self.rotation if current else None, np.array((1, 0, 0, 0), dtype="float32"))
+        self.scale = grow(self.scale if current else None, np.ones(3, dtype="float32"))
+        self.local = grow(self.local if current else None, np.eye(4, dtype="float32"))
+        self.local_normal = grow(self.local_normal if current else None, np.eye(3, dtype="float32"))
+        self.world = grow(self.world if current else None, np.eye(4, dtype="float32"))
+        self.normal = grow(self.normal if current else None, np.eye(3, dtype="float32"))
+        self.parent = grow(self.parent if current else None, np.array(-1, dtype="int32"))
+        self.dirty = grow(self.dirty if current else None, np.array(False))
+        self.alive = grow(self.alive if current else None, np.array(False))
+        # rows whose local matrix was assigned directly because it shears
+        self.raw = grow(self.raw if current else None, np.array(False))
+        self.capacity = capacity
+
+    def allocate(self) -> int:
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            if self.count == self.capacity:
+                self.resize(self.capacity * 2)
+            row = self.count
+            self.count += 1
+        self.position[row] = 0
+        self.rotation[row] = (1, 0, 0, 0)
+        self.scale[row] = 1
+        self.local[row] = np.eye(4)
+        self.local_normal[row] = np.eye(3)
+        self.world[row] = np.eye(4)
+        self.normal[row] = np.eye(3)
+        self.parent[row] = -1
+        self.dirty[row] = False
+        self.alive[row] = True
+        self.raw[row] = False
+        self.levels = None
+        return row
+
+    def free(self, row: int):
+        # children of a freed row become roots
+        children = self.children(row)
+        self.parent[children] = -1
+        self.dirty[children] = True
+        self.pending = self.pending or len(children) > 0
+        self.dirty[row] = False
+        self.alive[row] = False
+        self.levels = None
+        self.free_rows.append(row)
+
+    def touch(self, row: int):
+        self.dirty[row] = True
+        self.pending = True
+
+    def set_parent(self, row: int, parent: int):
+        ancestor = parent
+        while ancestor >= 0:
+            if ancestor == row:
+                raise ValueError(f"row {parent} is a descendant of row {row}")
+            ancestor = self.parent[ancestor]
+        self.parent[row] = parent
+        self.levels = None
+        self.touch(row)
+
+    def children(self, row: int) -> np.ndarray:
+        return np.flatnonzero((self.parent[:self.count] == row) & self.alive[:self.count])
+
+    def build_levels(self):
+        parent = self.parent[:self.count]
+        depth = np.zeros(self.count, dtype="int32")
+        # one pass per tree level, each row takes its parent's depth plus one
+        while True:
+            next_depth = np.where(parent >= 0, depth[parent] + 1, 0).astype("int32")
+            if np.array_equal(next_depth, depth):
+                break
+            depth = next_depth
+        self.depth = depth
+
+        alive = np.flatnonzero(self.alive[:self.count])
+        order = alive[np.argsort(depth[alive], kind="stable")]
+        counts = np.bincount(depth[alive]) if len(alive) else np.zeros(0, dtype=int)
+        self.levels = np.split(order, np.cumsum(counts)[:-1])
+
+    def compose(self, rows: np.ndarray):
+        raw = rows[self.raw[rows]]
+        if len(raw):
+            self.local_normal[raw] = np.linalg.inv(self.local[raw, :3, :3]).transpose(0, 2, 1)
+
+        rows = rows[~self.raw[rows]]
+        rotation = self.rotation[rows]
+        rotation /= np.linalg.norm(rotation, axis=1, keepdims=True)
+        self.rotation[rows] = rotation
+        basis = quat_to_mat3(rotation)
+        scale = self.scale[rows]
+
+        local = self.local[rows]
+        local[:, :3, :3] = basis * scale[:, None, :]
+        local[:, :3, 3] = self.position[rows]
+        self.local[rows] = local
+        # inverse transpose of rotation * scale is rotation / scale
+        self.local_normal[rows] = basis / scale[:, None, :]
+
+    def update(self) -> int:
+        # returns the number of world matrices that were recomputed
+        if not self.pending:
+            return 0
+        self.pending = False
+        if self.levels is None:
+            self.build_levels()
+
+        dirty = self.dirty[:self.count] & self.alive[:self.count]
+        rows = np.flatnonzero(dirty)
+        self.dirty[:self.count] = False
+        if len(rows) == 0:
+            return 0
+        self.compose(rows)
+
+        # breadth first: a row moves if it was edited or its parent moved.
+        # Inverse transposes multiply like the matrices themselves, so world
+        # normal matrices need no inverse either.
+        moved = dirty.copy()
+        deepest = self.depth[rows].max()
+        updated = 0
+        for depth, level in enumerate(self.levels):
+            if depth == 0:
+                rows = level[moved[level]]
+                self.world[rows] = self.local[rows]
+                self.normal[rows] = self.local_normal[rows]
+            else:
+                parents = self.parent[level]
+                selected = moved[level] | moved[parents]
+                rows, parents = level[selected], parents[selected]
+                moved[rows] = True
+                self.world[rows] = self.world[parents] @ self.local[rows]
+                self.normal[rows] = self.normal[parents] @ self.local_normal[rows]
+            updated += len(rows)
+            if len(rows) == 0 and depth >= deepest:
+                break
+        return updated
+
+    def refresh(self):
+        # for callers outside Scene.render that read a matrix directly
+        if self.pending:
+            self.update()
+
+    def world_pointer(self, row: int) -> ctypes.c_void_p:
+        # raw addresses skip PyOpenGL's numpy argument conversion per draw
+        return ctypes.c_void_p(self.world.ctypes.data + row * self.world.itemsize * 16)
+
+    def normal_pointer(self, row: int) -> ctypes.c_void_p:
+        return ctypes.c_void_p(self.normal.ctypes.data + row * self.normal.itemsize * 9)
+
+    def __len__(self) -> int:
+        return self.count - len(self.free_rows)
+
+
+class Transform:
+    # a thin view of one row of a TransformStore. Assigning a component marks
+    # the row dirty; the matrices are rebuilt by the next store update.
+    def __init__(self, store: TransformStore):
+        self.store = store
+        self.row = store.allocate()
+        self._parent = None
+        # kept so a release can let go of both sides of the link
+        self._children: set[Transform] = set()
+
+    @property
+    def position(self) -> glm.vec3:
+        if self.store.raw[self.row]:
+            return glm.vec3(*self.store.local[self.row, :3, 3])
+        return glm.vec3(*self.store.position[self.row])
+
+    @position.setter
+    def position(self, value: glm.vec3):
+        if self.store.raw[self.row]:
+            self.store.local[self.row, :3, 3] = value
+        self.store.position[self.row] = value
+        self.store.touch(self.row)
+
+    @property
+    def rotation(self) -> glm.quat:
+        return glm.quat(*self.store.rotation[self.row])
+
+    @rotation.setter
+    def rotation(self, value: glm.quat):
+        self.set_components(rotation=(value.w, value.x, value.y, value.z))
+
+    @property
+    def scale(self) -> glm.vec3:
+        return glm.vec3(*self.store.scale[self.row])
+
+    @scale.setter
+    def scale(self, value: glm.vec3):
+        self.set_components(scale=value)
+
+    @property
+    def parent(self) -> "Transform | None":
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent: "Transform | None"):
+        if parent is not None and parent.store is not self.store:
+            raise ValueError("parent belongs to a different transform store")
+        self.store.set_parent(self.row, parent.row if parent is not None else -1)
+        if self._parent is not None:
+            self._parent._children.discard(self)
+        if parent is not None:
+            parent._children.add(self)
+        self._parent = parent
+
+    @property
+    def matrix(self) -> glm.mat4:
+        # local matrix, relative to the parent
+        if self.store.dirty[self.row]:
+            self.store.update()
+        return glm.mat4(self.store.local[self.row])
+
+    @matrix.setter
+    def matrix(self, value: glm.mat4):
+        self.set_matrix(np.asarray(value, dtype="float32"))
+
+    @property
+    def world_matrix(self) -> glm.mat4:
+        self.store.refresh()
+        return glm.mat4(self.store.world[self.row])
+
+    @property
+    def normal_matrix(self) -> np.ndarray:
+        self.store.refresh()
+        return self.store.normal[self.row]
+
+    def set_components(self, position=None, rotation=None, scale=None):
+        # a sheared row drops the shear and goes back to plain components
+        store, row = self.store, self.row
+        if position is not None:
+            store.position[row] = position
+        if rotation is not None:
+            store.rotation[row] = rotation
+        if scale is not None:
+            store.scale[row] = scale
+        store.raw[row] = False
+        store.touch(row)
+
+    def set_matrix(self, matrix: np.ndarray):
+        store, row = self.store, self.row
+        components = decompose(matrix)
+        if components is None:
+            store.local[row] = matrix
+            store.raw[row] = True
+        else:
+            store.position[row], store.rotation[row], store.scale[row] = components
+            store.raw[row] = False
+        store.touch(row)
+
+    def translate(self, offset: glm.vec3):
+        # in local space, like glm.translate(matrix, offset)
+        if self.store.raw[self.row]:
+            local = self.store.local[self.row]
+            local[:3, 3] += local[:3, :3] @ np.asarray(offset, dtype="float32")
+            self.store.touch(self.row)
+        else:
+            self.position = self.position + self.rotation * (self.scale * offset)
+        return self
+
+    def scale_by(self, scalers: glm.vec3):
+        if self.store.raw[self.row]:
+            self.store.local[self.row, :3, :3] *= np.asarray(scalers, dtype="float32")
+        else:
+            self.store.scale[self.row] *= scalers
+        self.store.touch(self.row)
+        return self
+
+    def rotate(self, rotation: glm.quat):
+        scale = self.store.scale[self.row]
+        if self.store.raw[self.row] or not np.allclose(scale, scale[0]):
+            # rotating after a non-uniform scale shears, only a matrix holds that
+            self.set_matrix(np.asarray(self.matrix * glm.mat4_cast(rotation), dtype="float32"))
+        else:
+            self.rotation = self.rotation * rotation
+        return self
+
+    def snapshot(self):
+        return self.store.raw[self.row], self.matrix, self.position, self.rotation, self.scale
+
+    def restore(self, snapshot):
+        raw, matrix, position, rotation, scale = snapshot
+        if raw:
+            self.matrix = matrix
+        else:
+            self.set_components(position, (rotation.w, rotation.x, rotation.y, rotation.z), scale)
+
+    def release(self):
+        # the children become roots, as they do in the store
+        for child in self._children:
+            child._parent = None
+        self._children.clear()
+        if self._parent is not None:
+            self._parent._children.discard(self)
+            self._parent = None
+        self.store.free(self.row)
+
+
+transforms = TransformStore()
+
+
+class Node:
+    # anything placed in the scene graph. A bare Node has no geometry and is
+    # never drawn, it groups children or serves as a pivot.
+    def __init__(self, store: TransformStore = transforms):
+        self.transform = Transform(store)
+
+    @property
+    def model_matrix(self) -> glm.mat4:
+        return self.transform.matrix
+
+    @model_matrix.setter
+    def model_matrix(self, value: glm.mat4):
+        self.transform.matrix = value
+
+    def translate(self, pos: glm.vec3):
+        self.transform.translate(pos)
+        return self
+
+    def scale(self, scalers: glm.vec3):
+        self.transform.scale_by(scalers)
+        return self
+
+    def rotate(self, angles: glm.vec3):
+        angles = glm.radians(angles)
+        self.transform.rotate(
+            glm.angleAxis(angles.x, glm.vec3(1, 0, 0))
+            * glm.angleAxis(angles.y, glm.vec3(0, 1, 0))
+            * glm.angleAxis(angles.z, glm.vec3(0, 0, 1))
+        )
+        return self
+
+    def release(self):
+        self.transform.release()
@@ -0,0 +1,152 @@
+from OpenGL.GL import *
+
+from modules.shaders import programs, get_uniforms
+from modules.renderqueue import GLState
+from config import SHADERS_DIR
+
+# (depth bits, stencil bits, float) of the target framebuffer -> renderbuffer format
+DEPTH_FORMATS = {
+    (16, 0, False): GL_DEPTH_COMPONENT16,
+    (24, 0, False): GL_DEPTH_COMPONENT24,
+    (32, 0, False): GL_DEPTH_COMPONENT32,
+    (32, 0, True): GL_DEPTH_COMPONENT32F,
+    (24, 8, False): GL_DEPTH24_STENCIL8,
+    (32, 8, True): GL_DEPTH32F_STENCIL8,
+}
+
+
+class WeightedBlendedOIT:
+    # weighted blended order independent transparency (McGuire and Bavoil,
+    # 2013). Translucent surfaces add their weighted premultiplied colour into
+    # an RGBA16F target and multiply their coverage into an R8 revealage
+    # target, then one full screen pass blends the average over the opaque
+    # image. Nothing is sorted, which keeps thousands of overlapping instances
+    # cheap; the price is an approximate order where layers are close in depth.
+    def __init__(self):
+        self.framebuffer = glGenFramebuffers(1)
+        self.accum = None
+        self.revealage = None
+        self.depth = None
+        self.size = None
+        self.depth_format = None
+        self.target = 0
+        self.viewport = (0, 0, 0, 0)
+        self.multisampled = False
+
+        self.vao = glGenVertexArrays(1)
+        self.shaderProgram = programs.acquire(f"{SHADERS_DIR}/vs_screen.glsl", f"{SHADERS_DIR}/fs_oit_composite.glsl")
+        uniforms = get_uniforms(self.shaderProgram)
+        glProgramUniform1i(self.shaderProgram, uniforms["accum"], 0)
+        glProgramUniform1i(self.shaderProgram, uniforms["revealage"], 1)
+
+    def target_depth_format(self):
+        # the opaque depth is blitted over, which needs identical formats
+        read = glGetIntegerv(GL_READ_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.target)
+        attachment = GL_DEPTH if self.target == 0 else GL_DEPTH_ATTACHMENT
+        depth_format = None
+        if glGetFramebufferAttachmentParameteriv(GL_READ_FRAMEBUFFER, attachment, GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE) != GL_NONE:
+            bits = glGetFramebufferAttachmentParameteriv(GL_READ_FRAMEBUFFER, attachment, GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE)
+            stencil = glGetFramebufferAttachmentParameteriv(GL_READ_FRAMEBUFFER, attachment, GL_FRAMEBUFFER_ATTACHMENT_STENCIL_SIZE)
+            kind = glGetFramebufferAttachmentParameteriv(GL_READ_FRAMEBUFFER, attachment, GL_FRAMEBUFFER_ATTACHMENT_COMPONENT_TYPE)
+            depth_format = DEPTH_FORMATS.get((int(bits), int(stencil), kind == GL_FLOAT), GL_DEPTH_COMPONENT24)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, read)
+        return depth_format
+
+    def prepare(self) -> bool:
+        # called before the queue is filled; False when the bound framebuffer
+        # cannot be used and translucent objects have to be sorted instead
+        self.target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        if glGetIntegerv(GL_SAMPLES) > 0:
+            if not self.multisampled:
+                print("Weighted blended transparency needs a single sampled framebuffer, sorting instead")
+                self.multisampled = True
+            return False
+
+        self.viewport = tuple(int(value) for value in glGetIntegerv(GL_VIEWPORT))
+        x, y, width, height = self.viewport
+        size = (x + width, y + height)
+        depth_format = self.target_depth_format()
+        if (size, depth_format) != (self.size, self.depth_format):
+            self.allocate(size, depth_format)
+        return True
+
+    def allocate(self, size: tuple[int, int], depth_format: int):
+        self.delete_targets()
+        self.size = size
+        self.depth_format = depth_format
+        width, height = size
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        self.accum = glGenTextures(1)
+        self.revealage = glGenTextures(1)
+        for attachment, texture, internal_format in (
+            (GL_COLOR_ATTACHMENT0, self.accum, GL_RGBA16F),
+            (GL_COLOR_ATTACHMENT1, self.revealage, GL_R8),
+        ):
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexStorage2D(GL_TEXTURE_2D, 1, internal_format, width, height)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, attachment, GL_TEXTURE_2D, texture, 0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        self.depth = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, depth_format or GL_DEPTH_COMPONENT24, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        stencil = depth_format in (GL_DEPTH24_STENCIL8, GL_DEPTH32F_STENCIL8)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT if stencil else GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+
+        glDrawBuffers(2, (GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1))
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            print("Weighted blended transparency framebuffer is incomplete")
+        glBindFramebuffer(GL_FRAMEBUFFER, self.target)
+
+    def begin(self, state: GLState):
+        x, y, width, height = self.viewport
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.target)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.framebuffer)
+        state.depth_mask(True)
+        if self.depth_format is not None:
+            glBlitFramebuffer(x, y, x + width, y + height, x, y, x + width, y + height, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+        else:
+            glClearBufferfv(GL_DEPTH, 0, (1.0,))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glClearBufferfv(GL_COLOR, 0, (0.0, 0.0, 0.0, 0.0))
+        glClearBufferfv(GL_COLOR, 1, (1.0, 0.0, 0.0, 0.0))
+
+        # colour adds up, revealage multiplies by (1 - alpha)
+        state.depth_mask(False)
+        state.blend(True)
+        glBlendFunci(0, GL_ONE, GL_ONE)
+        glBlendFunci(1, GL_ZERO, GL_ONE_MINUS_SRC_COLOR)
+
+    def composite(self, state: GLState):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.target)
+        depth_test = glIsEnabled(GL_DEPTH_TEST)
+        glDisable(GL_DEPTH_TEST)
+        state.blend(True)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+        state.use_program(self.shaderProgram)
+        state.bind_vertex_array(self.vao)
+        state.bind_texture(0, GL_TEXTURE_2D, self.accum)
+        state.bind_texture(1, GL_TEXTURE_2D, self.revealage)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+        state.count("draw calls")
+
+        if depth_test:
+            glEnable(GL_DEPTH_TEST)
+
+    def delete_targets(self):
+        if self.accum is not None:
+            glDeleteTextures(2, (self.accum, self.revealage))
+            glDeleteRenderbuffers(1, (self.depth,))
+        self.accum = self.revealage = self.depth = None
+
+    def release(self):
+        self.delete_targets()
+        glDeleteFramebuffers(1, (self.framebuffer,))
+        glDeleteVertexArrays(1, (self.vao,))
+        programs.release(self.shaderProgram)
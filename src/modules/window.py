@@ -1,6 +1,7 @@
 import glfw, glm
 from OpenGL.GL import *
 from modules.scene import Scene
+from modules.textures import texture_cache
 
 
 class Window:
@@ -110,6 +111,9 @@ class Window:
         if self.keys[glfw.KEY_SPACE]:
             self.animation_mode = not self.animation_mode
 
+        if self.keys[glfw.KEY_T] and action == glfw.PRESS:
+            print("Textures:", texture_cache.report())
+
         if self.keys[glfw.KEY_W]:
             self.scene.camera.position += camera_speed * self.scene.camera.target
 
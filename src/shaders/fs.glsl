@@ -1,14 +1,19 @@
 #version 440 core
 
-#define NUM_DIRLIGHTS 1
-#define NUM_POINTLIGHTS 1
-#define NUM_SPOTLIGHTS 2
-
+#ifdef WEIGHTED_OIT
+// order independent transparency targets, see modules/transparency.py
+layout(location = 0) out vec4 Accum;
+layout(location = 1) out float Revealage;
+vec4 FragColor;
+#else
 out vec4 FragColor;
+#endif
 
 in vec3 FragPos;
 in vec3 Normal;
 
+// std430: the float members fill the padding after each vec3, keep the
+// order in sync with the light dtypes in modules/buffers.py
 struct DirLight
 {
     vec3 direction;
@@ -20,30 +25,27 @@ struct DirLight
 struct PointLight
 {
     vec3 position;
+    float constant;
 
     vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-
-    float constant;
     float linear;
+    vec3 diffuse;
     float quadratic;
+    vec3 specular;
 };
 
 struct SpotLight
 {
     vec3 position;
+    float constant;
     vec3 direction;
+    float linear;
 
     vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-
-    float constant;
-    float linear;
     float quadratic;
-
+    vec3 diffuse;
     float cutOff;
+    vec3 specular;
     float outerCutOff;
 };
 
@@ -58,11 +60,44 @@ struct Material
     float refractive_index;
 };
 
-uniform vec3 viewPos;
-uniform DirLight[NUM_DIRLIGHTS] dirlights;
-uniform PointLight[NUM_POINTLIGHTS] pointlights;
-uniform SpotLight[NUM_SPOTLIGHTS] spotlights;
-uniform Material material;
+layout(std140, binding = 0) uniform FrameData
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+    float time;
+    vec2 resolution;
+    int numDirLights;
+    int numPointLights;
+    int numSpotLights;
+};
+
+layout(std430, binding = 0) readonly buffer DirLights
+{
+    DirLight dirlights[];
+};
+layout(std430, binding = 1) readonly buffer PointLights
+{
+    PointLight pointlights[];
+};
+layout(std430, binding = 2) readonly buffer SpotLights
+{
+    SpotLight spotlights[];
+};
+
+// every Material, see MaterialTable in modules/buffers.py. std430:
+// shininess fills the padding after specular
+layout(std430, binding = 3) readonly buffer Materials
+{
+    Material materials[];
+};
+
+#ifdef INSTANCED
+flat in int MaterialIndex;
+#else
+uniform int materialIndex;
+#endif
+Material material;
 uniform samplerCube skybox;
 
 vec3 calcDirLight(DirLight light, vec3 normal, vec3 viewDir);
@@ -71,22 +106,27 @@ vec3 calcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
 
 void main()
 {
+#ifdef INSTANCED
+    material = materials[MaterialIndex];
+#else
+    material = materials[materialIndex];
+#endif
     vec3 norm = normalize(Normal);
     vec3 viewDir = normalize(viewPos - FragPos);
     
     vec3 result = vec3(0);
 
-    for(int i = 0; i < NUM_DIRLIGHTS; i++)
+    for(int i = 0; i < numDirLights; i++)
     {
         result += calcDirLight(dirlights[i], norm, viewDir);
     }
 
-    for(int i = 0; i < NUM_POINTLIGHTS; i++)
+    for(int i = 0; i < numPointLights; i++)
     {
         result += calcPointLight(pointlights[i], norm, FragPos, viewDir);
     }
 
-    for(int i = 0; i < NUM_SPOTLIGHTS; i++)
+    for(int i = 0; i < numSpotLights; i++)
     {
         result += calcSpotLight(spotlights[i], norm, FragPos, viewDir);
     }
@@ -111,6 +151,14 @@ void main()
         float gamma = 2.2;
         FragColor.rgb = pow(FragColor.rgb, vec3(1.0 / gamma));
     }
+
+#ifdef WEIGHTED_OIT
+    // depth weight from McGuire and Bavoil, equation 10
+    float alpha = FragColor.a;
+    float weight = clamp(pow(min(1.0, alpha * 10.0) + 0.01, 3.0) * 1e8 * pow(1.0 - gl_FragCoord.z * 0.9, 3.0), 1e-2, 3e3);
+    Accum = vec4(FragColor.rgb * alpha, alpha) * weight;
+    Revealage = alpha;
+#endif
 }
 
 // calculates the color when using a directional light.
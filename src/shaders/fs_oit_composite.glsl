@@ -0,0 +1,21 @@
+#version 440 core
+
+out vec4 FragColor;
+
+uniform sampler2D accum;
+uniform sampler2D revealage;
+
+void main()
+{
+    ivec2 coords = ivec2(gl_FragCoord.xy);
+    float reveal = texelFetch(revealage, coords, 0).r;
+    if (reveal == 1.0)
+        discard;
+
+    vec4 sum = texelFetch(accum, coords, 0);
+    // overflowed half floats would turn the average into nan
+    if (isinf(max(max(abs(sum.r), abs(sum.g)), abs(sum.b))))
+        sum.rgb = vec3(sum.a);
+
+    FragColor = vec4(sum.rgb / max(sum.a, 1e-5), 1.0 - reveal);
+}
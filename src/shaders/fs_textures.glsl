@@ -1,15 +1,13 @@
 #version 440 core
 
-#define NUM_DIRLIGHTS 1
-#define NUM_POINTLIGHTS 1
-#define NUM_SPOTLIGHTS 2
-
 out vec4 FragColor;
 
 in vec2 TexCoords;
 in vec3 FragPos;
 in vec3 Normal;
 
+// std430: the float members fill the padding after each vec3, keep the
+// order in sync with the light dtypes in modules/buffers.py
 struct DirLight
 {
     vec3 direction;
@@ -21,67 +19,112 @@ struct DirLight
 struct PointLight
 {
     vec3 position;
+    float constant;
 
     vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-
-    float constant;
     float linear;
+    vec3 diffuse;
     float quadratic;
+    vec3 specular;
 };
 
 struct SpotLight
 {
     vec3 position;
+    float constant;
     vec3 direction;
+    float linear;
 
     vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-
-    float constant;
-    float linear;
     float quadratic;
-
+    vec3 diffuse;
     float cutOff;
+    vec3 specular;
     float outerCutOff;
 };
 
+// layers in the texture arrays bound to units 0 and 1, see
+// texture_material_dtype in modules/buffers.py. The lods are the finest mip
+// levels streamed in so far
 struct Material
 {
-    sampler2D diffuse;
-    sampler2D specular;
+    int diffuse;
+    int specular;
     float shininess;
+    float diffuseLod;
+    float specularLod;
 };
 
-uniform vec3 viewPos;
-uniform DirLight[NUM_DIRLIGHTS] dirlights;
-uniform PointLight[NUM_POINTLIGHTS] pointlights;
-uniform SpotLight[NUM_SPOTLIGHTS] spotlights;
-uniform Material material;
+layout(std140, binding = 0) uniform FrameData
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+    float time;
+    vec2 resolution;
+    int numDirLights;
+    int numPointLights;
+    int numSpotLights;
+};
+
+layout(std430, binding = 0) readonly buffer DirLights
+{
+    DirLight dirlights[];
+};
+layout(std430, binding = 1) readonly buffer PointLights
+{
+    PointLight pointlights[];
+};
+layout(std430, binding = 2) readonly buffer SpotLights
+{
+    SpotLight spotlights[];
+};
+
+layout(std430, binding = 4) readonly buffer TextureMaterials
+{
+    Material materials[];
+};
+
+#ifdef INSTANCED
+flat in int MaterialIndex;
+#else
+uniform int materialIndex;
+#endif
+Material material;
+layout(binding = 0) uniform sampler2DArray diffuseMaps;
+layout(binding = 1) uniform sampler2DArray specularMaps;
+vec3 diffuseTexel;
+vec3 specularTexel;
 uniform samplerCube skybox;
 
+vec3 sampleLayer(sampler2DArray maps, int layer, float minLod);
 vec3 calcDirLight(DirLight light, vec3 normal, vec3 viewDir);
 vec3 calcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
 vec3 calcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
 
 void main()
 {
+#ifdef INSTANCED
+    material = materials[MaterialIndex];
+#else
+    material = materials[materialIndex];
+#endif
+    diffuseTexel = sampleLayer(diffuseMaps, material.diffuse, material.diffuseLod);
+    specularTexel = sampleLayer(specularMaps, material.specular, material.specularLod);
     vec3 norm = normalize(Normal);
     vec3 viewDir = normalize(viewPos - FragPos);
     
     vec3 result = vec3(0);
 
-    for(int i = 0; i < NUM_DIRLIGHTS; i++){
+    for(int i = 0; i < numDirLights; i++){
         result += calcDirLight(dirlights[i], norm, viewDir);
     }
 
-    for(int i = 0; i < NUM_POINTLIGHTS; i++){
+    for(int i = 0; i < numPointLights; i++){
         result += calcPointLight(pointlights[i], norm, FragPos, viewDir);
     }
 
-    for(int i = 0; i < NUM_SPOTLIGHTS; i++){
+    for(int i = 0; i < numSpotLights; i++){
         result += calcSpotLight(spotlights[i], norm, FragPos, viewDir);
     }
     
@@ -101,6 +144,13 @@ void main()
     }
 }
 
+// the mip level the hardware would pick, but no finer than what is resident
+vec3 sampleLayer(sampler2DArray maps, int layer, float minLod)
+{
+    float lod = max(textureQueryLod(maps, TexCoords).x, minLod);
+    return textureLod(maps, vec3(TexCoords, layer), lod).rgb;
+}
+
 // calculates the color when using a directional light.
 vec3 calcDirLight(DirLight light, vec3 normal, vec3 viewDir)
 {
@@ -116,9 +166,9 @@ vec3 calcDirLight(DirLight light, vec3 normal, vec3 viewDir)
     // float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
 
     // combine results
-    vec3 ambient = light.ambient * vec3(texture(material.diffuse, TexCoords));
-    vec3 diffuse = light.diffuse * diff * vec3(texture(material.diffuse, TexCoords));
-    vec3 specular = light.specular * spec * vec3(texture(material.specular, TexCoords));
+    vec3 ambient = light.ambient * diffuseTexel;
+    vec3 diffuse = light.diffuse * diff * diffuseTexel;
+    vec3 specular = light.specular * spec * specularTexel;
     return (ambient + diffuse + specular);
 }
 
@@ -141,9 +191,9 @@ vec3 calcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
     float attenuation = 1.0 / (light.constant + light.linear * distance + light.quadratic * (distance * distance));
 
     // combine results
-    vec3 ambient = light.ambient * vec3(texture(material.diffuse, TexCoords));
-    vec3 diffuse = light.diffuse * diff * vec3(texture(material.diffuse, TexCoords));
-    vec3 specular = light.specular * spec * vec3(texture(material.specular, TexCoords));
+    vec3 ambient = light.ambient * diffuseTexel;
+    vec3 diffuse = light.diffuse * diff * diffuseTexel;
+    vec3 specular = light.specular * spec * specularTexel;
     ambient *= attenuation;
     diffuse *= attenuation;
     specular *= attenuation;
@@ -174,9 +224,9 @@ vec3 calcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
     float intensity = clamp((theta - light.outerCutOff) / epsilon, 0.0, 1.0);
     
     // combine results
-    vec3 ambient = light.ambient * vec3(texture(material.diffuse, TexCoords));
-    vec3 diffuse = light.diffuse * diff * vec3(texture(material.diffuse, TexCoords));
-    vec3 specular = light.specular * spec * vec3(texture(material.specular, TexCoords));
+    vec3 ambient = light.ambient * diffuseTexel;
+    vec3 diffuse = light.diffuse * diff * diffuseTexel;
+    vec3 specular = light.specular * spec * specularTexel;
     ambient *= attenuation;
     diffuse *= attenuation * intensity;
     specular *= attenuation * intensity;
@@ -8,14 +8,40 @@ out vec2 TexCoords;
 out vec3 FragPos;
 out vec3 Normal;
 
+layout(std140, binding = 0) uniform FrameData
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+    float time;
+    vec2 resolution;
+    int numDirLights;
+    int numPointLights;
+    int numSpotLights;
+};
+
+#ifdef INSTANCED
+// per-instance attributes, see InstancedModel in modules/model.py
+layout(location = 3) in mat4 aModel;
+layout(location = 7) in mat3 aNormalMatrix;
+layout(location = 10) in int aMaterialIndex;
+
+flat out int MaterialIndex;
+#else
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+// inverse transpose of the upper 3x3 of model, from the transform store
+uniform mat3 normalMatrix;
+#endif
 
 void main()
 {
+#ifdef INSTANCED
+    mat4 model = aModel;
+    mat3 normalMatrix = aNormalMatrix;
+    MaterialIndex = aMaterialIndex;
+#endif
     FragPos = vec3(model * vec4(aPos, 1.0));
     TexCoords = aTexCoords;
-    Normal = mat3(transpose(inverse(model))) * aNormal;
+    Normal = normalMatrix * aNormal;
     gl_Position = projection * view * vec4(FragPos, 1.0);
 }
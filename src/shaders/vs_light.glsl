@@ -2,12 +2,29 @@
 
 layout (location = 0) in vec3 aPos;
 
-uniform mat4 projection;
-uniform mat4 view;
+layout(std140, binding = 0) uniform FrameData
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+    float time;
+    vec2 resolution;
+    int numDirLights;
+    int numPointLights;
+    int numSpotLights;
+};
+
+#ifdef INSTANCED
+layout(location = 3) in mat4 aModel;
+#else
 uniform mat4 model;
+#endif
 
 void main()
 {
+#ifdef INSTANCED
+    mat4 model = aModel;
+#endif
     gl_Position = projection * view * model * vec4(aPos, 1.0);
     
 }
\ No newline at end of file
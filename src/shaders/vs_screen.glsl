@@ -0,0 +1,8 @@
+#version 440 core
+
+// one triangle covering the screen, drawn without a vertex buffer
+void main()
+{
+    vec2 position = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2) * 2.0 - 1.0;
+    gl_Position = vec4(position, 0.0, 1.0);
+}
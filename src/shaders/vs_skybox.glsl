@@ -4,12 +4,22 @@ layout (location = 0) in vec3 aPos;
 
 out vec3 TexCoords;
 
-uniform mat4 projection;
-uniform mat4 view;
+layout(std140, binding = 0) uniform FrameData
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+    float time;
+    vec2 resolution;
+    int numDirLights;
+    int numPointLights;
+    int numSpotLights;
+};
 
 void main()
 {
     TexCoords = aPos;
-    vec4 pos = projection * view * vec4(aPos, 1.0);
+    // drop the translation so the box stays centred on the camera
+    vec4 pos = projection * mat4(mat3(view)) * vec4(aPos, 1.0);
     gl_Position = pos.xyww;
 }
\ No newline at end of file
@@ -0,0 +1,62 @@
+# cd src && python -m pytest tests
+import numpy as np
+
+from modules import meshopt
+from modules.meshopt import reorder_triangles, reorder_vertices
+
+
+def grid(size: int) -> tuple[np.ndarray, np.ndarray]:
+    y, x = np.mgrid[0:size, 0:size]
+    positions = np.stack([x.ravel(), y.ravel(), np.sin(x.ravel() * 0.3)], axis=1).astype("float32")
+    corner = (y[:-1, :-1] * size + x[:-1, :-1]).ravel()
+    triangles = np.concatenate([
+        np.stack([corner, corner + 1, corner + size + 1], axis=1),
+        np.stack([corner, corner + size + 1, corner + size], axis=1),
+    ])
+    return positions, triangles
+
+
+def canonical(triangles: np.ndarray) -> np.ndarray:
+    # each triangle rotated to start at its smallest index, winding kept, so
+    # a reorder that only moves whole triangles compares equal
+    rotated = np.stack([np.roll(row, -int(np.argmin(row))) for row in triangles])
+    return rotated[np.lexsort(rotated.T[::-1])]
+
+
+def assert_permutation(before: np.ndarray, after: np.ndarray):
+    assert after.shape == before.shape
+    assert np.array_equal(canonical(after), canonical(before))
+
+
+def test_reorder_keeps_every_triangle():
+    positions, triangles = grid(12)
+    shuffled = triangles[np.random.default_rng(0).permutation(len(triangles))]
+    assert_permutation(shuffled, reorder_triangles(shuffled, positions))
+
+
+def test_reorder_keeps_degenerate_and_duplicate_triangles():
+    positions, triangles = grid(9)
+    rng = np.random.default_rng(1)
+    vertices = rng.integers(0, len(positions), size=(20, 2))
+    degenerate = np.concatenate([
+        np.stack([vertices[:10, 0], vertices[:10, 0], vertices[:10, 1]], axis=1),
+        np.stack([vertices[10:15, 0], vertices[10:15, 1], vertices[10:15, 1]], axis=1),
+        np.repeat(vertices[15:, :1], 3, axis=1),
+    ])
+    mesh = np.concatenate([triangles, degenerate, triangles[:10]])
+    mesh = mesh[rng.permutation(len(mesh))]
+    assert_permutation(mesh, reorder_triangles(mesh, positions))
+
+
+def test_reorder_across_clusters(monkeypatch):
+    monkeypatch.setattr(meshopt, "CLUSTER_SIZE", 32)
+    positions, triangles = grid(16)
+    mesh = np.concatenate([triangles, triangles[:40, [0, 0, 1]]])
+    assert_permutation(mesh, reorder_triangles(mesh, positions))
+
+
+def test_reorder_vertices_remaps_every_index():
+    positions, triangles = grid(6)
+    order, remap = reorder_vertices(triangles.ravel(), len(positions))
+    assert np.array_equal(np.sort(order), np.arange(len(positions)))
+    assert np.array_equal(order[remap[triangles]], triangles)